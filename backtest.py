@@ -0,0 +1,526 @@
+"""
+Columnar backtesting engine for signal histories.
+
+Signals are loaded into NumPy arrays (one line per signal, e.g.
+"EURUSD;10:05;COMPRA ✅ WIN G") and the balance path is computed with
+either rules:
+- "live": the MoneyManager of the bot, driven with the events each signal
+  would produce in production
+- "legacy": the SOROS and GALE rules of the original simulator loop
+  (optionally with CYCLE LOSS), fully vectorized when neither is enabled
+  and with a tight kernel over the arrays otherwise (compiled with numba
+  when it is installed)
+
+Signal files are streamed in batches into a fixed-width record cache
+(<file>.npy, next to the source) which later runs memory-map instead of
+parsing the text again
+"""
+from typing import NamedTuple
+from itertools import islice
+from os import stat, replace, getenv
+import json
+import numpy as np
+from dotenv import load_dotenv
+from money import MoneyManager
+
+load_dotenv()
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+CALL, PUT = 0, 1
+# SKIPPED signals came after a STOP WIN or STOP LOSS of their day
+SKIPPED, LOSS, WIN = -1, 0, 1
+
+# "live" (the bot's MoneyManager) or "legacy" (the original simulator loop),
+# the default of every entry point
+RULES = getenv('SIMULATOR_RULES', 'live')
+# days simulated at a time by iter_simulate
+CHUNK_DAYS = 30
+# lines parsed at a time while streaming a signal file
+BATCH_SIZE = 65536
+# bump when RECORD changes so older caches are rebuilt
+CACHE_VERSION = 1
+
+
+class Signals(NamedTuple):
+    pair: np.ndarray    # 'S10' pair name
+    slot: np.ndarray    # int16 minute of the day of the start time
+    action: np.ndarray  # int8 CALL or PUT
+    result: np.ndarray  # int8 WIN or LOSS
+    gales: np.ndarray   # int8 gales needed by the signal (0 to 2)
+    day: np.ndarray     # int32 day index, increased every time the start time goes back
+
+
+# one signal of the cache file
+RECORD = np.dtype([('pair', 'S10'), ('slot', np.int16), ('action', np.int8),
+                   ('result', np.int8), ('gales', np.int8), ('day', np.int32)])
+
+
+class Params(NamedTuple):
+    base_order: float = 0.02
+    gale_rate: float = 2.2
+    payout: float = 0.8
+    max_gales: int = 1
+    soros_holding: float = 0.1
+    max_soros: int = 3
+    cycle_loss: bool = False
+    # profit and loss (percentage of the day's initial balance) that stop the day, 0 to disable
+    stop_win: float = 0.0
+    stop_loss: float = 0.0
+
+
+class Result(NamedTuple):
+    pnl: np.ndarray      # balance change of each signal
+    # WIN, LOSS (a WIN after too many gales is a LOSS) or SKIPPED (also every signal after going broke)
+    result: np.ndarray
+    gales: np.ndarray    # gales used by each signal
+    balance: np.ndarray  # balance after each signal
+    final_balance: float
+    stops: np.ndarray    # WIN, LOSS or SKIPPED (no stop) for every day
+
+
+def parse_lines(lines, day=0, previous_slot=None):
+    """
+    Parses the signal lines into columns with vectorized string operations.
+    day and previous_slot continue the day index of a previous batch
+    """
+    text = np.array(lines, dtype='U')
+    if text.size == 0:
+        return as_signals(np.empty(0, RECORD))
+
+    chars = text.view(np.uint32).reshape(len(text), -1)
+    digits = chars[:, 7:12].astype(np.int16) - ord('0')
+    slot = (digits[:, 0] * 10 + digits[:, 1]) * 60 + digits[:, 3] * 10 + digits[:, 4]
+
+    # gales are the "G"s in the last two characters of the line
+    length = np.char.str_len(text)
+    rows = np.arange(len(text))
+    gales = (chars[rows, length - 1] == ord('G')).astype(np.int8) + \
+        (chars[rows, np.maximum(length - 2, 0)] == ord('G')).astype(np.int8)
+
+    went_back = np.diff(slot, prepend=slot[0] if previous_slot is None else previous_slot) < 0
+    days = (day + np.cumsum(went_back)).astype(np.int32)
+
+    return Signals(
+        pair=np.char.encode(text.astype('U6')).astype('S10'),
+        slot=slot.astype(np.int16),
+        action=np.where(np.char.find(text, 'COMPRA') >= 0,
+                        CALL, PUT).astype(np.int8),
+        result=(np.char.find(text, 'WIN') >= 0).astype(np.int8),
+        gales=gales,
+        day=days)
+
+
+def as_signals(records):
+    """ Column views of a RECORD array """
+    return Signals(*(records[field] for field in Signals._fields))
+
+
+def iter_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line:
+                yield line
+
+
+def iter_batches(lines, size=BATCH_SIZE):
+    """ Parses the lines in batches of Signals, keeping the day index going across batches """
+    lines = iter(lines)
+    (day, previous_slot) = (0, None)
+    while True:
+        batch = list(islice(lines, size))
+        if not batch:
+            return
+        signals = parse_lines(batch, day, previous_slot)
+        (day, previous_slot) = (int(signals.day[-1]), int(signals.slot[-1]))
+        yield signals
+
+
+def read_records(path, records):
+    """ Streams the signals of the file into the records array """
+    position = 0
+    for batch in iter_batches(iter_lines(path)):
+        end = position + len(batch.slot)
+        if end > len(records):
+            raise ValueError(f'{path} changed while being read')
+        for field in Signals._fields:
+            records[field][position:end] = getattr(batch, field)
+        position = end
+    return records[:position]
+
+
+def cache_paths(path):
+    return (f'{path}.npy', f'{path}.npy.json')
+
+
+def source_stamp(path):
+    info = stat(path)
+    return {'version': CACHE_VERSION, 'mtime': info.st_mtime_ns, 'size': info.st_size}
+
+
+def cached(path):
+    """ Path of the cache of the signal file, or None if it is missing or stale """
+    (cache_path, stamp_path) = cache_paths(path)
+    try:
+        with open(stamp_path, 'r') as f:
+            return cache_path if json.load(f) == source_stamp(path) else None
+    except (OSError, ValueError):
+        return None
+
+
+def build_cache(path):
+    """ Writes the cache of the signal file with two streaming passes (count, then fill) """
+    (cache_path, stamp_path) = cache_paths(path)
+    stamp = source_stamp(path)
+    count = sum(1 for _ in iter_lines(path))
+
+    temp_path = f'{cache_path}.tmp'
+    if count == 0:
+        # empty files can't be memory-mapped
+        with open(temp_path, 'wb') as f:
+            np.save(f, np.empty(0, RECORD))
+    else:
+        records = np.lib.format.open_memmap(
+            temp_path, mode='w+', dtype=RECORD, shape=(count,))
+        read_records(path, records)
+        records.flush()
+        del records
+    replace(temp_path, cache_path)
+
+    with open(stamp_path, 'w') as f:
+        json.dump(stamp, f)
+    return cache_path
+
+
+def load_signals(path, cache=True):
+    """
+    Loads the signals of a file as column views of its memory-mapped cache,
+    (re)building the cache when it's missing or older than the file
+    """
+    if cache:
+        try:
+            cache_path = cached(path) or build_cache(path)
+            return as_signals(np.load(cache_path, mmap_mode='r'))
+        except OSError:
+            # e.g. read-only data folder
+            pass
+
+    records = np.empty(sum(1 for _ in iter_lines(path)), RECORD)
+    return as_signals(read_records(path, records))
+
+
+def group_starts(signals):
+    """ Index of the first signal of every group of signals sharing the same day and start time """
+    if len(signals.slot) == 0:
+        return np.array([], np.int64)
+    changed = (np.diff(signals.slot) != 0) | (np.diff(signals.day) != 0)
+    return np.concatenate(([0], np.flatnonzero(changed) + 1))
+
+
+def returns(signals, params):
+    """
+    Balance change of every signal in units of its order amount, when it is
+    entered without SOROS (and so may use gales). Returns (returns, results, gales)
+    """
+    p = params
+    win = signals.result == WIN
+    gales = signals.gales.astype(np.int8)
+
+    r_loss = -1 - (p.gale_rate if p.max_gales >= 1 else 0) - \
+        (p.gale_rate ** 2 if p.max_gales == 2 else 0)
+    r = np.full(len(gales), float(r_loss))
+    r[win & (gales == 0)] = p.payout
+    if p.max_gales >= 1:
+        r[win & (gales == 1)] = -1 + p.gale_rate * p.payout
+    if p.max_gales >= 2:
+        r[win & (gales == 2)] = -1 - p.gale_rate + p.gale_rate ** 2 * p.payout
+
+    applied = np.where(win & (gales <= p.max_gales), WIN, LOSS).astype(np.int8)
+    # losses without gale marks went through every gale
+    used = np.where((applied == LOSS) & (gales == 0), 2, gales)
+    return r, applied, np.minimum(used, p.max_gales).astype(np.int8)
+
+
+def _kernel(starts, group_days, win, gales, r, applied, used, balance, base_order, gale_rate, payout,
+            max_gales, soros_holding, max_soros, cycle_loss, stop_win, stop_loss, pnl, stops):
+    n = len(win)
+    n_groups = len(starts)
+    soros_enabled = False
+    soros_count = 0
+    soros_amount = 0.0
+    soros_start = 0.0
+    cycle_amount = 0.0
+    day = -1
+    day_balance = balance
+    stopped = False
+    broke = False
+    for g in range(n_groups):
+        start = starts[g]
+        end = starts[g + 1] if g + 1 < n_groups else n
+        if group_days[g] != day:
+            # every day starts from scratch, like TradingBot.reset
+            day = group_days[g]
+            day_balance = balance
+            stopped = False
+            soros_enabled = False
+            soros_count = 0
+            cycle_amount = 0.0
+        if stopped or broke:
+            for i in range(start, end):
+                applied[i] = -1
+                used[i] = 0
+            continue
+
+        group_balance = balance
+        amount = soros_amount if soros_enabled else balance * base_order
+        last_soros_status = False
+
+        for i in range(start, end):
+            if broke:
+                applied[i] = -1
+                used[i] = 0
+                continue
+            before = balance
+            order_amount = amount
+            is_cycle = False
+            if cycle_amount > 0 and not soros_enabled:
+                # the next order after a LOSS recovers what the cycle lost
+                order_amount = cycle_amount
+                cycle_amount = 0.0
+                is_cycle = True
+
+            if not soros_enabled:
+                balance += order_amount * r[i]
+                if win[i] and gales[i] == 0 and not is_cycle:
+                    soros_enabled = soros_count < max_soros
+                else:
+                    soros_enabled = last_soros_status
+                if cycle_loss and applied[i] == 0 and not is_cycle:
+                    cycle_amount = -order_amount * r[i]
+            else:
+                # orders entered with SOROS don't use gales
+                used[i] = 0
+                if win[i] and gales[i] == 0:
+                    soros_enabled = soros_count < max_soros
+                    balance += order_amount * payout
+                    applied[i] = 1
+                else:
+                    balance -= order_amount
+                    applied[i] = 0
+                    soros_enabled = last_soros_status
+                    if cycle_loss:
+                        cycle_amount = max(soros_start - balance, 0.0)
+            if balance <= 0:
+                # a balance that is gone stops the trading
+                balance = 0.0
+                broke = True
+            pnl[i] = balance - before
+            last_soros_status = soros_enabled
+
+        if soros_enabled:
+            if soros_count == 0:
+                soros_start = group_balance
+            soros_amount = (amount + amount * payout) * (1 - soros_holding)
+            soros_count += 1
+        else:
+            soros_amount = 0.0
+            soros_count = 0
+
+        if stop_win > 0 and balance - day_balance >= day_balance * stop_win:
+            stopped = True
+            stops[day] = 1
+        elif stop_loss > 0 and day_balance - balance >= day_balance * stop_loss:
+            stopped = True
+            stops[day] = 0
+    return balance
+
+
+kernel = njit(cache=True)(_kernel) if njit else _kernel
+
+
+def simulate_live(signals, params=Params(), balance=1000.0, starts=None, money=None):
+    """
+    Drives a MoneyManager with the signals: every order of a start time is
+    entered before any result, results (and then the results of their gales)
+    arrive in order, and the day stops at its STOP WIN or STOP LOSS (and the
+    trading once the balance is gone). money continues the state of an
+    earlier run
+    """
+    if starts is None:
+        starts = group_starts(signals)
+    if money is None:
+        money = MoneyManager(params.base_order, params.gale_rate, params.max_gales, params.soros_holding,
+                             params.max_soros, params.cycle_loss, params.stop_win, params.stop_loss)
+    on_result = money.on_result
+    take_amount = money.take_amount
+    check_stop = money.check_stop
+    payout = params.payout
+    initial_balance = balance
+
+    n = len(signals.slot)
+    win = (signals.result == WIN).tolist()
+    gales = signals.gales.tolist()
+    group_days = signals.day[starts].tolist()
+    bounds = starts.tolist() + [n]
+    pnl = [0.0] * n
+    applied = [SKIPPED] * n
+    used = [0] * n
+    stops = [SKIPPED] * (int(signals.day[-1]) + 1 if n else 0)
+
+    day = -1
+    stopped = False
+    broke = False
+    for g in range(len(group_days)):
+        if broke:
+            break
+        if group_days[g] != day:
+            day = group_days[g]
+            money.start_day(balance)
+            stopped = False
+        if stopped:
+            continue
+
+        (start, end) = (bounds[g], bounds[g + 1])
+        base = None
+        amounts = {}
+        kinds = {}
+        for i in range(start, end):
+            (amount, kinds[i]) = take_amount()
+            if amount is None:
+                if base is None:
+                    base = money.base_amount(balance, end - start)
+                amount = base
+            amounts[i] = amount
+
+        active = range(start, end)
+        attempt = 0
+        while active:
+            next_round = []
+            for i in active:
+                amount = amounts[i]
+                won = win[i] and gales[i] == attempt
+                profit = amount * payout if won else 0.0
+                change = profit if won else -amount
+                balance += change
+                pnl[i] += change
+                applied[i] = WIN if won else LOSS
+                used[i] = attempt
+
+                gale_amount = on_result(
+                    won, amount, attempt, kinds[i], profit, balance)
+                if not stopped:
+                    stop = check_stop(balance)
+                    if stop:
+                        stopped = True
+                        stops[day] = WIN if stop == 'WIN' else LOSS
+                if balance <= 0:
+                    # a balance that is gone stops the trading
+                    pnl[i] -= balance
+                    balance = 0.0
+                    broke = True
+                    break
+                # orders stopped for the day don't gale either
+                if gale_amount is not None and not stopped:
+                    amounts[i] = gale_amount
+                    next_round.append(i)
+            active = [] if broke else next_round
+            attempt += 1
+
+    pnl = np.array(pnl)
+    return Result(pnl, np.array(applied, np.int8), np.array(used, np.int8), initial_balance + np.cumsum(pnl),
+                  float(balance), np.array(stops, np.int8))
+
+
+def simulate(signals, params=Params(), balance=1000.0, starts=None, rules=RULES):
+    """
+    Runs the signals through the money management rules, returning a Result
+    (starts may be passed in when the same signals are simulated many times)
+    """
+    if rules == 'live':
+        return simulate_live(signals, params, balance, starts)
+
+    r, applied, used = returns(signals, params)
+    if starts is None:
+        starts = group_starts(signals)
+    n_days = int(signals.day[-1]) + 1 if len(signals.day) else 0
+    stops = np.full(n_days, SKIPPED, np.int8)
+
+    if params.max_soros <= 0 and not params.cycle_loss and not params.stop_win and not params.stop_loss:
+        # without SOROS, CYCLE LOSS or stops every group just multiplies the
+        # balance by 1 + base_order * (sum of the returns of its signals)
+        factors = 1 + params.base_order * \
+            np.add.reduceat(r, starts) if len(starts) else np.ones(0)
+        start_balance = balance * \
+            np.concatenate(([1.0], np.cumprod(factors)[:-1]))
+        sizes = np.diff(np.append(starts, len(r)))
+        pnl = np.repeat(start_balance * params.base_order, sizes) * r
+        final = balance * np.prod(factors)
+        gone = np.flatnonzero(balance + np.cumsum(pnl) <= 0)
+        if len(gone):
+            # a balance that is gone stops the trading
+            first = gone[0]
+            pnl[first] = -(balance + pnl[:first].sum())
+            pnl[first + 1:] = 0
+            applied[first + 1:] = SKIPPED
+            used[first + 1:] = 0
+            final = 0.0
+    elif njit is not None:
+        pnl = np.zeros(len(r))
+        final = kernel(starts, signals.day[starts], signals.result == WIN, signals.gales,
+                       r, applied, used, balance, *params, pnl, stops)
+    else:
+        # plain lists are much faster than arrays in the interpreted loop
+        pnl = [0.0] * len(r)
+        applied, used = applied.tolist(), used.tolist()
+        py_stops = stops.tolist()
+        final = _kernel(starts.tolist(), signals.day[starts].tolist(), (signals.result == WIN).tolist(),
+                        signals.gales.tolist(), r.tolist(), applied, used, balance, *params, pnl, py_stops)
+        pnl = np.array(pnl)
+        applied = np.array(applied, np.int8)
+        used = np.array(used, np.int8)
+        stops = np.array(py_stops, np.int8)
+
+    return Result(pnl, applied, used, balance + np.cumsum(pnl), float(final), stops)
+
+
+def iter_simulate(signals, params=Params(), balance=1000.0, rules=RULES, days=CHUNK_DAYS):
+    """
+    Simulates the signals a chunk of days at a time, yielding the index of
+    the first signal of every chunk and its Result (with day indexes and
+    stops starting at the chunk) as soon as it is simulated. The balance,
+    and the MoneyManager of the live rules, carry over between chunks
+    """
+    n = len(signals.slot)
+    n_days = int(signals.day[-1]) + 1 if n else 0
+    bounds = np.searchsorted(signals.day, np.arange(0, n_days + days, days)).tolist()
+    money = MoneyManager(params.base_order, params.gale_rate, params.max_gales, params.soros_holding,
+                         params.max_soros, params.cycle_loss, params.stop_win, params.stop_loss)
+    for (first, (start, end)) in enumerate(zip(bounds, bounds[1:])):
+        if start == end:
+            continue
+        chunk = Signals(*(field[start:end] for field in signals))
+        chunk = chunk._replace(day=chunk.day - first * days)
+        if balance <= 0:
+            # broke in an earlier chunk
+            size = end - start
+            result = Result(np.zeros(size), np.full(size, SKIPPED, np.int8), np.zeros(size, np.int8),
+                            np.zeros(size), 0.0, np.full(int(chunk.day[-1]) + 1, SKIPPED, np.int8))
+        elif rules == 'live':
+            result = simulate_live(chunk, params, balance, money=money)
+        else:
+            result = simulate(chunk, params, balance, rules=rules)
+        balance = result.final_balance
+        yield start, result
+
+
+def max_drawdown(result, balance):
+    """ Largest drop from a previous peak of the balance, as a percentage of that peak """
+    path = np.concatenate(([balance], result.balance))
+    peaks = np.maximum.accumulate(path)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns = np.where(peaks > 0, (peaks - path) / peaks, 0)
+    return float(drawdowns.max())
@@ -0,0 +1,276 @@
+"""
+Local stand-in for the PocketOption trading cabinet, with the same elements
+and selectors used by pocketoption.PocketOption (pairs list, timeframes,
+amount, call/put buttons, deals list and balances), so the selenium broker
+can be driven offline. Deals settle on a configurable clock and latency,
+jitter and dropped orders can be injected:
+
+    python -m benchmarks.cabinet --port 8000 --time-scale 60 --latency 50
+    POCKETOPTION_URL=http://localhost:8000/cabinet/demo-quick-high-low/ python main.py
+"""
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from json import dumps
+from datetime import datetime
+from utils import CustomTZ
+
+PAIRS = ['EUR/USD', 'GBP/USD', 'USD/JPY', 'EUR/JPY', 'GBP/JPY', 'AUD/USD', 'USD/CAD', 'EUR/GBP',
+         'EUR/USD OTC', 'GBP/USD OTC', 'USD/JPY OTC', 'GBP/JPY OTC', 'AUD/CAD OTC']
+# pairs listed as closed for trading
+CLOSED_PAIRS = ['EUR/CHF', 'NZD/USD']
+TIMEFRAMES = ['M1', 'M2', 'M3', 'M5', 'M15', 'M30', 'H1']
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Cabinet stand-in</title>
+<style>
+    .hidden { display: none }
+    .deals-list__item { border-bottom: 1px solid #ccc; margin: 2px 0 }
+</style>
+</head>
+<body>
+<div class="balance">
+    <span class="js-balance-demo"></span>
+    <span class="js-balance-real">0.00</span>
+</div>
+<div class="pair-number-wrap"><span class="current-symbol">EUR/USD</span></div>
+<div class="drop-down-modal hidden">
+    <input class="search__field" type="text">
+    <ul class="alist"></ul>
+</div>
+<div class="block--bet-amount"><div class="value"><input type="text" value="1"></div></div>
+<div class="block--expiration-inputs">
+    <i class="fa fa-flag-checkered"></i>
+    <div class="control">00:01:00</div>
+    <div class="dops hidden"></div>
+</div>
+<button class="btn-call">Call</button>
+<button class="btn-put">Put</button>
+<div class="deals">
+    <a class="flex-centered" href="#">Opened</a>
+    <a class="flex-centered" href="#">Closed</a>
+    <div class="deals-list"></div>
+</div>
+<script>
+const config = /*CONFIG*/
+const $ = selector => document.querySelector(selector)
+const state = { pair: 'EUR/USD', timeframe: 1, tab: 0, balance: config.balance, opened: [] }
+// every order clicked, for the benchmark: {cls, pair, amount, clicked, settled, win, dropped}
+window.mockDeals = []
+
+// runs fn after the injected latency (plus jitter)
+const later = fn => {
+    const delay = config.latency + Math.random() * config.jitter
+    delay > 0 ? setTimeout(fn, delay) : fn()
+}
+const pad = value => String(value).padStart(2, '0')
+// HH:MM of a timestamp in the timezone of the bot
+const clock = ms => {
+    const date = new Date(ms + config.tz_offset * 60000)
+    return `${pad(date.getUTCHours())}:${pad(date.getUTCMinutes())}`
+}
+const money = value => '$' + value.toFixed(2)
+
+const renderBalance = () => { $('.js-balance-demo').textContent = state.balance.toFixed(2) }
+
+const renderPairs = () => {
+    const search = $('.search__field').value.trim().toUpperCase().replace('/', '')
+    const list = $('.alist')
+    list.innerHTML = ''
+    config.pairs.concat(config.closed_pairs).forEach(pair => {
+        if (search && !pair.replace('/', '').startsWith(search)) return
+        const item = document.createElement('li')
+        item.className = 'alist__item' + (config.closed_pairs.includes(pair) ? ' alist__item--no-active' : '')
+        const label = document.createElement('span')
+        label.className = 'alist__label'
+        label.textContent = pair
+        label.addEventListener('click', () => later(() => {
+            state.pair = pair
+            $('.current-symbol').textContent = pair
+        }))
+        item.appendChild(label)
+        list.appendChild(item)
+    })
+}
+
+$('.pair-number-wrap').addEventListener('click', () => {
+    $('.search__field').value = ''
+    renderPairs()
+    $('.drop-down-modal').classList.remove('hidden')
+    $('.search__field').focus()
+})
+$('.search__field').addEventListener('input', () => renderPairs())
+document.addEventListener('keydown', event => {
+    if (event.key === 'Escape') $('.drop-down-modal').classList.add('hidden')
+}, true)
+
+// the flag switches the expiration from a clock time to a timeframe
+$('.fa-flag-checkered').addEventListener('click', event => event.target.remove())
+$('.block--expiration-inputs .control').addEventListener('click', () => later(() => {
+    const dops = $('.dops')
+    dops.innerHTML = ''
+    config.timeframes.forEach(timeframe => {
+        const item = document.createElement('div')
+        item.className = 'dops__timeframes-item'
+        item.textContent = timeframe
+        item.addEventListener('click', () => {
+            const minutes = timeframe[0] === 'H' ? parseInt(timeframe.slice(1)) * 60 : parseInt(timeframe.slice(1))
+            state.timeframe = minutes
+            $('.block--expiration-inputs .control').textContent = `00:${pad(minutes)}:00`
+            dops.classList.add('hidden')
+        })
+        dops.appendChild(item)
+    })
+    dops.classList.remove('hidden')
+}))
+
+const dealNode = (deal, profit) => {
+    const node = document.createElement('div')
+    node.className = 'deals-list__item'
+    node.innerHTML = `<div class="item-row"><div><a href="#"></a></div><div></div></div>` +
+        `<div class="item-row"><div></div>${profit === null ? '' : '<div class="centered"></div>'}</div>`
+    node.querySelector('a').textContent = deal.pair
+    node.querySelector('.item-row:first-of-type div:last-of-type').textContent = clock(deal.expires)
+    node.querySelector('.item-row:last-of-type div:first-of-type').textContent = money(deal.amount)
+    if (profit !== null) node.querySelector('.centered').textContent = money(profit)
+    return node
+}
+
+const renderDeals = () => {
+    const list = $('.deals-list')
+    list.innerHTML = ''
+    const deals = state.tab === 0 ? state.opened : window.mockDeals.filter(deal => deal.settled)
+    deals.forEach(deal => list.appendChild(dealNode(deal, state.tab === 0 ? null : deal.profit)))
+}
+document.querySelectorAll('.deals a.flex-centered').forEach((tab, index) => tab.addEventListener('click', event => {
+    event.preventDefault()
+    state.tab = index
+    renderDeals()
+}))
+
+const settle = deal => {
+    deal.win = Math.random() < config.win_rate
+    deal.profit = deal.win ? deal.amount * (1 + config.payout) : 0
+    deal.settled = Date.now()
+    state.balance += deal.profit
+    state.opened = state.opened.filter(opened => opened !== deal)
+    renderBalance()
+    if (state.tab === 1) {
+        $('.deals-list').prepend(dealNode(deal, deal.profit))
+    } else {
+        renderDeals()
+    }
+}
+
+const openDeal = action => {
+    const amount = parseFloat($('.block--bet-amount .value input').value)
+    const clicked = Date.now()
+    const deal = {
+        pair: state.pair, action, amount, clicked, settled: null, win: null, profit: null,
+        expires: clicked + state.timeframe * 60000, dropped: false
+    }
+    deal.cls = `o${clock(deal.expires).replace(':', '-')}_${deal.pair.replace('/', '').replace(' ', '-')}_${amount.toFixed(2).replace('.', '-')}`
+    window.mockDeals.push(deal)
+    if (!(amount >= 1) || amount > state.balance || Math.random() < config.fault_rate) {
+        deal.dropped = true
+        return
+    }
+    later(() => {
+        state.balance -= amount
+        renderBalance()
+        state.opened.push(deal)
+        if (state.tab === 0) $('.deals-list').prepend(dealNode(deal, null))
+        setTimeout(() => settle(deal), state.timeframe * 60000 / config.time_scale + config.settle_delay)
+    })
+}
+$('.btn-call').addEventListener('click', () => openDeal('call'))
+$('.btn-put').addEventListener('click', () => openDeal('put'))
+
+renderBalance()
+</script>
+</body>
+</html>
+'''
+
+
+class CabinetServer():
+    """ Serves the cabinet stand-in from a thread (any path under /cabinet/, everything else is a blank page) """
+
+    def __init__(self, host='localhost', port=0, balance=1000, payout=0.92, win_rate=0.5, time_scale=60,
+                 latency=0, jitter=0, fault_rate=0, settle_delay=0):
+        offset = CustomTZ().utcoffset(datetime.now())
+        # latency, jitter and settle_delay in milliseconds
+        self.config = {'balance': balance, 'payout': payout, 'win_rate': win_rate, 'time_scale': time_scale,
+                       'latency': latency, 'jitter': jitter, 'fault_rate': fault_rate, 'settle_delay': settle_delay,
+                       'tz_offset': offset.total_seconds() // 60, 'pairs': PAIRS, 'closed_pairs': CLOSED_PAIRS,
+                       'timeframes': TIMEFRAMES}
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        (host, port) = self.server.server_address[:2]
+        return f'http://{host}:{port}/cabinet/demo-quick-high-low/'
+
+    def handler(self):
+        page = PAGE.replace('/*CONFIG*/', dumps(self.config)).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = page if self.path.startswith(
+                    '/cabinet/') else b'<!DOCTYPE html><html><body></body></html>'
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever,
+                             name='Cabinet Server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def parse_args(args=None):
+    parser = ArgumentParser(
+        description='Local PocketOption trading cabinet stand-in')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--balance', type=float, default=1000)
+    parser.add_argument('--payout', type=float, default=0.92)
+    parser.add_argument('--win-rate', type=float, default=0.5)
+    parser.add_argument('--time-scale', type=float, default=60,
+                        help='how many times faster than real time deals settle')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds before the page reacts to a click')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='random milliseconds added to the latency')
+    parser.add_argument('--fault-rate', type=float, default=0,
+                        help='share of the orders silently dropped')
+    parser.add_argument('--settle-delay', type=float, default=0,
+                        help='milliseconds between the expiration and the result')
+    return parser.parse_args(args)
+
+
+def server_of(args):
+    return CabinetServer(args.host, args.port, args.balance, args.payout, args.win_rate, args.time_scale,
+                         args.latency, args.jitter, args.fault_rate, args.settle_delay)
+
+
+if __name__ == '__main__':
+    server = server_of(parse_args())
+    print(f'Serving {server.url}')
+    server.server.serve_forever()
@@ -0,0 +1,73 @@
+"""
+Throughput of the money management state machine: MoneyManager events per
+second when driven directly, and signals per second through the live-rules
+backtest
+
+    python -m benchmarks.money [events]
+"""
+import sys
+from time import perf_counter
+import numpy as np
+from money import MoneyManager
+from backtest import Signals, Params, simulate_live, SKIPPED
+
+
+def events(count, seed=0):
+    """ Random (win, gales) results, so SOROS, GALE and CYCLE LOSS all get exercised """
+    rng = np.random.default_rng(seed)
+    return list(zip((rng.random(count) < 0.6).tolist(), rng.integers(0, 2, count).tolist()))
+
+
+def drive(results, balance=1000.0, payout=0.8):
+    money = MoneyManager(max_gales=1)
+    money.start_day(balance)
+    handled = 0
+    for (win, gales) in results:
+        (amount, kind) = money.take_amount()
+        if amount is None:
+            amount = money.base_amount(balance)
+        handled += 1
+        attempt = 0
+        while True:
+            won = win and gales == attempt
+            profit = amount * payout if won else 0.0
+            balance += profit if won else -amount
+            amount = money.on_result(won, amount, attempt, kind, profit, balance)
+            handled += 1
+            if amount is None:
+                break
+            attempt += 1
+    return handled
+
+
+def signals(count, seed=0):
+    rng = np.random.default_rng(seed)
+    # 40 signals a day, a few sharing the same start time
+    slot = np.sort(rng.integers(0, 1440, count).reshape(-1, 40), axis=1).ravel()
+    return Signals(pair=np.full(count, b'EURUSD', 'S10'), slot=slot.astype(np.int16),
+                   action=rng.integers(0, 2, count).astype(np.int8),
+                   result=(rng.random(count) < 0.7).astype(np.int8),
+                   gales=rng.integers(0, 3, count).astype(np.int8),
+                   day=np.repeat(np.arange(count // 40), 40).astype(np.int32))
+
+
+def run(count=1000000):
+    results = events(count)
+    start = perf_counter()
+    handled = drive(results)
+    elapsed = perf_counter() - start
+    print(f'MoneyManager: {handled} events in {elapsed:.2f}s ({handled / elapsed:,.0f} events/s)')
+
+    history = signals(count - count % 40)
+    for (name, params) in (('no stops', Params()), ('daily stops', Params(stop_win=0.1, stop_loss=0.12))):
+        start = perf_counter()
+        result = simulate_live(history, params)
+        elapsed = perf_counter() - start
+        # signals after the stop of their day are skipped, not simulated
+        simulated = int((result.result != SKIPPED).sum())
+        print(f'Live backtest ({name}): {simulated} of {len(history.slot)} signals simulated in {elapsed:.2f}s '
+              f'({simulated / elapsed:,.0f} signals/s)')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
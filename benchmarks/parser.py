@@ -0,0 +1,36 @@
+"""
+Micro-benchmark of the signal parsers: parse cost per message for each
+channel format, without and with the parse cache
+
+    python -m benchmarks.parser [iterations]
+"""
+import sys
+from timeit import timeit
+from signals import DefaultParser, PatternParser, parse_signal, register_channel
+
+FORMATS = {
+    'default (Moeda)': (DefaultParser(), 'Sinal - 🟢COMPRA🟢\nMoeda: EUR/USD\nHorário: 10:05\nExpiração: 5\n'),
+    'default (semicolon)': (DefaultParser(), 'M5;EURUSD;10:05;VENDA'),
+    'default (OTC)': (DefaultParser(), '⏰ 10:05 GBPJPY-OTC PUT Timeframe M1'),
+    'pattern (semicolon)': (PatternParser(r'(?P<pair>\w{6});(?P<hour>\d{2}):(?P<minute>\d{2});(?P<action>COMPRA|VENDA)(?:.*M(?P<timeframe>\d))?'),
+                            'EURUSD;10:05;COMPRA M5'),
+}
+
+
+def run(iterations=20000):
+    print(f'{"format":<24}{"parse (us)":>12}{"cached (us)":>14}')
+    for channel_id, (name, (parser, message)) in enumerate(FORMATS.items()):
+        parser.parse(message)
+        register_channel({'id': channel_id, 'timeframe': parser.default_timeframe,
+                          **({'signal': parser.signal.pattern} if isinstance(parser, PatternParser) else {})})
+
+        uncached = timeit(lambda: parser.parse(message),
+                          number=iterations) / iterations
+        parse_signal(message, channel_id)
+        cached = timeit(lambda: parse_signal(message, channel_id),
+                        number=iterations) / iterations
+        print(f'{name:<24}{uncached * 1e6:>12.2f}{cached * 1e6:>14.2f}')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
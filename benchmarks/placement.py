@@ -0,0 +1,247 @@
+"""
+Offline benchmark of the selenium broker against the cabinet stand-in
+(benchmarks/cabinet.py): orders per minute, placement latency (with the time
+of every stage) and placed orders of each placement path, result detection
+latency and driver memory, written as JSON so runs can be compared
+
+    python -m benchmarks.placement --orders 30 --latency 20 --output placement.json
+    python -m benchmarks.placement --baseline placement.json
+"""
+import sys
+import json
+from os import path, listdir, sysconf
+from argparse import ArgumentParser
+from time import perf_counter, time, sleep
+import numpy as np
+import pocketoption
+from pocketoption import PocketOption
+from tracing import Tracer, traced
+from benchmarks.cabinet import CabinetServer
+
+# placement paths: FAST_PLACEMENT and whether the ticket is pre-armed (not timed) before the order
+SCENARIOS = {
+    'element': {'fast': False, 'armed': False},
+    'fast': {'fast': True, 'armed': False},
+    'fast_armed': {'fast': True, 'armed': True},
+}
+
+PAIRS = ['EURUSD', 'GBPJPY-OTC', 'USDJPY', 'AUDCAD-OTC', 'EURGBP']
+
+# (metric path, True if higher is better) compared against the baseline
+COMPARED = [(('orders_per_minute',), True), (('latency_ms', 'p95'), False)]
+
+
+def summary(values):
+    """ p50/p95/p99/max/mean of latencies in seconds, in milliseconds """
+    if len(values) == 0:
+        return {}
+    values = np.array(values) * 1000
+    return {**{f'p{point}': round(float(value), 2) for (point, value) in zip((50, 95, 99), np.percentile(values, (50, 95, 99)))},
+            'max': round(float(values.max()), 2), 'mean': round(float(values.mean()), 2)}
+
+
+def page_deals(api):
+    """ Deals clicked in the stand-in of every session, by their class """
+    deals = {}
+    for session in api.pool.sessions:
+        for deal in session.driver.execute_script('return window.mockDeals'):
+            deals[deal['cls']] = deal
+    return deals
+
+
+def process_rss(pid):
+    """ Resident memory (bytes) of a process and its descendants, from /proc (None elsewhere) """
+    if not path.isdir('/proc'):
+        return None
+    children = {}
+    for entry in listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    parent = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(entry))
+
+    total = 0
+    pending = [pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                total += int(f.read().split()[1]) * sysconf('SC_PAGE_SIZE')
+        except OSError:
+            pass
+        pending.extend(children.get(pid, []))
+    return total
+
+
+def memory(api):
+    sessions = []
+    for session in api.pool.sessions:
+        driver = session.driver
+        sessions.append({'rss': process_rss(driver.service.process.pid),
+                         'js_heap': driver.execute_script('return performance.memory ? performance.memory.usedJSHeapSize : null')})
+    return sessions
+
+
+class Amounts():
+    """ Unique order amounts, so every order can be told apart in the deals list """
+
+    def __init__(self):
+        self.next = 1.0
+
+    def __call__(self):
+        amount = round(self.next, 2)
+        self.next += 0.01
+        return amount
+
+
+def place(api, scenario, orders, amount, timeframe=1):
+    """ Places the orders with the placement path of scenario, returning its metrics """
+    pocketoption.FAST_PLACEMENT = scenario['fast']
+    tracer = Tracer(path=None)
+    latencies = []
+    placed = []
+    for index in range(orders):
+        pair = PAIRS[index % len(PAIRS)]
+        action = 'call' if index % 2 == 0 else 'put'
+        if scenario['armed']:
+            api.prepare(pair, timeframe)
+
+        start = perf_counter()
+        (check, id) = traced(tracer.begin(), api.buy,
+                             amount(), pair, action, timeframe)
+        latencies.append(perf_counter() - start)
+        if check:
+            placed.append(id)
+
+    # orders clicked with the right pair and amount, and not dropped by the stand-in
+    deals = page_deals(api)
+    confirmed = [id for id in placed if not deals.get(
+        api.order_class(api.orders[id]), {'dropped': True})['dropped']]
+    return {'orders': orders, 'placed': len(placed), 'confirmed': len(confirmed),
+            'orders_per_minute': round(len(placed) / sum(latencies) * 60, 2) if latencies else 0,
+            'latency_ms': summary(latencies),
+            'stages_ms': {stage: stats for (stage, stats) in tracer.summary().items() if stats['count']}}
+
+
+def detect(api, orders, amount, timeframe=1):
+    """ Places orders one by one and waits for their results, returning the result detection metrics """
+    pocketoption.FAST_PLACEMENT = True
+    latencies = []
+    missed = 0
+    for index in range(orders):
+        (check, id) = api.buy(amount(), PAIRS[index %
+                              len(PAIRS)], 'call', timeframe)
+        if not check:
+            missed += 1
+            continue
+        result = api.check_binary_orders([id])[id]
+        observed = time()
+        deal = page_deals(api).get(api.order_class(api.orders[id]))
+        if result is None or deal is None or deal['settled'] is None:
+            missed += 1
+            continue
+        latencies.append(max(observed - deal['settled'] / 1000, 0))
+    return {'orders': orders, 'detected': len(latencies), 'missed': missed, 'latency_ms': summary(latencies)}
+
+
+def lookup(report, keys):
+    for key in keys:
+        report = report.get(key, {}) if isinstance(report, dict) else {}
+    return report if isinstance(report, (int, float)) else None
+
+
+def compare(report, baseline, tolerance):
+    """ Regressions of report compared to baseline, beyond tolerance (share) """
+    regressions = []
+    runs = [(f'scenarios.{name}', report['scenarios'][name], baseline.get('scenarios', {}).get(name, {}))
+            for name in report['scenarios']]
+    runs.append(('results', report['results'], baseline.get('results', {})))
+    for (name, current, previous) in runs:
+        for (keys, higher) in COMPARED:
+            (value, before) = (lookup(current, keys), lookup(previous, keys))
+            if value is None or not before:
+                continue
+            change = (value - before) / before
+            if (change < -tolerance) if higher else (change > tolerance):
+                regressions.append(
+                    f'{name}.{".".join(keys)}: {before} -> {value} ({change:+.0%})')
+    return regressions
+
+
+def run(args):
+    server = CabinetServer(time_scale=args.time_scale, latency=args.latency, jitter=args.jitter,
+                           fault_rate=args.fault_rate, settle_delay=args.settle_delay).start()
+    PocketOption.url = server.url
+    amount = Amounts()
+    report = {'time': time(), 'config': {key: value for (key, value) in vars(args).items() if key not in ('output', 'baseline')},
+              'scenarios': {}}
+    start = perf_counter()
+    api = PocketOption('benchmark', demo=True)
+    report['startup_seconds'] = round(perf_counter() - start, 2)
+    try:
+        for (name, scenario) in SCENARIOS.items():
+            if args.scenarios and name not in args.scenarios:
+                continue
+            report['scenarios'][name] = place(
+                api, scenario, args.orders, amount)
+            print(f'{name}: {report["scenarios"][name]["orders_per_minute"]} orders/min, '
+                  f'p95 {report["scenarios"][name]["latency_ms"].get("p95")}ms')
+        # let the deals of the placement runs settle before timing the results
+        sleep(60 / args.time_scale)
+        report['results'] = detect(api, args.results, amount)
+        print(
+            f'results: p95 {report["results"]["latency_ms"].get("p95")}ms')
+        report['memory'] = memory(api)
+    finally:
+        api.quit()
+        server.stop()
+    return report
+
+
+def parse_args(args=None):
+    parser = ArgumentParser(
+        description='Benchmarks the selenium broker against the local cabinet stand-in')
+    parser.add_argument('--orders', type=int, default=30,
+                        help='orders placed by every scenario')
+    parser.add_argument('--results', type=int, default=10,
+                        help='orders whose result detection is timed')
+    parser.add_argument('--scenarios', nargs='*',
+                        choices=list(SCENARIOS), default=None)
+    parser.add_argument('--time-scale', type=float, default=60)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds before the page reacts to a click')
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--fault-rate', type=float, default=0)
+    parser.add_argument('--settle-delay', type=float, default=0)
+    parser.add_argument('--output', default='placement.json')
+    parser.add_argument('--baseline', default=None,
+                        help='previous report to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    # read first, the baseline may be the file the report is written to
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    report = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+from abc import ABC, abstractmethod
+
+
+class Broker(ABC):
+    """
+    Operations the TradingBot needs from a trading platform.
+
+    Orders are referenced by the id returned from buy, and a checked order is
+    a dict with at least 'active', 'direction', 'amount', 'profit_amount'
+    (total returned by the order, 0 when lost) and 'result' ('win' or 'loss')
+    """
+    # how many orders can be placed in parallel
+    workers = 1
+
+    @abstractmethod
+    def buy(self, amount, pair, action, timeframe):
+        """ Opens an order and returns (success, order id) """
+
+    @abstractmethod
+    def check_binary_order(self, id):
+        """ Waits for the order to expire and returns it with its result, or None on failure """
+
+    @abstractmethod
+    def get_balance(self, fresh=False):
+        """ Returns the current balance (possibly cached unless fresh is True), or None on failure """
+
+    @abstractmethod
+    def restart(self, update_token=False):
+        pass
+
+    @abstractmethod
+    def quit(self):
+        pass
+
+    def check_binary_orders(self, ids):
+        """ Returns {id: order or None} for already expired orders """
+        return {id: self.check_binary_order(id) for id in ids}
+
+    def prepare(self, pair, timeframe):
+        """ Gets ready for an upcoming order of pair and timeframe, when the platform allows it """
+        return False
+
+    def is_armed(self, pair, timeframe):
+        return True
+
+
+def create_broker(name, ssid, demo=True):
+    if name == 'selenium':
+        from pocketoption import PocketOption
+        return PocketOption(ssid, demo)
+    elif name == 'websocket':
+        from pocketoption_ws import PocketOptionClient
+        return PocketOptionClient(ssid, demo)
+    elif name == 'stub':
+        from stub_broker import StubBroker
+        return StubBroker()
+    raise ValueError(f'Unknown broker: {name}')
@@ -1,7 +1,22 @@
-from threading import Timer, enumerate, main_thread
-from termcolor import colored
-from utils import get_time
+from threading import Timer, Thread, Event, Lock, enumerate, main_thread
+from queue import SimpleQueue, Empty
 from datetime import datetime
+from time import time
+from functools import partial
+from os import getenv
+import atexit
+from termcolor import colored
+from utils import CustomTZ, clock
+
+# max records written between two flushes of the log file
+LOG_BATCH = int(getenv('LOG_BATCH', 256))
+
+# (timestamp, message, live), a callable to run in the writer thread (see
+# defer), an Event to signal once everything before it is written, or None
+# to stop the writer
+records = SimpleQueue()
+writer = None
+writer_lock = Lock()
 
 
 def watch_threads(interval=300):
@@ -13,25 +28,136 @@ def watch_threads(interval=300):
         t.start()
 
 
+def log_path(day=None):
+    """ Log file of the day (today in the configured timezone by default) """
+    day = day or datetime.now(CustomTZ())
+    return f'./log-{day.strftime("%d-%m-%Y")}.txt'
+
+
 def log(message, live=True):
-    timestamp = get_time()
-    raw_text = f'{timestamp}: {message}'
-
-    if live:
-        print_text = raw_text
-        if 'WIN' in print_text:
-            print_text = print_text.replace(
-                'WIN', colored(' WIN ', 'grey', 'on_green'))
-        elif 'LOSS' in print_text:
-            print_text = print_text.replace(
-                'LOSS', colored(' LOSS ', 'white', 'on_red'))
-        elif 'TEST MODE' in print_text:
-            print_text = print_text.replace(
-                'TEST MODE', colored(' TEST MODE ', 'grey', 'on_yellow'))
-
-        print_text = print_text.replace(
-            timestamp + ':', colored(f' {timestamp} ', 'grey', 'on_cyan'))
-        print(print_text)
-
-    with open(f'./log-{datetime.today().strftime("%d-%m-%Y")}.txt', 'a', encoding='utf-8') as f:
-        f.write(raw_text + '\n')
+    """
+    Queues a log record for the writer thread. message may be a callable
+    returning the message, so expensive messages are only built by the writer.
+    It runs later in another thread, so it must only format values taken
+    when logging (never live state like the time or shared dicts)
+    """
+    if writer is None:
+        start_writer()
+    records.put((clock.time(), message, live))
+
+
+def defer(fn, *args):
+    """ Runs fn(*args) in the writer thread, in order with the log records (e.g. other file writes) """
+    if writer is None:
+        start_writer()
+    records.put(partial(fn, *args))
+
+
+def flush(timeout=5):
+    """ Waits until every record queued so far is written """
+    if writer is None:
+        return
+    done = Event()
+    records.put(done)
+    done.wait(timeout)
+
+
+def start_writer():
+    global writer
+    with writer_lock:
+        if writer is None:
+            thread = Thread(target=LogWriter().run,
+                            name='Log Writer', daemon=True)
+            thread.start()
+            writer = thread
+
+
+def stop_writer(timeout=5):
+    global writer
+    if writer is None:
+        return
+    records.put(None)
+    writer.join(timeout)
+    writer = None
+
+
+# whatever is still queued gets written on exit
+atexit.register(stop_writer)
+
+
+def console_text(timestamp, raw_text):
+    if 'WIN' in raw_text:
+        raw_text = raw_text.replace(
+            'WIN', colored(' WIN ', 'grey', 'on_green'))
+    elif 'LOSS' in raw_text:
+        raw_text = raw_text.replace(
+            'LOSS', colored(' LOSS ', 'white', 'on_red'))
+    elif 'TEST MODE' in raw_text:
+        raw_text = raw_text.replace(
+            'TEST MODE', colored(' TEST MODE ', 'grey', 'on_yellow'))
+
+    return raw_text.replace(timestamp + ':', colored(f' {timestamp} ', 'grey', 'on_cyan'), 1)
+
+
+class LogWriter():
+    """
+    Writes the queued records with a single open file handle, flushing once
+    per batch and switching to a new file at midnight (CustomTZ)
+    """
+
+    def __init__(self):
+        self.file = None
+        self.path = None
+        self.tz = CustomTZ()
+
+    def run(self):
+        running = True
+        while running:
+            # everything queued while the last batch was written goes in the next one
+            batch = [records.get()]
+            try:
+                while len(batch) < LOG_BATCH:
+                    batch.append(records.get_nowait())
+            except Empty:
+                pass
+
+            waiting = []
+            for record in batch:
+                if record is None:
+                    running = False
+                elif isinstance(record, Event):
+                    waiting.append(record)
+                elif callable(record):
+                    try:
+                        record()
+                    except Exception as e:
+                        self.write(time(), f'Deferred write failed: {repr(e)}', False)
+                else:
+                    self.write(*record)
+            if self.file:
+                self.file.flush()
+            for done in waiting:
+                done.set()
+
+        if self.file:
+            self.file.close()
+
+    def write(self, timestamp, message, live):
+        day = datetime.fromtimestamp(timestamp, self.tz)
+        try:
+            message = message() if callable(message) else message
+        except Exception as e:
+            message = f'Log message failed: {repr(e)}'
+
+        hour = day.strftime('%H:%M')
+        raw_text = f'{hour}: {message}'
+        if live:
+            print(console_text(hour, raw_text))
+
+        path = log_path(day)
+        if path != self.path:
+            if self.file:
+                self.file.close()
+            self.file = open(path, 'a', encoding='utf-8')
+            self.path = path
+        self.file.write(raw_text + '\n')
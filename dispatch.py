@@ -0,0 +1,51 @@
+import re
+from signals import parse_signal, register_channel
+
+
+class ChannelDispatcher():
+    """
+    Maps every watched chat to its own compiled filter and parser, so a
+    message is only matched against the pattern of the chat it came from
+    and chatter that fails the filter is dropped before any parsing
+    """
+
+    def __init__(self):
+        # chat id -> compiled filter (None accepts every message)
+        self.filters = {}
+        # chat id -> {'received', 'filtered', 'parsed'}
+        self.counters = {}
+
+    def add(self, channel):
+        """ Registers a channel of telegram_channels.json (with its raw id) """
+        pattern = channel.get('pattern')
+        self.filters[channel['id']] = re.compile(
+            pattern).match if pattern and pattern != '.*' else None
+        self.counters[channel['id']] = {
+            'received': 0, 'filtered': 0, 'parsed': 0}
+        register_channel(channel)
+
+    def dispatch(self, channel_id, message):
+        """ Returns the Signal in the message, or None """
+        counters = self.counters.get(channel_id)
+        if counters is None:
+            counters = self.counters[channel_id] = {
+                'received': 0, 'filtered': 0, 'parsed': 0}
+        counters['received'] += 1
+
+        match = self.filters.get(channel_id)
+        if match is not None and not match(message):
+            counters['filtered'] += 1
+            return None
+
+        signal = parse_signal(message, channel_id)
+        if signal:
+            counters['parsed'] += 1
+        return signal
+
+    def report(self):
+        lines = [f'{channel_id}: {counters["received"]} received | {counters["filtered"]} filtered | {counters["parsed"]} parsed'
+                 for channel_id, counters in self.counters.items()]
+        return '\n'.join(lines) or 'No messages received'
+
+
+dispatcher = ChannelDispatcher()
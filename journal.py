@@ -0,0 +1,154 @@
+from struct import Struct
+from datetime import datetime
+from mmap import mmap, ACCESS_READ
+from os import path
+import json
+import numpy as np
+from debug import defer, flush
+from utils import CustomTZ, clock
+
+"""
+Structured event journal (signals, orders, results, errors) written next
+to the human log as ./journal-DD-MM-YYYY.jsonl, with a sidecar index of
+fixed-width records (.idx) so pages and filters are served by reading the
+index and seeking to the matching lines instead of scanning the journal
+"""
+
+TYPES = {'signal': 1, 'order': 2, 'result': 3, 'error': 4}
+RESULTS = {'win': 1, 'loss': 0}
+
+# offset, length, timestamp, type, result (-1 if none), channel (0 if none), pair
+INDEX = Struct('<QIdBbq12s')
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('length', '<u4'), ('time', '<f8'), ('type', 'u1'),
+                        ('result', 'i1'), ('channel', '<i8'), ('pair', 'S12')])
+
+# journal lines per bot:logs page (pages are cut short to fit a telegram message)
+PAGE_SIZE = 20
+MESSAGE_LIMIT = 4096
+
+
+def journal_paths(day=None):
+    day = day or datetime.now(CustomTZ())
+    name = f'./journal-{day.strftime("%d-%m-%Y")}'
+    return (name + '.jsonl', name + '.idx')
+
+
+class Journal():
+    """ Appends events and their index records, switching files at midnight (CustomTZ) """
+
+    def __init__(self):
+        self.file = None
+        self.index = None
+        self.path = None
+        self.tz = CustomTZ()
+
+    def write(self, timestamp, type, channel, pair, result, fields):
+        (journal_path, index_path) = journal_paths(
+            datetime.fromtimestamp(timestamp, self.tz))
+        if journal_path != self.path:
+            self.close()
+            self.file = open(journal_path, 'ab')
+            self.index = open(index_path, 'ab')
+            self.path = journal_path
+
+        data = (json.dumps({'time': timestamp, 'type': type, 'channel': channel, 'pair': pair, 'result': result, **fields},
+                           default=str) + '\n').encode('utf-8')
+        offset = self.file.tell()
+        self.file.write(data)
+        self.file.flush()
+        self.index.write(INDEX.pack(offset, len(data), timestamp, TYPES[type], RESULTS.get(result, -1),
+                                    channel or 0, (pair or '').encode()[:12]))
+        self.index.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.index.close()
+        self.file = self.index = self.path = None
+
+
+journal = Journal()
+
+
+def record(type, channel=None, pair=None, result=None, **fields):
+    """ Queues an event for the journal, written by the log writer thread """
+    defer(journal.write, clock.time(), type, channel, pair, result, fields)
+
+
+def read_index(index_path):
+    """ Memory-mapped index records of a day """
+    # a record being written right now may still be partial
+    count = path.getsize(index_path) // INDEX.size if path.exists(index_path) else 0
+    if count == 0:
+        return np.empty(0, INDEX_DTYPE)
+    return np.memmap(index_path, INDEX_DTYPE, mode='r', shape=(count,))
+
+
+def query(day=None, type=None, channel=None, pair=None, result=None, since=None, until=None):
+    """ Index records of the day matching every given filter """
+    (_, index_path) = journal_paths(day)
+    entries = read_index(index_path)
+    mask = np.ones(len(entries), bool)
+    if type is not None:
+        mask &= entries['type'] == TYPES[type]
+    if channel is not None:
+        mask &= entries['channel'] == int(channel)
+    if pair is not None:
+        mask &= entries['pair'] == pair.upper().encode()
+    if result is not None:
+        mask &= entries['result'] == RESULTS[result.lower()]
+    if since is not None:
+        mask &= entries['time'] >= since
+    if until is not None:
+        mask &= entries['time'] < until
+    return entries[mask]
+
+
+def read_events(entries, day=None):
+    """ Journal events of the index records, read by seeking into the mapped journal """
+    (journal_path, _) = journal_paths(day)
+    if len(entries) == 0:
+        return []
+    with open(journal_path, 'rb') as f, mmap(f.fileno(), 0, access=ACCESS_READ) as data:
+        return [json.loads(data[entry['offset']:entry['offset'] + entry['length']])
+                for entry in entries]
+
+
+def format_event(event):
+    fields = {key: value for (key, value) in event.items()
+              if key not in ('time', 'type', 'channel', 'pair', 'result') and value is not None}
+    text = datetime.fromtimestamp(event['time'], CustomTZ()).strftime('%H:%M:%S')
+    text += f' {event["type"].upper()}'
+    for key in ('pair', 'result', 'channel'):
+        if event.get(key) is not None:
+            text += f' {event[key]}'
+    if fields:
+        text += ' ' + ' '.join(f'{key}={value}' for (key, value) in fields.items())
+    return text
+
+
+def time_of(hour_minute, day=None):
+    """ Timestamp of an HH:MM of the day in the configured timezone """
+    day = day or datetime.now(CustomTZ())
+    (hour, minute) = hour_minute.split(':')
+    return day.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0).timestamp()
+
+
+def page(number=1, day=None, **filters):
+    """ Text of a page of the day's journal with the filters (type, channel, pair, result, since, until) """
+    flush()
+    entries = query(day, **filters)
+    pages = max((len(entries) + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+    selected = entries[(number - 1) * PAGE_SIZE:number * PAGE_SIZE]
+
+    header = f'Page {number}/{pages} ({len(entries)} events)'
+    lines = [header]
+    size = len(header)
+    for event in read_events(selected, day):
+        line = format_event(event)
+        if size + len(line) + 1 > MESSAGE_LIMIT - 4:
+            lines.append('...')
+            break
+        lines.append(line)
+        size += len(line) + 1
+    return '\n'.join(lines)
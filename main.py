@@ -1,32 +1,40 @@
 from telethon import events
-from telegram import get_message_options, run_command, client, CHANNELS
+from telegram import run_command, client, CHANNELS
+from dispatch import dispatcher
 from trading import TradingBot
-from debug import log
-from utils import Timeout
+from debug import log, defer
+from journal import record
+from tracing import tracer
+from utils import Timeout, clock
 from os import getenv
-from asyncio import get_event_loop
+import json
 
 
 TEST_MODE = getenv('TEST_MODE', 'False') == 'True'
 DISCONNECTION_TIMEOUT = int(getenv('DISCONNECTION_TIMEOUT', 60)) * 60
+# file every message of the watched chats is appended to, so the session can be replayed (see replay.py)
+RECORD_MESSAGES = getenv('RECORD_MESSAGES')
+
+
+def record_message(timestamp, channel_id, text):
+    with open(RECORD_MESSAGES, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'time': timestamp, 'channel': channel_id, 'text': text}) + '\n')
 
 
 def stop_client():
-    client.disconnect()
+    # a coroutine when called from the running loop
+    return client.disconnect()
 
 
-bot = TradingBot(stop_callback=stop_client, loop=get_event_loop())
+bot = TradingBot(stop_callback=stop_client, loop=client.loop)
 
 target_chat = []
-patterns = ['.*']
 if TEST_MODE:
     # if test mode, receives signals from "Saved messages" chat
     target_chat = 'me'
 else:
-    patterns = []
     for chat in CHANNELS:
         target_chat.append(chat['id'])
-        patterns.append(chat['pattern'])
 
 
 # creates a timeout to disconnect the client when no orders are received in the specified interval
@@ -34,21 +42,36 @@ disconnect_timeout = Timeout(
     max_interval=DISCONNECTION_TIMEOUT, finish=stop_client, loop=client.loop)
 
 
-@client.on(events.NewMessage(chats=target_chat, pattern='|'.join(patterns)))
+# each chat is filtered and parsed by its own rules in the dispatcher
+@client.on(events.NewMessage(chats=target_chat))
 async def new_option_message(event):
-    options = get_message_options(event.raw_text)
+    channel_id = getattr(event.message.peer_id, 'channel_id', None)
+    if RECORD_MESSAGES:
+        defer(record_message, clock.time(), channel_id, event.raw_text)
+    trace = tracer.begin()
+    options = dispatcher.dispatch(channel_id, event.raw_text)
 
     if options:
+        trace.mark('parse')
         (pair, action, start_time, timeframe) = options
+        record('signal', channel_id, pair, action=action,
+               start_time=start_time, timeframe=timeframe, trace=trace.id)
         disconnect_timeout.reset()
-        bot.execute_option(pair, action, start_time, expires_in=timeframe)
+        # placement runs as its own task, so message handling never waits on the driver
+        bot.submit(pair, action, start_time, expires_in=timeframe,
+                   channel=channel_id, trace=trace)
 
 
 # event for receiving commands for the bot through "Saved messages"
 # syntax: bot:<command_name>
 @client.on(events.NewMessage(chats=['me'], pattern=r'bot:.*'))
 async def new_command(event):
-    result = run_command(event.raw_text.split('bot:')[1])
+    command = event.raw_text.split('bot:')[1]
+    if command.split(' ')[0] == 'logs':
+        # reading the journal waits for the log writer, so it runs off the event loop
+        result = await client.loop.run_in_executor(None, run_command, command)
+    else:
+        result = run_command(command)
     if result == 'STOP':
         await event.reply('Stopped')
         client.disconnect()
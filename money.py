@@ -0,0 +1,130 @@
+from utils import normalize_amount
+
+# what set the amount of an order
+BASE, GALE, SOROS, CYCLE = 0, 1, 2, 3
+
+
+class MoneyManager():
+    """
+    SOROS, GALE, CYCLE LOSS and stop rules of the bot as a state machine
+    without any I/O: balances and results are passed in by whoever drives it
+    (TradingBot with the broker events, the backtest with historical signals)
+    """
+    __slots__ = ('base_order', 'gale_rate', 'max_gales', 'soros_holding', 'max_soros', 'cycle_loss', 'stop_win', 'stop_loss',
+                 'initial_balance', 'next_soros_amount', 'soros_start_balance', 'soros_count', 'pending_soros', 'cycle_loss_amount')
+
+    def __init__(self, base_order=0.02, gale_rate=2.2, max_gales=1, soros_holding=0.1, max_soros=3,
+                 cycle_loss=True, stop_win=None, stop_loss=None):
+        self.base_order = base_order
+        self.gale_rate = gale_rate
+        self.max_gales = max_gales
+        self.soros_holding = soros_holding
+        self.max_soros = max_soros
+        self.cycle_loss = cycle_loss
+        # profit and loss (percentage of the day's initial balance) that stop the day, None to disable
+        self.stop_win = stop_win or None
+        self.stop_loss = stop_loss or None
+
+        self.initial_balance = None
+        self.cycle_loss_amount = None
+        self.reset_soros()
+
+    def start_day(self, balance):
+        self.reset_soros()
+        self.initial_balance = balance
+
+    def reset_soros(self):
+        self.soros_count = 0
+        self.next_soros_amount = None
+        self.pending_soros = False
+        self.soros_start_balance = None
+
+    def take_amount(self):
+        """
+        Returns (amount, kind) for the next order when a SOROS or CYCLE LOSS
+        is waiting for it, or (None, BASE) when it should use base_amount
+        """
+        if self.next_soros_amount:
+            amount = self.next_soros_amount
+            self.next_soros_amount = None
+            self.pending_soros = False
+            return amount, SOROS
+        if self.cycle_loss_amount:
+            amount = self.cycle_loss_amount
+            self.cycle_loss_amount = None
+            return amount, CYCLE
+        return None, BASE
+
+    def base_amount(self, balance, orders=1):
+        """ BASE_ORDER of the balance, split equally between the orders of the same time """
+        return normalize_amount(balance * self.base_order / orders)
+
+    def can_gale(self, gales):
+        return gales != self.max_gales and self.max_gales >= 1 and (self.soros_count == 0 or self.pending_soros)
+
+    def needs_balance(self, win, gales, kind=BASE):
+        """ Whether on_result will use the balance for this result (so callers can skip fetching it) """
+        if win:
+            return not self.pending_soros and gales == 0 and kind != CYCLE and self.soros_count < self.max_soros
+        return not self.can_gale(gales) and self.cycle_loss and self.cycle_loss_amount is None \
+            and self.soros_start_balance is not None
+
+    def on_result(self, win, amount, gales=0, kind=BASE, profit=0.0, balance=None):
+        """
+        Updates the state with the result of an order, where amount is its
+        last stake, profit what a WIN paid over the stake and balance the
+        balance once it settled (only needed when needs_balance says so).
+
+        Returns the amount of the next GALE, or None if the position closed
+        """
+        if win:
+            if not self.pending_soros:
+                # enables SOROS if direct WIN
+                if gales == 0 and kind != CYCLE and self.soros_count < self.max_soros:
+                    self.next_soros_amount = normalize_amount(
+                        (amount + profit) * (1 - self.soros_holding))
+                    self.soros_count += 1
+                    self.pending_soros = True
+                    self.soros_start_balance = balance - profit if balance is not None else None
+                elif self.soros_count >= self.max_soros:
+                    self.reset_soros()
+            return None
+
+        if self.can_gale(gales):
+            if not self.pending_soros:
+                self.reset_soros()
+            return normalize_amount(amount * self.gale_rate)
+
+        self.enable_cycle_loss(amount, balance)
+        if not self.pending_soros:
+            self.reset_soros()
+        return None
+
+    def on_unknown(self):
+        """ The result of an order couldn't be verified """
+        self.reset_soros()
+
+    def enable_cycle_loss(self, amount, balance=None):
+        if self.cycle_loss_amount is not None or not self.cycle_loss:
+            return
+
+        if self.soros_start_balance is not None and balance is not None:
+            self.cycle_loss_amount = normalize_amount(
+                self.soros_start_balance - balance)
+        else:
+            # every stake of the position, back from the last gale
+            total = 0
+            for i in range(self.max_gales + 1):
+                total += amount / self.gale_rate ** (self.max_gales - i)
+            self.cycle_loss_amount = normalize_amount(total)
+
+    def check_stop(self, balance):
+        """ 'WIN' or 'LOSS' once the balance reaches the STOP WIN or STOP LOSS of the day, else None """
+        if self.initial_balance is None:
+            return None
+        stop = None
+        if self.stop_win is not None and balance - self.initial_balance >= self.initial_balance * self.stop_win:
+            stop = 'WIN'
+        if self.stop_loss is not None and self.initial_balance - balance >= self.initial_balance * self.stop_loss:
+            stop = 'LOSS'
+        return stop
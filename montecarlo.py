@@ -0,0 +1,492 @@
+from os import getenv, cpu_count
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import json
+import numpy as np
+from dotenv import load_dotenv
+from backtest import load_signals, returns, group_starts, Params, Signals, RULES, WIN, LOSS
+from money import BASE, SOROS, CYCLE
+from simulator import signals_path, BASE_ORDER, GALE_RATE, PAYOUT, MAX_GALES, SOROS_HOLDING, MAX_SOROS, CYCLE_LOSS, STOP_WIN, STOP_LOSS
+from sweep import share, open_shared
+
+load_dotenv()
+
+"""
+Monte Carlo risk of ruin: replays the timeline of a signal history (days,
+start times and pairs) many times, with the result and gales of every
+signal bootstrapped from the history of its channel (file) and pair. The
+rules run over every path of a batch at once, and a path that loses its
+whole balance stays broke.
+
+e.g. python montecarlo.py channel_a.txt channel_b.txt --paths 200000 --stop-win 0.1
+"""
+
+# cap of signals x paths sampled at once by a worker for the closed form (legacy
+# rules without state), which bounds its memory
+MAX_BATCH_CELLS = int(getenv('MONTECARLO_MAX_BATCH_CELLS', 4000000))
+# paths advanced together by the stateful kernel (its memory only grows with the paths)
+BATCH_PATHS = int(getenv('MONTECARLO_BATCH_PATHS', 16384))
+# outcome code = result * 3 + gales
+OUTCOMES = 6
+
+# attached by every worker: (Signals, group starts, pool of each signal, outcome codes of each pool, blocks)
+shared = None
+
+
+def outcome_codes(signals):
+    return (signals.result.astype(np.int8) * 3 + np.minimum(signals.gales, 2)).astype(np.int8)
+
+
+def combine(histories):
+    """
+    Merges the signals of every channel into one timeline (day N of every
+    file is the same day, and signals of the same day and start time form
+    one group, sharing its amount) and numbers the (channel, pair) pools,
+    returning (Signals, pool of each signal)
+    """
+    signals = Signals(*(np.concatenate([getattr(part, field) for part in histories])
+                        for field in Signals._fields))
+    channels = np.concatenate(
+        [np.full(len(part.slot), i, np.int32) for (i, part) in enumerate(histories)])
+    # stable, so the signals of a channel keep their order within a start time
+    order = np.lexsort((channels, signals.slot, signals.day))
+    signals = Signals(*(field[order] for field in signals))
+    channels = channels[order]
+
+    (_, pools) = np.unique(np.rec.fromarrays(
+        [channels, signals.pair]), return_inverse=True)
+    return signals, pools.astype(np.int32)
+
+
+def attach(specs):
+    global shared
+    (arrays, blocks) = open_shared(specs)
+    shared = (Signals(*arrays[:6]), arrays[6], arrays[7], arrays[8], blocks)
+
+
+def pool_histories(pool_codes):
+    return [codes[codes >= 0] for codes in pool_codes]
+
+
+def sample(pools, pool_codes, paths, rng):
+    """ Bootstraps the outcome code of every signal for every path (paths x signals) """
+    codes = np.empty((paths, len(pools)), np.int8)
+    for (pool, history) in enumerate(pool_histories(pool_codes)):
+        columns = np.flatnonzero(pools == pool)
+        codes[:, columns] = history[rng.integers(
+            0, len(history), (paths, len(columns)))]
+    return codes
+
+
+def normalize(amounts):
+    """ utils.normalize_amount of every path """
+    scaled = amounts * 100
+    rounded = np.rint(scaled)
+    # a product of exactly half a cent is settled by its rounding error (split
+    # as in Dekker's product), matching round(), which rounds the exact value
+    half = scaled - np.floor(scaled) == 0.5
+    if half.any():
+        (amount, product) = (amounts[half], scaled[half])
+        split = amount * 134217729.0
+        high = split - (split - amount)
+        error = (high * 100 - product) + (amount - high) * 100
+        rounded[half] = np.where(error > 0, np.ceil(product), np.where(
+            error < 0, np.floor(product), rounded[half]))
+    return np.clip(rounded / 100, 1, 1000)
+
+
+class Outcomes():
+    """ Draws the outcome of a signal for every path, with its lookups (win, gales, returns, applied result) """
+
+    def __init__(self, pools, pool_codes, paths, rng, params):
+        self.pools = pools
+        self.histories = pool_histories(pool_codes)
+        self.paths = paths
+        self.rng = rng
+        code = np.arange(OUTCOMES)
+        table = Signals(np.zeros(OUTCOMES, 'S10'), np.zeros(OUTCOMES, np.int16), np.zeros(OUTCOMES, np.int8),
+                        (code // 3).astype(np.int8), (code % 3).astype(np.int8), np.zeros(OUTCOMES, np.int32))
+        (self.r, self.applied, _) = returns(table, params)
+        self.win = code // 3 == WIN
+        self.gales = code % 3
+
+    def __call__(self, i):
+        history = self.histories[self.pools[i]]
+        return history[self.rng.integers(0, len(history), self.paths)]
+
+
+class Paths():
+    """
+    Balances of a batch of paths with their lowest point and max drawdown.
+    A path is broke once its balance reaches 0, and stays there
+    """
+
+    def __init__(self, paths, balance):
+        self.balance = np.full(paths, float(balance))
+        self.peak = self.balance.copy()
+        self.low = self.balance.copy()
+        self.drawdown = np.zeros(paths)
+        self.broke = np.zeros(paths, bool)
+
+    def update(self):
+        balance = self.balance
+        broke = balance <= 0
+        if broke.any():
+            balance[broke] = 0
+            self.broke |= broke
+        np.maximum(self.peak, balance, out=self.peak)
+        np.minimum(self.low, balance, out=self.low)
+        np.maximum(self.drawdown, 1 - balance / self.peak, out=self.drawdown)
+
+
+class Stops():
+    """ STOP WIN / STOP LOSS days of a batch and the minutes taken to STOP WIN """
+
+    def __init__(self):
+        self.wins = np.zeros(1441, np.int64)
+        self.days = [0, 0]
+
+    def add(self, win, loss, minutes):
+        wins = int(win.sum())
+        self.wins[minutes] += wins
+        self.days[0] += wins
+        self.days[1] += int(loss.sum())
+
+
+def legacy_kernel(outcomes, starts, days, slots, n, params, paths, stops):
+    """ backtest._kernel with every path advanced at once (one array element per path) """
+    p = params
+    balance = paths.balance
+    size = len(balance)
+    soros = np.zeros(size, bool)
+    count = np.zeros(size, np.int64)
+    soros_amount = np.zeros(size)
+    soros_start = np.zeros(size)
+    cycle = np.zeros(size)
+    day_balance = balance.copy()
+    stopped = np.zeros(size, bool)
+    bounds = np.append(starts, n)
+    day = first = -1
+    for g in range(len(starts)):
+        if days[g] != day:
+            # every day starts from scratch, like TradingBot.reset
+            (day, first) = (days[g], slots[g])
+            day_balance = balance.copy()
+            stopped[:] = False
+            soros[:] = False
+            count[:] = 0
+            cycle[:] = 0
+        active = ~(stopped | paths.broke)
+        if not active.any():
+            continue
+
+        group_balance = balance.copy()
+        amount = np.where(soros, soros_amount, balance * p.base_order)
+        last = np.zeros(size, bool)
+        for i in range(bounds[g], bounds[g + 1]):
+            code = outcomes(i)
+            direct = outcomes.win[code] & (outcomes.gales[code] == 0)
+            r = outcomes.r[code]
+            # the next order after a LOSS recovers what the cycle lost
+            is_cycle = active & (cycle > 0) & ~soros
+            order = np.where(is_cycle, cycle, amount)
+            cycle[is_cycle] = 0
+            # orders entered with SOROS don't use gales
+            change = np.where(soros, np.where(
+                direct, order * p.payout, -order), order * r)
+            balance += np.where(active & ~paths.broke, change, 0)
+            if p.cycle_loss:
+                lost = active & np.where(
+                    soros, ~direct, (outcomes.applied[code] == LOSS) & ~is_cycle)
+                cycle = np.where(lost, np.where(soros, np.maximum(
+                    soros_start - balance, 0), -order * r), cycle)
+            soros = np.where(active, np.where(
+                direct & ~is_cycle, count < p.max_soros, last), soros)
+            last = soros
+            paths.update()
+
+        begins = active & soros & (count == 0)
+        soros_start[begins] = group_balance[begins]
+        soros_amount = np.where(active, np.where(
+            soros, (amount + amount * p.payout) * (1 - p.soros_holding), 0), soros_amount)
+        count = np.where(active, np.where(soros, count + 1, 0), count)
+
+        win = active & (balance - day_balance >= day_balance *
+                        p.stop_win) if p.stop_win > 0 else np.zeros(size, bool)
+        loss = active & ~win & (day_balance - balance >= day_balance *
+                                p.stop_loss) if p.stop_loss > 0 else np.zeros(size, bool)
+        stopped |= win | loss
+        stops.add(win, loss, slots[g] - first)
+
+
+def live_kernel(outcomes, starts, days, slots, n, params, paths, stops):
+    """
+    backtest.simulate_live with every path advanced at once: MoneyManager
+    (take_amount, base_amount, on_result and check_stop) over arrays, where
+    NaN stands for None
+    """
+    p = params
+    balance = paths.balance
+    size = len(balance)
+    initial = balance.copy()
+    next_soros = np.full(size, np.nan)
+    pending = np.zeros(size, bool)
+    count = np.zeros(size, np.int64)
+    soros_start = np.full(size, np.nan)
+    cycle = np.full(size, np.nan)
+    stopped = np.zeros(size, bool)
+    # every stake of a position, back from the last gale, in units of that gale
+    stakes = sum(1 / p.gale_rate ** (p.max_gales - i)
+                 for i in range(p.max_gales + 1))
+
+    def reset_soros(mask):
+        count[mask] = 0
+        next_soros[mask] = np.nan
+        pending[mask] = False
+        soros_start[mask] = np.nan
+
+    bounds = np.append(starts, n)
+    day = first = -1
+    for g in range(len(starts)):
+        if days[g] != day:
+            (day, first) = (days[g], slots[g])
+            initial = balance.copy()
+            reset_soros(slice(None))
+            stopped[:] = False
+        active = ~(stopped | paths.broke)
+        if not active.any():
+            continue
+
+        # every order of the start time is entered before any result
+        (start, end) = (bounds[g], bounds[g + 1])
+        base = normalize(balance * p.base_order / (end - start))
+        amounts = []
+        kinds = []
+        for i in range(start, end):
+            soros = active & ~np.isnan(next_soros)
+            recover = active & ~soros & ~np.isnan(cycle)
+            amounts.append(np.where(soros, next_soros,
+                           np.where(recover, cycle, base)))
+            kinds.append(np.where(soros, SOROS, np.where(recover, CYCLE, BASE)))
+            next_soros[soros] = np.nan
+            pending[soros] = False
+            cycle[recover] = np.nan
+        codes = [outcomes(i) for i in range(start, end)]
+
+        placed = [active] * (end - start)
+        attempt = 0
+        while any(mask.any() for mask in placed):
+            for (j, code) in enumerate(codes):
+                mask = placed[j] & ~paths.broke
+                if not mask.any():
+                    placed[j] = mask
+                    continue
+                amount = amounts[j]
+                won = outcomes.win[code] & (outcomes.gales[code] == attempt)
+                profit = np.where(won, amount * p.payout, 0)
+                balance += np.where(mask, np.where(won, profit, -amount), 0)
+
+                # MoneyManager.on_result
+                wins = mask & won
+                direct = wins & ~pending & (attempt == 0) & (
+                    kinds[j] != CYCLE) & (count < p.max_soros)
+                capped = wins & ~pending & ~direct & (count >= p.max_soros)
+                losses = mask & ~won
+                can_gale = (attempt != p.max_gales) & (
+                    p.max_gales >= 1) & ((count == 0) | pending)
+                gales = losses & can_gale
+                closed = losses & ~can_gale
+                if p.cycle_loss:
+                    recover = closed & np.isnan(cycle)
+                    cycle = np.where(recover, np.where(np.isnan(soros_start), normalize(
+                        amount * stakes), normalize(soros_start - balance)), cycle)
+                reset = capped | ((gales | closed) & ~pending)
+                if reset.any():
+                    reset_soros(reset)
+                if direct.any():
+                    next_soros[direct] = normalize(
+                        (amount + profit)[direct] * (1 - p.soros_holding))
+                    soros_start[direct] = (balance - profit)[direct]
+                    count[direct] += 1
+                    pending |= direct
+
+                win = mask & ~stopped & (balance - initial >= initial *
+                                         p.stop_win) if p.stop_win else np.zeros(size, bool)
+                loss = mask & ~stopped & (initial - balance >= initial *
+                                          p.stop_loss) if p.stop_loss else np.zeros(size, bool)
+                stopped |= win | loss
+                stops.add(win & ~loss, loss, slots[g] - first)
+
+                # orders stopped for the day don't gale either
+                placed[j] = gales & ~stopped
+                amounts[j] = np.where(
+                    placed[j], normalize(amount * p.gale_rate), amount)
+                paths.update()
+            attempt += 1
+
+
+def run_batch(paths, seed, params, balance, ruin, rules):
+    """ Simulates a batch of paths, returning its per-path and aggregated metrics """
+    (signals, starts, pools, pool_codes, _) = shared
+    rng = np.random.default_rng(seed)
+    stops = Stops()
+    days = int(signals.day[-1]) + 1 if len(signals.day) else 0
+
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        if rules == 'legacy' and params.max_soros <= 0 and not params.cycle_loss \
+                and not params.stop_win and not params.stop_loss:
+            # no state between start times: every path at once
+            codes = sample(pools, pool_codes, paths, rng)
+            table = Signals(*(np.zeros(OUTCOMES, dtype) for dtype in ('S10', np.int16, np.int8)),
+                            result=np.repeat([0, 1], 3).astype(np.int8),
+                            gales=np.tile([0, 1, 2], 2).astype(np.int8),
+                            day=np.zeros(OUTCOMES, np.int32))
+            r = returns(table, params)[0][codes]
+            factors = 1 + params.base_order * \
+                np.add.reduceat(r, starts, axis=1)
+            start_balance = balance * \
+                np.hstack((np.ones((paths, 1)), np.cumprod(factors, axis=1)[:, :-1]))
+            sizes = np.diff(np.append(starts, len(pools)))
+            path = balance + \
+                np.cumsum(np.repeat(start_balance * params.base_order,
+                          sizes, axis=1) * r, axis=1)
+            path = np.hstack((np.full((paths, 1), balance), path))
+            # broke paths stay at 0
+            path[np.maximum.accumulate(path <= 0, axis=1)] = 0
+            peaks = np.maximum.accumulate(path, axis=1)
+            finals = path[:, -1]
+            drawdowns = ((peaks - path) / peaks).max(axis=1)
+            lows = path.min(axis=1)
+        else:
+            state = Paths(paths, balance)
+            kernel = live_kernel if rules == 'live' else legacy_kernel
+            kernel(Outcomes(pools, pool_codes, paths, rng, params), starts, signals.day[starts],
+                   signals.slot[starts].astype(np.int64), len(pools), params, state, stops)
+            (finals, drawdowns, lows) = (
+                state.balance, state.drawdown, state.low)
+
+    return {'finals': finals.astype(np.float32), 'drawdowns': drawdowns.astype(np.float32),
+            'ruined': int((lows <= balance * ruin).sum()), 'stop_wins': stops.wins, 'stop_days': stops.days,
+            'days': days * paths}
+
+
+def percentiles(values, points=(5, 25, 50, 75, 95, 99)):
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return {}
+    return {f'p{point}': float(value) for (point, value) in zip(points, np.percentile(values, points))}
+
+
+def histogram_percentiles(counts, points=(25, 50, 75, 90)):
+    total = counts.sum()
+    if total == 0:
+        return {}
+    cumulative = np.cumsum(counts)
+    return {f'p{point}': int(np.searchsorted(cumulative, total * point / 100)) for point in points}
+
+
+def monte_carlo(histories, params=Params(), paths=100000, balance=1000.0, ruin=0.5, rules=RULES,
+                workers=None, batch_size=None, seed=None):
+    """
+    Runs the paths in batches (of BATCH_PATHS, or capped by MAX_BATCH_CELLS
+    for the closed form) over a process pool,
+    returning risk of ruin, final balance and max drawdown percentiles and
+    the STOP WIN / STOP LOSS frequencies with the minutes taken to STOP WIN
+    """
+    (signals, pools) = combine(histories)
+    codes = outcome_codes(signals)
+    n_pools = int(pools.max()) + 1 if len(pools) else 0
+    longest = int(np.bincount(pools).max()) if len(pools) else 0
+    # outcome codes of every pool, padded with -1
+    pool_codes = np.full((n_pools, longest), -1, np.int8)
+    for pool in range(n_pools):
+        history = codes[pools == pool]
+        pool_codes[pool, :len(history)] = history
+
+    if rules == 'legacy' and params.max_soros <= 0 and not params.cycle_loss \
+            and not params.stop_win and not params.stop_loss:
+        cap = max(1, MAX_BATCH_CELLS // max(len(pools), 1))
+        batch_size = min(batch_size or cap, cap)
+    else:
+        batch_size = batch_size or BATCH_PATHS
+    batches = [min(batch_size, paths - start)
+               for start in range(0, paths, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+
+    blocks, specs = share(
+        [*signals, group_starts(signals), pools, pool_codes])
+    try:
+        with ProcessPoolExecutor(max_workers=workers or cpu_count(), initializer=attach, initargs=(specs,)) as executor:
+            results = list(executor.map(run_batch, batches, seeds, [params] * len(batches), [balance] * len(batches),
+                                        [ruin] * len(batches), [rules] * len(batches)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    finals = np.concatenate([result['finals'] for result in results])
+    drawdowns = np.concatenate([result['drawdowns'] for result in results])
+    stop_wins = sum(result['stop_wins'] for result in results)
+    days = max(sum(result['days'] for result in results), 1)
+    return {
+        'paths': paths,
+        'signals': len(pools),
+        'pools': n_pools,
+        'risk_of_ruin': sum(result['ruined'] for result in results) / paths,
+        'final_balance': percentiles(finals),
+        'max_drawdown': percentiles(drawdowns, (50, 75, 90, 95, 99)),
+        'stop_win_frequency': sum(result['stop_days'][0] for result in results) / days,
+        'stop_loss_frequency': sum(result['stop_days'][1] for result in results) / days,
+        'minutes_to_stop_win': histogram_percentiles(stop_wins),
+    }
+
+
+def parse_args(args=None):
+    parser = ArgumentParser(
+        description='Bootstraps the risk of ruin of a signal history')
+    parser.add_argument('signals', nargs='*', default=['signals.txt'],
+                        help='signals files, one per channel (looked up in data/ when not found)')
+    parser.add_argument('--paths', type=int, default=100000)
+    parser.add_argument('--balance', type=float, default=1000)
+    parser.add_argument('--ruin', type=float, default=0.5,
+                        help='a path is ruined once its balance falls to this share of the initial balance')
+    parser.add_argument('--base-order', type=float, default=BASE_ORDER)
+    parser.add_argument('--gale-rate', type=float, default=GALE_RATE)
+    parser.add_argument('--payout', type=float, default=PAYOUT)
+    parser.add_argument('--max-gales', type=int, default=MAX_GALES)
+    parser.add_argument('--soros-holding', type=float,
+                        default=SOROS_HOLDING)
+    parser.add_argument('--max-soros', type=int, default=MAX_SOROS)
+    parser.add_argument('--cycle-loss', action='store_true',
+                        default=CYCLE_LOSS)
+    parser.add_argument('--stop-win', type=float, default=STOP_WIN)
+    parser.add_argument('--stop-loss', type=float, default=STOP_LOSS)
+    parser.add_argument('--rules', choices=['live', 'legacy'], default=RULES)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default=None,
+                        help='also write the report to this JSON file')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    params = Params(args.base_order, args.gale_rate, args.payout, args.max_gales,
+                    args.soros_holding, args.max_soros, args.cycle_loss, args.stop_win, args.stop_loss)
+    histories = [load_signals(signals_path(name)) for name in args.signals]
+
+    start = perf_counter()
+    report = monte_carlo(histories, params, args.paths, args.balance, args.ruin, args.rules,
+                         args.workers, args.batch_size, args.seed)
+    report['seconds'] = round(perf_counter() - start, 2)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
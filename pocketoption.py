@@ -8,11 +8,16 @@ from selenium.webdriver.chrome.service import Service
 from dotenv import load_dotenv
 from os import getenv
 import sys
-from urllib.parse import quote
-from time import sleep, time
+from urllib.parse import quote, urljoin
+from time import sleep, time, perf_counter
 from datetime import datetime
+from threading import Condition, Lock, Thread
+from heapq import heappush, heappop
+from itertools import count
 from debug import log
-from utils import get_time
+import tracing
+from utils import get_time, clock
+from broker import Broker
 
 linux = sys.platform == 'linux'
 
@@ -24,82 +29,331 @@ load_dotenv()
 TIMEOUT = 30
 ERROR_LIMIT = 2
 
+# seconds between reads of the deals buffered in the page
+RESULT_POLL = 0.2
+# seconds to keep drained deals that did not match any order yet
+DEALS_TTL = 600
+
+# max age (in seconds) of the cached balance before it is read again from the page
+BALANCE_MAX_AGE = float(getenv('BALANCE_MAX_AGE', 5))
+
+# place orders with a single injected script, falling back to
+# the element by element path when it fails
+FAST_PLACEMENT = getenv('FAST_PLACEMENT', 'True') == 'True'
+
+# amount of logged in browser sessions orders are spread across
+BROWSER_SESSIONS = max(int(getenv('BROWSER_SESSIONS', 1)), 1)
+
+# trading cabinet page (e.g. the local stand-in of benchmarks/cabinet.py)
+POCKETOPTION_URL = getenv('POCKETOPTION_URL',
+                          'https://pocketoption.com/pt/cabinet/demo-quick-high-low/')
+# chrome binary used on linux
+CHROME_BINARY = getenv('CHROME_BINARY', './ChromePortableGCPM/data/chrome')
+
+# driver access priorities (lower values are served first)
+PRIORITY_ORDER = 0
+PRIORITY_RESULT = 1
+PRIORITY_PREPARE = 2
+PRIORITY_BALANCE = 3
+
+
+class DriverQueue():
+    """
+    Lock-backed access queue for the driver. Waiting callers are served by
+    priority and then by arrival order, and the time each caller spends
+    waiting for and holding the driver is recorded (queue_wait_<caller> and
+    queue_hold_<caller> in bot:latency)
+    """
+
+    def __init__(self):
+        self.condition = Condition()
+        self.waiting = []
+        self.tickets = count()
+        self.owner = None
+        # callers routed to this driver that have not released it yet
+        self.users = 0
+
+    def reserve(self):
+        with self.condition:
+            self.users += 1
+
+    def acquire(self, priority, caller):
+        requested = perf_counter()
+        with self.condition:
+            ticket = (priority, next(self.tickets))
+            heappush(self.waiting, ticket)
+            while self.owner is not None or self.waiting[0] != ticket:
+                self.condition.wait()
+            heappop(self.waiting)
+            self.owner = caller
+        return requested, perf_counter()
+
+    def release(self, caller, requested, acquired):
+        hold = perf_counter() - acquired
+        wait = acquired - requested
+        with self.condition:
+            self.owner = None
+            self.users -= 1
+            self.condition.notify_all()
+        tracing.tracer.record(f'queue_wait_{caller}', wait)
+        tracing.tracer.record(f'queue_hold_{caller}', hold)
+        log(f'Driver used by {caller}: waited {wait * 1000:.0f}ms, held {hold * 1000:.0f}ms', False)
+
+
+class DriverAccess():
+    def __init__(self, wrapper, priority, caller):
+        self.wrapper = wrapper
+        self.priority = priority
+        self.caller = caller
+        # counted as a user from now on so the pool routes other callers elsewhere
+        wrapper.queue.reserve()
+
+    def __enter__(self):
+        self.requested, self.acquired = self.wrapper.queue.acquire(
+            self.priority, self.caller)
+        tracing.mark('driver_wait')
+        return self.wrapper
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.wrapper.queue.release(self.caller, self.requested, self.acquired)
 
-class UseDriver():
-    busy = False
 
-    def __init__(self, driver, retries=1, script=None):
+class UseDriver():
+    def __init__(self, driver, retries=1, script=None, queue=None):
         self.driver = driver
         self.retries = retries
         self.script = script
+        self.queue = queue or DriverQueue()
+        # how many times the page was reloaded (which resets the order ticket)
+        self.refreshes = 0
+        # consecutive and total failed runs, and when the last run succeeded
+        self.errors = 0
+        self.failures = 0
+        self.last_ok = time()
 
-    def __enter__(self):
-        while self.busy:
-            sleep(0.1)
-        self.busy = True
-        return self
-
-    def __exit__(self, exc_type, exc_value, exc_tb):
-        self.busy = False
+    def __call__(self, priority, caller):
+        return DriverAccess(self, priority, caller)
 
     def run(self, fn):
         exc = None
         retry = False
         tries = self.retries
-        log('Entering retry loop', False)
         while tries >= 0:
             try:
                 if retry:
+                    self.refreshes += 1
                     self.driver.refresh()
                     WebDriverWait(self.driver, TIMEOUT).until(
                         EC.presence_of_element_located((By.CSS_SELECTOR, ".btn-call")))
                     if self.script:
                         self.driver.execute_script(self.script)
                 log(f'Returnig from function {fn.__name__}', False)
-                return fn(self.driver)
+                result = fn(self.driver)
+                self.errors = 0
+                self.last_ok = time()
+                return result
             except Exception as e:
                 log(f'Driver error: {repr(e)} - {e}', False)
                 exc = e
                 tries -= 1
                 retry = True
+        self.errors += 1
+        self.failures += 1
         now = datetime.now().time().strftime('%H-%M-%S')
         log(f'Saving screenshot {now}...', False)
         self.driver.save_screenshot(f'{fn.__name__}-{now}.png')
         log(f'Current cookies: {self.driver.get_cookies()}', False)
         raise WebDriverException(msg=f'{repr(exc)} - {exc}')
 
+    @property
+    def healthy(self):
+        return self.errors < ERROR_LIMIT
+
+    def replace(self, driver):
+        """ Swaps in a new browser for this session (must hold its driver access) """
+        self.quit()
+        self.driver = driver
+        # the new page has a fresh order ticket
+        self.refreshes += 1
+        self.errors = 0
+        self.last_ok = time()
+
     def quit(self):
         log('Quitting driver...')
-        self.driver.quit()
+        try:
+            self.driver.quit()
+        except Exception as e:
+            log(f'Quit error: {e}', False)
+
+
+class SessionPool():
+    """
+    Browser sessions logged in the same account. Every caller is routed to
+    the healthy session with the fewest users, so orders of the same minute
+    can be placed in parallel and reads go to an idle session
+    """
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.lock = Lock()
+
+    def __call__(self, priority, caller, prefer=None):
+        with self.lock:
+            healthy = [
+                session for session in self.sessions if session.healthy] or self.sessions
+            if prefer in healthy and prefer.queue.users == 0:
+                session = prefer
+            else:
+                session = min(healthy, key=lambda session: session.queue.users)
+            return session(priority, caller)
 
+    def quit(self):
+        for session in self.sessions:
+            session.quit()
 
-class PocketOption():
+
+class PocketOption(Broker):
     orders = []
-    url = 'https://pocketoption.com/pt/cabinet/demo-quick-high-low/'
-    driver = None
+    orders_lock = Lock()
+    url = POCKETOPTION_URL
+    pool = None
+    workers = BROWSER_SESSIONS
     demo = True
     display = None
     check_errors = 0
-
-    # script for automatically adding a unique class
-    # to every new order created in the deals list
+    # end time/pair/amount class -> [(profit, received at)] of the drained deals
+    closed_deals = {}
+    deals_lock = Lock()
+    # held while unhealthy sessions are restarted
+    healing = Lock()
+    # last known balance and when it was read
+    balance = None
+    balance_time = 0
+    # session -> (pair, timeframe, refreshes) currently selected in its order ticket
+    tickets = {}
+
+    # script for automatically adding a unique class to every new order created
+    # in the deals list and buffering the result of the closed ones, so they can
+    # be drained in bulk with drain_script (along with the balances, kept up to
+    # date by another observer)
     script = '''
+        window.closedDeals = window.closedDeals || []
+        // class -> closed deals buffered
+        window.dealCounts = window.dealCounts || {}
+        window.balances = {}
+        ;['demo', 'real'].forEach(mode => {
+            let balance = document.querySelector(`.js-balance-${mode}`)
+            if (!balance) return
+            let read = () => { window.balances[mode] = balance.textContent }
+            read()
+            new MutationObserver(read).observe(balance, { childList: true, characterData: true, subtree: true })
+        })
+
         new MutationObserver(mutations => {
             mutations.forEach(mutation => {
-                if (mutation.addedNodes.length) {
-                    mutation.addedNodes.forEach(node => {
-                        if (node.classList.contains('deals-list__item')) {
-                            let pair = node.querySelector('.item-row:first-of-type div > a')
-                            let amount = node.querySelector('.item-row:last-of-type div:first-of-type')
-                            let endTime = node.querySelector('.item-row:first-of-type div:last-of-type')
-            
-                            let cls = `o${endTime.textContent.replace(":", "-")}_${pair.textContent.replace("/", "").replace(" ", "-")}_${amount.textContent.replace("$", "").replace(".", "-")}`
-                            node.classList.add(cls)
+                mutation.addedNodes.forEach(node => {
+                    if (node.classList && node.classList.contains('deals-list__item')) {
+                        let pair = node.querySelector('.item-row:first-of-type div > a')
+                        let amount = node.querySelector('.item-row:last-of-type div:first-of-type')
+                        let endTime = node.querySelector('.item-row:first-of-type div:last-of-type')
+                        let profit = node.querySelector('.centered')
+
+                        let cls = `o${endTime.textContent.replace(":", "-")}_${pair.textContent.replace("/", "").replace(" ", "-")}_${amount.textContent.replace("$", "").replace(".", "-")}`
+                        node.classList.add(cls)
+                        // switching tabs renders the whole list again, so a deal is only
+                        // buffered while fewer of its class were buffered than are listed
+                        let listed = profit && Array.from(document.getElementsByClassName(cls))
+                            .filter(item => item.querySelector('.centered')).length
+                        if (profit && (window.dealCounts[cls] || 0) < listed) {
+                            window.dealCounts[cls] = (window.dealCounts[cls] || 0) + 1
+                            window.closedDeals.push([cls, profit.textContent])
                         }
-                    })
-                }
+                    }
+                })
             })
-        }).observe(document.querySelector('.deals-list'), { childList: true});
+        }).observe(document.querySelector('.deals'), { childList: true, subtree: true });
+
+        // keep the closed deals tab open so settled deals are added to the observed list
+        document.querySelectorAll('.deals a.flex-centered')[1].click()
+    '''
+
+    # returns and clears the deals buffered by the observer, plus the current balances
+    drain_script = 'return [(window.closedDeals || []).splice(0), window.balances || {}]'
+
+    # returns the unique class and the profit of every tagged deal in the list
+    deals_script = '''
+        return Array.from(document.querySelectorAll('.deals-list__item')).map(node => {
+            let cls = Array.from(node.classList).find(c => /^o\\d{2}-\\d{2}_/.test(c))
+            let profit = node.querySelector('.centered')
+            return cls && profit ? [cls, profit.textContent] : null
+        }).filter(deal => deal)
+    '''
+
+    # applies amount, pair, timeframe and direction inside the page and reports
+    # back {ok, stage, error, timings}, so an order costs one round trip to the driver.
+    # Steps with null arguments are skipped (e.g. pair and timeframe of a pre-armed ticket)
+    place_script = '''
+        const [amount, pairLabel, pairSearch, timeframe, action, done] = arguments
+        const setValue = (input, value) => {
+            Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set.call(input, value)
+            input.dispatchEvent(new Event('input', { bubbles: true }))
+            input.dispatchEvent(new Event('change', { bubbles: true }))
+        }
+        const find = async (selector, match, timeout = 3000) => {
+            const start = Date.now()
+            while (Date.now() - start < timeout) {
+                const found = Array.from(document.querySelectorAll(selector)).find(match)
+                if (found) return found
+                await new Promise(resolve => setTimeout(resolve, 20))
+            }
+            return null
+        }
+        const escape = () => document.activeElement.dispatchEvent(
+            new KeyboardEvent('keydown', { key: 'Escape', keyCode: 27, bubbles: true }))
+        // seconds taken by every step, for the latency tracing
+        const timings = {}
+        let last = performance.now()
+        const lap = step => {
+            const now = performance.now()
+            timings[step] = (now - last) / 1000
+            last = now
+        }
+
+        let stage = 'amount'
+        ;(async () => {
+            if (amount !== null) {
+                setValue(document.querySelector('.block--bet-amount .value input'), amount)
+                lap('amount_input')
+            }
+
+            if (pairLabel !== null) {
+                stage = 'pair'
+                document.querySelector('.pair-number-wrap').click()
+                setValue(await find('.search__field', () => true), pairSearch)
+                const pair = await find('.alist__item:not(.alist__item--no-active) .alist__label',
+                    label => label.textContent.trim() === pairLabel)
+                if (pair) pair.click()
+                escape()
+                if (!pair) return done({ ok: false, stage, error: 'Pair not found' })
+                lap('select_pair')
+
+                stage = 'timeframe'
+                const flag = document.querySelector('.block--expiration-inputs .fa-flag-checkered')
+                if (flag) flag.click()
+                document.querySelector('.block--expiration-inputs .control').click()
+                const tf = await find('.dops__timeframes-item', item => item.textContent.trim() === `M${timeframe}`)
+                if (!tf) return done({ ok: false, stage, error: 'Timeframe not found' })
+                tf.click()
+                lap('select_timeframe')
+            }
+
+            if (action !== null) {
+                stage = 'click'
+                document.querySelector(`.btn-${action}`).click()
+                lap('click')
+            }
+            done({ ok: true, stage, timings })
+        })().catch(e => done({ ok: false, stage, error: String(e) }))
     '''
 
     def __init__(self, ssid, demo=True):
@@ -107,7 +361,17 @@ class PocketOption():
         self.demo = demo
         if not self.demo:
             self.url = self.url.replace('demo-', '')
-        self.driver = UseDriver(self.create_driver(), script=self.script)
+        self.start_display()
+        self.pool = self.create_pool()
+
+    def start_display(self):
+        if linux and self.display is None:
+            self.display = Display(size=(1400, 800), visible=0)
+            self.display.start()
+
+    def create_pool(self):
+        return SessionPool([UseDriver(self.create_driver(), script=self.script)
+                            for _ in range(BROWSER_SESSIONS)])
 
     def create_driver(self):
         cookies = [
@@ -139,10 +403,9 @@ class PocketOption():
         options = webdriver.ChromeOptions()
 
         if linux:
-            self.display = Display(size=(1400, 800), visible=0)
-            self.display.start()
-            # comment this like with if the binary is globally available
-            options.binary_location = "./ChromePortableGCPM/data/chrome"
+            # set CHROME_BINARY to an empty value if the binary is globally available
+            if CHROME_BINARY:
+                options.binary_location = CHROME_BINARY
             options.add_argument('--single-process')
         else:
             options.add_argument('--headless')
@@ -159,7 +422,8 @@ class PocketOption():
 
         driver = webdriver.Chrome(
             options=options, service=Service(log_path='NUL'))
-        driver.get('https://pocketoption.com/404')
+        # cookies can only be set for the domain of the current page
+        driver.get(urljoin(self.url, '/404'))
 
         for cookie in cookies:
             driver.add_cookie(cookie)
@@ -176,6 +440,34 @@ class PocketOption():
 
         return driver
 
+    def pair_label(self, pair):
+        """ Formats the pair as shown in the pairs list (e.g. EURUSD-OTC -> EUR/USD OTC) """
+        return pair[:3] + '/' + pair[3:6] + pair[6:].replace('-', ' ')
+
+    def place_order(self, driver, amount, pair, action, timeframe):
+        """
+        Places the order with a single script call. Returns False when the order was
+        not placed and the element by element path can be safely used instead.
+        None arguments skip their step (no pair means the ticket is already armed,
+        no action only stages the ticket)
+        """
+        start = perf_counter()
+        result = driver.execute_async_script(
+            self.place_script,
+            str(amount) if amount is not None else None,
+            self.pair_label(pair) if pair is not None else None,
+            pair.replace('-OTC', '') if pair is not None else None,
+            timeframe, action)
+        log(f'Fast placement: {result} in {(perf_counter() - start) * 1000:.0f}ms', False)
+
+        if result and result['ok']:
+            tracing.split(result.get('timings') or {})
+            return True
+        if result and result['stage'] == 'click':
+            # the button may have been clicked, retrying could open a duplicated order
+            raise WebDriverException(msg=f'Fast placement failed on click: {result["error"]}')
+        return False
+
     def select_pair(self, pair, driver):
         try:
             pair_selector = driver.find_element(
@@ -185,8 +477,7 @@ class PocketOption():
             pair_search = driver.find_element(
                 By.CSS_SELECTOR, '.search__field')
 
-            parsed_pair = pair[:3] + '/' + \
-                pair[3:6] + pair[6:].replace('-', ' ')
+            parsed_pair = self.pair_label(pair)
 
             pair_search.send_keys(pair.replace('-OTC', ''))
 
@@ -227,114 +518,278 @@ class PocketOption():
             log('Select timeframe error:', False)
             raise e
 
-    def get_balance(self):
+    def update_balance(self, balance):
+        if balance is not None:
+            self.balance = float(balance)
+            self.balance_time = time()
+
+    def get_balance(self, fresh=False):
+        """
+        Returns the cached balance when it is at most BALANCE_MAX_AGE seconds old,
+        only reading it from the page otherwise or when a fresh value is requested
+        """
+        if not fresh and self.balance is not None and time() - self.balance_time <= BALANCE_MAX_AGE:
+            return self.balance
+
         try:
-            with self.driver as wrapper:
+            with self.pool(PRIORITY_BALANCE, 'balance') as wrapper:
                 def b(driver): return driver.find_element(
                     By.CSS_SELECTOR, f'.js-balance-{"demo" if self.demo else "real"}')
                 balance = wrapper.run(b)
-                return float(balance.text)
-        except (WebDriverException, AttributeError) as e:
+                self.update_balance(balance.text)
+                return self.balance
+        except (WebDriverException, AttributeError, ValueError) as e:
             log(f'Balance Error: {e}', False)
             return None
 
+    def armed_session(self, pair, timeframe):
+        """ Session that still has pair and timeframe selected in its order ticket """
+        for session in self.pool.sessions:
+            if self.tickets.get(session) == (pair, timeframe, session.refreshes):
+                return session
+        return None
+
+    def is_armed(self, pair, timeframe):
+        return self.armed_session(pair, timeframe) is not None
+
+    def arm(self, wrapper, pair, timeframe):
+        self.tickets[wrapper] = (pair, timeframe, wrapper.refreshes)
+
+    def prepare(self, pair, timeframe):
+        """
+        Selects pair and timeframe ahead of an order, so only the amount
+        and the direction are left when it is placed. The amount is not
+        staged: it is only known once the order fires (SOROS, CYCLE LOSS and
+        the split between the orders of the minute are settled then)
+        """
+        if self.is_armed(pair, timeframe):
+            return True
+        try:
+            with self.pool(PRIORITY_PREPARE, 'prepare') as wrapper:
+                self.tickets.pop(wrapper, None)
+
+                def prepare_ticket(driver):
+                    self.select_pair(pair, driver)
+                    self.select_timeframe(timeframe, driver)
+
+                placed = False
+                if FAST_PLACEMENT:
+                    try:
+                        placed = self.place_order(
+                            wrapper.driver, None, pair, None, timeframe)
+                    except TimeoutException as e:
+                        log(f'Fast prepare timed out: {e}', False)
+                if not placed:
+                    wrapper.run(prepare_ticket)
+                self.arm(wrapper, pair, timeframe)
+            log(f'Ticket armed for {pair} M{timeframe}', False)
+            return True
+        except WebDriverException as e:
+            log(f'Prepare Error: {e}', False)
+            return False
+
     def buy(self, amount, pair, action, timeframe):
         try:
-            with self.driver as wrapper:
+            with self.pool(PRIORITY_ORDER, 'buy', prefer=self.armed_session(pair, timeframe)) as wrapper:
+                armed = self.tickets.pop(wrapper, None) == (
+                    pair, timeframe, wrapper.refreshes)
+                refreshes = wrapper.refreshes
+
                 def buy_pair(driver):
                     amount_field = driver.find_element(
                         By.CSS_SELECTOR, '.block--bet-amount .value input')
                     amount_field.send_keys(Keys.CONTROL, 'a', Keys.BACKSPACE)
                     amount_field.send_keys(amount)
+                    tracing.mark('amount_input')
 
-                    self.select_pair(pair, driver)
-                    self.select_timeframe(timeframe, driver)
+                    # a reload during the retries resets the armed ticket
+                    if not armed or wrapper.refreshes != refreshes:
+                        self.select_pair(pair, driver)
+                        tracing.mark('select_pair')
+                        self.select_timeframe(timeframe, driver)
+                        tracing.mark('select_timeframe')
 
                     driver.find_element(
                         By.CSS_SELECTOR, f'.btn-{action}').click()
-
-                wrapper.run(buy_pair)
-
-            id = len(self.orders)
-            self.orders.append({'amount': amount, 'active': pair,
-                               'direction': action, 'time': time(),  'timeframe': timeframe})
+                    tracing.mark('click')
+
+                placed = False
+                if FAST_PLACEMENT:
+                    try:
+                        placed = self.place_order(
+                            wrapper.driver, amount, pair if not armed else None, action, timeframe)
+                    except TimeoutException as e:
+                        log(f'Fast placement timed out: {e}', False)
+                if not placed:
+                    wrapper.run(buy_pair)
+                self.arm(wrapper, pair, timeframe)
+
+            with self.orders_lock:
+                id = len(self.orders)
+                self.orders.append({'amount': amount, 'active': pair,
+                                   'direction': action, 'time': clock.time(),  'timeframe': timeframe})
             return True, id
         except WebDriverException as e:
             log(f'Buy Error: {e}', False)
             return False, None
 
-    def check_binary_order(self, id):
-        try:
-            log(f'Check for order id {id}', False)
-            order = self.orders[id]
-
-            if time() - order['time'] < order['timeframe'] * 60:
-                # waits for order to finish (plus 1 second of error margin)
-                sleep(order['timeframe'] * 60 - (time() - order['time']) + 1)
-
-            with self.driver as wrapper:
-                def check(driver: webdriver.Chrome):
-                    # switch closed deals tab
-                    driver.find_elements(
-                        By.CSS_SELECTOR, '.deals a.flex-centered')[1].click()
+    def order_class(self, order):
+        return f'o{get_time(order["time"] + order["timeframe"] * 60).replace(":", "-")}_{order["active"]}_{"{:.2f}".format(order["amount"]).replace(".", "-")}'
 
-                    order_class = f'.o{get_time(order["time"] + order["timeframe"] * 60).replace(":", "-")}_{order["active"]}_{"{:.2f}".format(order["amount"]).replace(".", "-")}'
-
-                    log(
-                        f'Checking deals for {order_class}', False)
-
-                    WebDriverWait(driver, TIMEOUT).until(
-                        EC.presence_of_element_located((By.CSS_SELECTOR, order_class)))
-
-                    deal = driver.find_element(
-                        By.CSS_SELECTOR, order_class)
-
-                    # look for the profit from the order
-                    profit_elem = deal.find_element(
-                        By.CSS_SELECTOR, '.centered')
-
-                    pair = deal.find_element(
-                        By.CSS_SELECTOR, '.item-row:first-of-type div > a')
+    def check_binary_order(self, id):
+        order = self.orders[id]
 
-                    amount = deal.find_element(
-                        By.CSS_SELECTOR, '.item-row:last-of-type div:first-of-type')
+        if clock.time() - order['time'] < order['timeframe'] * 60:
+            # waits for order to finish (plus 1 second of error margin)
+            clock.sleep(order['timeframe'] * 60 - (clock.time() - order['time']) + 1)
 
-                    end_time = deal.find_element(
-                        By.CSS_SELECTOR, '.item-row:first-of-type div:last-of-type')
+        return self.check_binary_orders([id])[id]
 
-                    order['profit_amount'] = float(
-                        profit_elem.text.replace('$', ''))
+    def drain_deals(self, driver):
+        # the clock of the orders, so the result stage is right under an accelerated clock too
+        now = clock.time()
+        (deals, balances) = driver.execute_script(self.drain_script)
+        try:
+            self.update_balance(balances.get('demo' if self.demo else 'real'))
+        except (AttributeError, TypeError, ValueError) as e:
+            # a bad balance read doesn't lose the deals drained with it
+            log(f'Balance Error: {e}', False)
 
-                    log(f'Result: {end_time.text} | {pair.text} | In = {amount.text} | Out = {profit_elem.text}', False)
+        with self.deals_lock:
+            for (cls, profit) in deals:
+                self.closed_deals.setdefault(cls, []).append((profit, now))
+
+            # forget deals that never matched any order
+            for cls in list(self.closed_deals):
+                self.closed_deals[cls] = [
+                    deal for deal in self.closed_deals[cls] if now - deal[1] < DEALS_TTL]
+                if not self.closed_deals[cls]:
+                    del self.closed_deals[cls]
+
+    def scan_deals(self, driver):
+        # switch closed deals tab
+        driver.find_elements(
+            By.CSS_SELECTOR, '.deals a.flex-centered')[1].click()
+
+        now = clock.time()
+        scanned = {}
+        for (cls, profit) in driver.execute_script(self.deals_script):
+            scanned.setdefault(cls, []).append((profit, now))
+        with self.deals_lock:
+            self.closed_deals.update(scanned)
+
+    def match_deals(self, missing):
+        with self.deals_lock:
+            for cls in list(missing):
+                deals = self.closed_deals.get(cls)
+                while deals and missing[cls]:
+                    (profit, received) = deals.pop(0)
+                    order = missing[cls].pop()
+                    order['profit_amount'] = float(profit.replace('$', ''))
+                    # from the expiration of the order to its result being read from the page
+                    tracing.tracer.record(
+                        'result', clock.real(received - order['time'] - order['timeframe'] * 60))
+                    log(f'Result: {cls} | Out = {profit}', False)
+                if not deals:
+                    self.closed_deals.pop(cls, None)
+                if not missing[cls]:
+                    del missing[cls]
+
+    def check_binary_orders(self, ids):
+        """
+        Reads the results of all the given (already expired) orders from the deals
+        buffered in the page, draining them with a single script call per poll.
+        The whole closed deals list is only scanned when a result takes too long
+        """
+        log(f'Check for order ids {ids}', False)
+        orders = {id: self.orders[id] for id in ids}
+
+        missing = {}
+        for order in orders.values():
+            if 'profit_amount' not in order:
+                missing.setdefault(self.order_class(order), []).append(order)
 
-                wrapper.run(check)
+        log(f'Checking deals for {list(missing)}', False)
 
+        try:
+            deadline = time() + TIMEOUT
+            self.match_deals(missing)
+            while missing and time() < deadline:
+                with self.pool(PRIORITY_RESULT, 'results') as wrapper:
+                    self.drain_deals(wrapper.driver)
+                self.match_deals(missing)
+                if missing:
+                    sleep(RESULT_POLL)
+
+            if missing:
+                log(f'Deals not received, scanning closed deals list', False)
+                with self.pool(PRIORITY_RESULT, 'results') as wrapper:
+                    wrapper.run(self.scan_deals)
+                self.match_deals(missing)
+        except Exception as e:
+            # the orders still missing fail below, so their positions are closed as unknown
+            log(f'Check order error: {repr(e)}', False)
+
+        results = {}
+        for id, order in orders.items():
             if 'profit_amount' not in order:
-                self.check_errors += 1
-                return None
+                results[id] = None
+                continue
 
             if order['profit_amount'] > 0:
                 order['result'] = 'win'
             else:
                 order['result'] = 'loss'
+            results[id] = order
 
-            self.check_errors = 0
-            return order
-        except WebDriverException as e:
-            log(f'Check order error: {e}', False)
+        if None in results.values():
             self.check_errors += 1
             if self.check_errors == ERROR_LIMIT:
                 log('Restarting driver...', False)
                 self.restart(update_token=True)
-            return None
+        else:
+            self.check_errors = 0
+            if not all(session.healthy for session in self.pool.sessions) and self.healing.acquire(blocking=False):
+                # starting a browser takes a while, the results are returned meanwhile
+                Thread(target=self.heal, name='Session Healer',
+                       daemon=True).start()
+
+        return results
+
+    def heal(self):
+        """ Restarts the browser of every session that failed ERROR_LIMIT runs in a row (holding healing) """
+        try:
+            for (index, session) in enumerate(self.pool.sessions):
+                if not session.healthy:
+                    log(f'Restarting unhealthy session {index}...', False)
+                    try:
+                        with session(PRIORITY_RESULT, 'heal'):
+                            session.replace(self.create_driver())
+                    except Exception as e:
+                        log(f'Session restart error: {e}', False)
+        finally:
+            self.healing.release()
 
     def quit(self):
-        self.driver.quit()
+        self.pool.quit()
         if self.display:
             self.display.stop()
+            self.display = None
 
     def restart(self, update_token=False):
-        self.driver = UseDriver(self.create_driver())
+        """
+        Replaces every session with a new browser (starting the display again
+        after quit). An old session is only quit once the callers already
+        using it are done, and heal can't run while the pool is swapped
+        """
+        with self.healing:
+            old = self.pool
+            self.tickets = {}
+            self.start_display()
+            self.pool = self.create_pool()
+            for session in old.sessions:
+                with session(PRIORITY_RESULT, 'restart'):
+                    session.quit()
 
 
 # if __name__ == '__main__':
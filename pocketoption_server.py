@@ -0,0 +1,99 @@
+"""
+Local stand-in for the PocketOption websocket, speaking the same subset of the
+protocol used by pocketoption_ws.PocketOptionClient, so the client (and the
+bot with BROKER=websocket) can be run offline:
+
+    python pocketoption_server.py --port 8765 --time-scale 60
+    POCKETOPTION_WS_URL=ws://localhost:8765 BROKER=websocket python main.py
+"""
+from argparse import ArgumentParser
+from asyncio import run, sleep, ensure_future, Future
+from json import loads, dumps
+from random import random
+from uuid import uuid4
+import websockets
+
+
+class StandInServer():
+    def __init__(self, balance=1000, payout=0.92, win_rate=0.5, time_scale=1, latency=0):
+        self.balance = balance
+        self.payout = payout
+        self.win_rate = win_rate
+        # how many times faster than real time orders expire
+        self.time_scale = time_scale
+        # seconds added before answering every request
+        self.latency = latency
+
+    async def emit(self, ws, event, payload, binary=False):
+        if binary:
+            # the platform sends most payloads as a binary attachment
+            await ws.send('451-' + dumps([event, {'_placeholder': True, 'num': 0}]))
+            await ws.send(dumps(payload).encode())
+        else:
+            await ws.send('42' + dumps([event, payload]))
+
+    async def handle(self, ws):
+        settlements = set()
+        await ws.send('0' + dumps({'sid': uuid4().hex, 'upgrades': [], 'pingInterval': 25000, 'pingTimeout': 20000}))
+        async for message in ws:
+            if message == '40':
+                await ws.send('40' + dumps({'sid': uuid4().hex}))
+            elif message.startswith('42'):
+                (event, payload) = loads(message[2:])
+                if self.latency:
+                    await sleep(self.latency)
+                if event == 'auth':
+                    await self.emit(ws, 'successauth', {'id': uuid4().hex}, binary=True)
+                    await self.update_balance(ws, payload['isDemo'])
+                elif event == 'openOrder':
+                    settle = await self.open_order(ws, payload)
+                    if settle:
+                        # keeps a reference until the order is settled
+                        task = ensure_future(settle)
+                        settlements.add(task)
+                        task.add_done_callback(settlements.discard)
+
+    async def update_balance(self, ws, demo):
+        await self.emit(ws, 'successupdateBalance', {'isDemo': demo, 'balance': round(self.balance, 2)}, binary=True)
+
+    async def open_order(self, ws, order):
+        if order['amount'] < 1 or order['amount'] > self.balance:
+            await self.emit(ws, 'failopenOrder', {'requestId': order['requestId'], 'error': 'Invalid amount'}, binary=True)
+            return None
+
+        deal = {'id': uuid4().hex, 'requestId': order['requestId'], 'asset': order['asset'], 'amount': order['amount'],
+                'command': 0 if order['action'] == 'call' else 1, 'openTime': None, 'closeTime': None}
+        self.balance -= order['amount']
+        await self.emit(ws, 'successopenOrder', deal, binary=True)
+        await self.update_balance(ws, order['isDemo'])
+
+        async def settle():
+            await sleep(order['time'] / self.time_scale)
+            won = random() < self.win_rate
+            profit = round(order['amount'] * self.payout, 2) if won else -order['amount']
+            self.balance += order['amount'] + profit
+            await self.emit(ws, 'successcloseOrder', {'profit': profit, 'deals': [{**deal, 'profit': profit}]}, binary=True)
+            await self.update_balance(ws, order['isDemo'])
+
+        return settle()
+
+    async def serve(self, host='localhost', port=8765):
+        async with websockets.serve(self.handle, host, port):
+            await Future()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Local PocketOption websocket stand-in')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--balance', type=float, default=1000)
+    parser.add_argument('--payout', type=float, default=0.92)
+    parser.add_argument('--win-rate', type=float, default=0.5)
+    parser.add_argument('--time-scale', type=float, default=1)
+    parser.add_argument('--latency', type=float, default=0)
+    args = parser.parse_args()
+
+    server = StandInServer(args.balance, args.payout,
+                           args.win_rate, args.time_scale, args.latency)
+    print(f'Listening on ws://{args.host}:{args.port}')
+    run(server.serve(args.host, args.port))
@@ -0,0 +1,256 @@
+from asyncio import new_event_loop, run_coroutine_threadsafe, wait_for, shield, sleep
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import Thread, Lock
+from itertools import count
+from dotenv import load_dotenv
+from os import getenv
+from time import time
+from json import loads, dumps
+from debug import log
+from broker import Broker
+import websockets
+
+load_dotenv()
+
+WS_URL = getenv('POCKETOPTION_WS_URL',
+                'wss://api-l.po.market/socket.io/?EIO=4&transport=websocket')
+WS_UID = int(getenv('POCKETOPTION_UID', 0))
+
+TIMEOUT = 30
+# seconds before every reconnection attempt after the socket drops (the last one repeats)
+RECONNECT_DELAYS = (1, 2, 5, 10, 30, 60)
+
+
+def to_asset(pair):
+    """ Formats the pair as the platform asset name (e.g. EURUSD-OTC -> EURUSD_otc) """
+    return pair.replace('-OTC', '_otc')
+
+
+class PocketOptionClient(Broker):
+    """
+    Protocol level PocketOption client, talking to the platform websocket
+    (socket.io over Engine.IO v4) from an asyncio loop running in its own
+    thread, instead of driving a browser.
+
+    Only the text framing is used for outgoing events. Incoming events with a
+    binary attachment ("451-[event, placeholder]") take their payload from the
+    next binary frame, as the platform sends them
+    """
+    orders = []
+    # requests are multiplexed over the same socket
+    workers = 4
+
+    def __init__(self, ssid, demo=True, url=WS_URL):
+        self.ssid = ssid
+        self.demo = demo
+        self.url = url
+        self.ws = None
+        self.balance = None
+        self.request_ids = count(int(time()))
+        self.lock = Lock()
+        # request id -> future of the opened deal
+        self.requests = {}
+        # deal id -> future of the closed deal
+        self.deals = {}
+        # set by quit, so a closed socket isn't reconnected
+        self.closing = False
+        self.reconnecting = False
+
+        self.loop = new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever,
+                             name='PocketOption Client', daemon=True)
+        self.thread.start()
+        self.connect()
+
+    def run(self, coro, timeout=TIMEOUT):
+        return run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def connect(self):
+        self.closing = False
+        self.run(self._connect())
+
+    async def _connect(self):
+        ws = self.ws = await websockets.connect(self.url, max_size=None)
+        try:
+            # Engine.IO open packet, then socket.io connect
+            handshake = await ws.recv()
+            if not handshake.startswith('0'):
+                raise ConnectionError(f'Unexpected handshake: {handshake}')
+            await ws.send('40')
+            self.authenticated = self.loop.create_future()
+            self.balance_received = self.loop.create_future()
+            self.loop.create_task(self._read(ws))
+            await self.emit('auth', {'session': self.ssid, 'isDemo': int(self.demo), 'uid': WS_UID, 'platform': 2})
+            await wait_for(self.authenticated, TIMEOUT)
+            await wait_for(self.balance_received, TIMEOUT)
+        except BaseException:
+            # the reader of a socket that never connected doesn't reconnect it
+            self.ws = None
+            await ws.close()
+            raise
+        log('Websocket client authenticated', False)
+
+    async def _reconnect(self):
+        """ Connects and authenticates again with backoff, until it succeeds or the client quits """
+        self.reconnecting = True
+        try:
+            for attempt in count():
+                await sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+                if self.closing:
+                    return
+                try:
+                    await self._connect()
+                    log('Websocket reconnected', False)
+                    return
+                except Exception as e:
+                    log(f'Websocket reconnect failed: {repr(e)}', False)
+        finally:
+            self.reconnecting = False
+
+    def fail_pending(self, error):
+        """ Fails every request and deal waiting on the socket, so their callers see it at once """
+        (requests, self.requests) = (self.requests, {})
+        pending = list(requests.values())
+        for (id, future) in list(self.deals.items()):
+            if not future.done():
+                del self.deals[id]
+                pending.append(future)
+        for future in pending:
+            if not future.done():
+                future.set_exception(error)
+                # retrieved, so futures nobody waits on don't warn
+                future.exception()
+
+    async def emit(self, event, payload):
+        await self.ws.send('42' + dumps([event, payload]))
+
+    async def _read(self, ws):
+        attachment = None
+        try:
+            async for message in ws:
+                if isinstance(message, bytes):
+                    if attachment is not None:
+                        self.dispatch(attachment, loads(message))
+                        attachment = None
+                elif message == '2':
+                    await ws.send('3')
+                elif message.startswith('451-'):
+                    attachment = loads(message[4:])[0]
+                elif message.startswith('42'):
+                    event = loads(message[2:])
+                    self.dispatch(event[0], event[1] if len(event) > 1 else None)
+            log('Websocket closed', False)
+        except websockets.ConnectionClosed as e:
+            log(f'Websocket closed: {e}', False)
+        except Exception as e:
+            log(f'Websocket reader failed: {repr(e)}', False)
+            await ws.close()
+
+        self.fail_pending(ConnectionError('Websocket closed'))
+        # a socket replaced by a reconnection in progress is not reconnected again
+        if not self.closing and not self.reconnecting and ws is self.ws:
+            self.loop.create_task(self._reconnect())
+
+    def dispatch(self, event, payload):
+        if event == 'successauth':
+            if not self.authenticated.done():
+                self.authenticated.set_result(True)
+        elif event == 'successupdateBalance':
+            if bool(payload.get('isDemo')) == self.demo:
+                self.balance = float(payload['balance'])
+                if not self.balance_received.done():
+                    self.balance_received.set_result(True)
+        elif event == 'successopenOrder':
+            future = self.requests.pop(payload.get('requestId'), None)
+            if future and not future.done():
+                future.set_result(payload)
+        elif event == 'failopenOrder':
+            future = self.requests.pop(payload.get('requestId'), None)
+            if future and not future.done():
+                future.set_exception(ValueError(payload.get('error')))
+        elif event == 'successcloseOrder':
+            for deal in payload.get('deals', []):
+                future = self.deals.get(deal['id'])
+                if future is None:
+                    future = self.deals[deal['id']] = self.loop.create_future()
+                if not future.done():
+                    future.set_result(deal)
+
+    async def _open(self, amount, pair, action, timeframe):
+        request_id = next(self.request_ids)
+        future = self.requests[request_id] = self.loop.create_future()
+        await self.emit('openOrder', {'asset': to_asset(pair), 'amount': amount, 'action': action, 'isDemo': int(self.demo),
+                                      'requestId': request_id, 'optionType': 100, 'time': timeframe * 60})
+        deal = await wait_for(future, TIMEOUT)
+        if deal['id'] not in self.deals:
+            self.deals[deal['id']] = self.loop.create_future()
+        return deal
+
+    def buy(self, amount, pair, action, timeframe):
+        try:
+            deal = self.run(self._open(amount, pair, action, timeframe))
+            with self.lock:
+                id = len(self.orders)
+                self.orders.append({'amount': amount, 'active': pair, 'direction': action,
+                                    'time': time(), 'timeframe': timeframe, 'deal': deal['id']})
+            return True, id
+        except Exception as e:
+            log(f'Buy Error: {repr(e)}', False)
+            return False, None
+
+    async def _closed(self, ids, timeout):
+        async def closed(id):
+            try:
+                # shielded, so a timeout doesn't cancel the stored future and drop a later close event
+                return id, await wait_for(shield(self.deals[self.orders[id]['deal']]), timeout)
+            except Exception:
+                return id, None
+
+        results = {}
+        for task in [self.loop.create_task(closed(id)) for id in ids]:
+            (id, deal) = await task
+            results[id] = deal
+        return results
+
+    def check_binary_orders(self, ids, timeout=TIMEOUT):
+        try:
+            deals = self.run(self._closed(ids, timeout), timeout + 1)
+        except FutureTimeoutError:
+            deals = {}
+
+        results = {}
+        for id in ids:
+            order = self.orders[id]
+            deal = deals.get(id)
+            if deal is None:
+                results[id] = None
+                continue
+            self.deals.pop(order['deal'], None)
+            # total returned by the order, as shown in the platform deals list
+            order['profit_amount'] = max(order['amount'] + float(deal['profit']), 0)
+            order['result'] = 'win' if order['profit_amount'] > 0 else 'loss'
+            results[id] = order
+        return results
+
+    def check_binary_order(self, id):
+        order = self.orders[id]
+        remaining = order['timeframe'] * 60 - (time() - order['time'])
+        return self.check_binary_orders([id], timeout=max(remaining, 0) + TIMEOUT)[id]
+
+    def get_balance(self, fresh=False):
+        # the balance is pushed by the platform after every change
+        return self.balance
+
+    def restart(self, update_token=False):
+        self.quit(stop_loop=False)
+        self.connect()
+
+    def quit(self, stop_loop=True):
+        self.closing = True
+        try:
+            if self.ws is not None:
+                self.run(self.ws.close())
+        except Exception as e:
+            log(f'Websocket close error: {repr(e)}', False)
+        if stop_loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,110 @@
+from collections import deque
+from itertools import count
+from os import getenv
+from sortedcontainers import SortedKeyList
+
+"""
+Positions of the trading bot: a position is an order and its gales. Open
+positions are indexed by the time they get near their expiration, so the
+checks made before every order don't depend on how many orders were placed
+in the day, and closed positions are archived when the day rolls over
+"""
+
+# closed positions of the previous days kept in memory (every order is in the journal)
+POSITIONS_ARCHIVE = int(getenv('POSITIONS_ARCHIVE', 1000))
+# share of the expiration time after which an open position is near its expiration
+# (e.g. 4m40s if expires in 5min)
+NEAR_EXPIRY = 0.93
+
+
+class Position():
+    __slots__ = ('key', 'id', 'pair', 'action', 'gales', 'amount', 'time', 'expires_in', 'kind', 'channel',
+                 'closed', 'near_expiry')
+
+    def __init__(self, key, id, pair, action, amount, time, expires_in, kind, channel=None):
+        self.key = key
+        # id of the latest order (the first one or its last gale)
+        self.id = id
+        self.pair = pair
+        self.action = action
+        self.gales = 0
+        self.amount = amount
+        # when the first order was placed
+        self.time = time
+        self.expires_in = expires_in
+        self.kind = kind
+        self.channel = channel
+        self.closed = False
+        self.near_expiry = time + expires_in * 60 * NEAR_EXPIRY
+
+    def snapshot(self):
+        return (self.id, self.pair, self.action, self.amount, self.gales, self.closed)
+
+    def __repr__(self):
+        return format_position(self.snapshot())
+
+
+class PositionStore():
+    def __init__(self, archive_size=POSITIONS_ARCHIVE):
+        self.keys = count()
+        # order id -> position of the day
+        self.by_id = {}
+        self.open = SortedKeyList(
+            key=lambda position: (position.near_expiry, position.key))
+        self.closed_today = 0
+        self.archive = deque(maxlen=archive_size)
+
+    def add(self, id, pair, action, amount, time, expires_in, kind, channel=None):
+        position = Position(next(self.keys), id, pair, action,
+                            amount, time, expires_in, kind, channel)
+        self.by_id[id] = position
+        self.open.add(position)
+        return position
+
+    def get(self, id):
+        return self.by_id.get(id)
+
+    def gale(self, position, id, amount):
+        """ Moves the position to the order of its gale """
+        self.by_id[id] = position
+        position.id = id
+        position.amount = amount
+
+    def close(self, position):
+        if not position.closed:
+            position.closed = True
+            self.open.remove(position)
+            self.closed_today += 1
+
+    def near_expiry(self, now):
+        """ Whether any open position is near its expiration """
+        return len(self.open) > 0 and self.open[0].near_expiry <= now
+
+    def archive_closed(self):
+        """ Moves the closed positions out of the day, at day rollover """
+        closed = {position for position in self.by_id.values()
+                  if position.closed}
+        self.archive.extend(sorted(closed, key=lambda position: position.key))
+        self.by_id = {id: position for (id, position)
+                      in self.by_id.items() if not position.closed}
+        self.closed_today = 0
+
+    def snapshot(self):
+        """ Open positions and closed count as plain values, which can be formatted later (see format_store) """
+        return (tuple(position.snapshot() for position in self.open), self.closed_today)
+
+    def __len__(self):
+        return len(self.open)
+
+    def __repr__(self):
+        return format_store(self.snapshot())
+
+
+def format_position(snapshot):
+    (id, pair, action, amount, gales, closed) = snapshot
+    return f'Position({id} {pair} {action} ${amount:.2f} G{gales} {"closed" if closed else "open"})'
+
+
+def format_store(snapshot):
+    (positions, closed_today) = snapshot
+    return f'{len(positions)} open, {closed_today} closed today: [{", ".join(map(format_position, positions))}]'
@@ -0,0 +1,225 @@
+import sys
+import json
+from os import environ
+from argparse import ArgumentParser
+from asyncio import new_event_loop, set_event_loop, sleep
+from collections import Counter
+from types import ModuleType, SimpleNamespace
+from time import perf_counter
+import numpy as np
+from dotenv import load_dotenv
+from utils import clock, get_time
+from dispatch import dispatcher
+from debug import flush
+import journal
+import tracing
+
+load_dotenv()
+
+"""
+Replays a recorded stream of telegram messages (see RECORD_MESSAGES in
+main.py) through main.new_option_message, against the stub broker and with
+the bot clock accelerated, so a full trading day runs in seconds. Reports
+throughput and the latency of every stage, and when the journal of the
+recorded session is given, its results are replayed and the orders placed
+are compared with the recorded ones.
+
+e.g. python replay.py messages.jsonl --session journal-10-05-2023.jsonl --speed 3600
+"""
+
+# virtual seconds to wait for the last orders (and their gales) to settle
+SETTLE_SECONDS = 3600
+
+
+class ReplayClient():
+    """ Stands in for the telegram client of main.py: handlers are called by the replay instead """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.disconnected = False
+
+    def on(self, event):
+        return lambda handler: handler
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+class ReplayEvent():
+    def __init__(self, channel_id, text):
+        self.raw_text = text
+        self.message = SimpleNamespace(
+            peer_id=SimpleNamespace(channel_id=channel_id))
+
+
+class Recorder():
+    """ Takes the place of the journal file, keeping the events of the replay in memory """
+
+    def __init__(self):
+        self.events = []
+
+    def write(self, timestamp, type, channel, pair, result, fields):
+        self.events.append({'time': timestamp, 'type': type, 'channel': channel,
+                            'pair': pair, 'result': result, **fields})
+
+    def close(self):
+        pass
+
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_main(channels, loop):
+    """
+    Imports main.py with the replay client in place of the telegram module
+    (which connects on import) and with the stub broker
+    """
+    environ['BROKER'] = 'stub'
+    telegram = ModuleType('telegram')
+    telegram.client = ReplayClient(loop)
+    telegram.run_command = lambda command: None
+    telegram.CHANNELS = channels
+    for channel in channels:
+        dispatcher.add(channel)
+    sys.modules['telegram'] = telegram
+
+    import main
+    return main
+
+
+def outcomes_of(events):
+    """ (pair, minute the order was placed in) -> result of the recorded orders """
+    orders = {event['id']: event for event in events if event['type'] == 'order'}
+    outcomes = {}
+    for event in events:
+        if event['type'] == 'result' and event.get('id') in orders:
+            order = orders[event['id']]
+            outcomes[(order['pair'], int(order['time'] // 60))] = event['result']
+    return outcomes
+
+
+def decision(event):
+    return (get_time(event['time']), event['pair'], event.get('action'), event.get('kind'), event.get('gales'))
+
+
+def compare(replayed, recorded, limit=20):
+    """ Orders placed by the replay compared with the recorded ones (by minute, pair, action, kind and gales) """
+    replayed = Counter(decision(event)
+                       for event in replayed if event['type'] == 'order')
+    recorded = Counter(decision(event)
+                       for event in recorded if event['type'] == 'order')
+    return {'matched': sum((replayed & recorded).values()),
+            'missing': [list(key) for key in (recorded - replayed).elements()][:limit],
+            'extra': [list(key) for key in (replayed - recorded).elements()][:limit],
+            'missing_count': sum((recorded - replayed).values()),
+            'extra_count': sum((replayed - recorded).values())}
+
+
+def busy(bot):
+    return bool(bot.tasks or bot.scheduler.pending or bot.scheduler.firing or bot.results.pending
+                or bot.results.scheduler.firing or bot.order_queue)
+
+
+async def feed(app, messages, client):
+    """ Delivers every message at its recorded time, returning the lateness of each delivery (in virtual seconds) """
+    lateness = []
+    for message in messages:
+        wait = message['time'] - clock.time()
+        if wait > 0:
+            await sleep(clock.real(wait))
+        if client.disconnected:
+            break
+        lateness.append(max(clock.time() - message['time'], 0))
+        await app.new_option_message(ReplayEvent(message['channel'], message['text']))
+
+    deadline = clock.time() + SETTLE_SECONDS
+    while busy(app.bot) and not client.disconnected and clock.time() < deadline:
+        await sleep(0.005)
+    return lateness
+
+
+def replay(messages, channels, session=None, speed=3600):
+    messages = sorted(messages, key=lambda message: message['time'])
+    recorded = read_jsonl(session) if session else []
+
+    loop = new_event_loop()
+    set_event_loop(loop)
+    # replayed events stay in memory, latency is only reported
+    journal.journal = Recorder()
+    tracing.tracer.path = None
+
+    app = load_main(channels, loop)
+    app.bot.api.outcomes = outcomes_of(recorded)
+    clock.accelerate(messages[0]['time'] - 60 if messages else 0, speed)
+
+    start = perf_counter()
+    virtual_start = clock.time()
+    try:
+        lateness = loop.run_until_complete(
+            feed(app, messages, app.client))
+    finally:
+        app.disconnect_timeout.cancel()
+        app.bot.close()
+        loop.close()
+    real = perf_counter() - start
+    virtual = clock.time() - virtual_start
+    clock.reset()
+    flush()
+
+    events = journal.journal.events
+    counts = Counter(event['type'] for event in events)
+    report = {
+        'messages': len(lateness),
+        'signals': counts['signal'],
+        'orders': counts['order'],
+        'results': counts['result'],
+        'errors': counts['error'],
+        'wins': sum(event['result'] == 'win' for event in events if event['type'] == 'result'),
+        'final_balance': app.bot.api.get_balance(),
+        'disconnected': app.client.disconnected,
+        'real_seconds': round(real, 2),
+        'virtual_seconds': round(virtual, 2),
+        'speedup': round(virtual / real, 1) if real else None,
+        'messages_per_second': round(len(lateness) / real, 1) if real else None,
+        'delivery_lateness': {f'p{point}': round(float(value), 2) for (point, value) in
+                              zip((50, 95, 99), np.percentile(lateness, (50, 95, 99)))} if lateness else {},
+        'latency_ms': {stage: stats for (stage, stats) in tracing.tracer.summary().items() if stats['count']},
+    }
+    if session:
+        report['decisions'] = compare(events, recorded)
+    return report
+
+
+def parse_args(args=None):
+    parser = ArgumentParser(
+        description='Replays recorded telegram messages through the bot with an accelerated clock')
+    parser.add_argument('messages',
+                        help='JSON lines of {"time", "channel", "text"} (see RECORD_MESSAGES)')
+    parser.add_argument('--channels', default='telegram_channels.json',
+                        help='channels of the recorded session')
+    parser.add_argument('--session', default=None,
+                        help='journal of the recorded session, to replay its results and compare the orders')
+    parser.add_argument('--speed', type=float, default=3600,
+                        help='how many times faster than real time the clock runs')
+    parser.add_argument('--output', default=None,
+                        help='also write the report to this JSON file')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    with open(args.channels, 'r') as f:
+        channels = json.load(f)
+    report = replay(read_jsonl(args.messages), channels,
+                    args.session, args.speed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
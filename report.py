@@ -0,0 +1,123 @@
+import csv
+import json
+from os import getenv
+
+# max points kept in the equity curve (it's downsampled as orders come in)
+EQUITY_POINTS = int(getenv('EQUITY_POINTS', 1000))
+
+
+class ReportWriter():
+    """
+    Streams the orders of a simulation to a file as they come, in the format
+    of its extension (.csv, .jsonl, or the plain text lines of the simulator
+    otherwise), keeping only running aggregates and a downsampled equity
+    curve in memory
+    """
+    fields = ['time', 'pair', 'action', 'amount', 'result', 'gales', 'balance']
+
+    def __init__(self, path, balance, equity_path=None, equity_points=EQUITY_POINTS):
+        self.format = path.rsplit('.', 1)[-1].lower() if '.' in path else 'txt'
+        self.file = open(path, 'w', newline='')
+        self.writer = None
+        if self.format == 'csv':
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(self.fields)
+
+        self.initial_balance = self.balance = self.peak = balance
+        self.count = 0
+        self.wins = 0
+        self.losses = 0
+        self.max_drawdown = 0.0
+        self.streak = 0
+        self.longest_streak = 0
+        # pair -> P&L
+        self.pairs = {}
+
+        self.equity_path = equity_path
+        self.equity_points = equity_points
+        # (order number, balance), keeping one every stride orders
+        self.equity = [(0, balance)]
+        self.stride = 1
+
+    def add(self, time, pair, action, amount, result, gales):
+        """ Writes an order (result is 'WIN' or 'LOSS') and returns its text line """
+        self.count += 1
+        self.balance += amount
+        self.pairs[pair] = self.pairs.get(pair, 0) + amount
+
+        if result == 'WIN':
+            self.wins += 1
+            self.streak = 0
+        else:
+            self.losses += 1
+            self.streak += 1
+            if self.streak > self.longest_streak:
+                self.longest_streak = self.streak
+
+        if self.balance > self.peak:
+            self.peak = self.balance
+        elif self.peak > 0 and (self.peak - self.balance) / self.peak > self.max_drawdown:
+            self.max_drawdown = (self.peak - self.balance) / self.peak
+
+        if self.count % self.stride == 0:
+            self.equity.append((self.count, self.balance))
+            if len(self.equity) > self.equity_points:
+                # halve the resolution to stay within equity_points
+                self.equity = self.equity[::2]
+                self.stride *= 2
+
+        line = f'{time}: {pair} - {action} ${"{:.2f}".format(amount)} {result} {"G" * gales}'
+        if self.writer:
+            self.writer.writerow(
+                [time, pair, action, round(amount, 2), result, gales, round(self.balance, 2)])
+        elif self.format == 'jsonl':
+            self.file.write(json.dumps({'time': time, 'pair': pair, 'action': action, 'amount': round(amount, 2),
+                                        'result': result, 'gales': gales, 'balance': round(self.balance, 2)}) + '\n')
+        else:
+            self.file.write(line + '\n')
+        return line
+
+    def summary(self):
+        return {
+            'orders': self.count,
+            'wins': self.wins,
+            'losses': self.losses,
+            'win_rate': self.wins / self.count if self.count else 0,
+            'initial_balance': self.initial_balance,
+            'final_balance': self.balance,
+            'max_drawdown': self.max_drawdown,
+            'longest_losing_streak': self.longest_streak,
+            'pairs': self.pairs,
+        }
+
+    def summary_text(self):
+        summary = self.summary()
+        lines = [f'WINS: {summary["wins"]}',
+                 f'LOSSES: {summary["losses"]}',
+                 'Win rate: {:.1%}'.format(summary['win_rate']),
+                 'Initial balance: {:.2f}'.format(summary['initial_balance']),
+                 'Final balance: {:.2f}'.format(summary['final_balance']),
+                 'Max drawdown: {:.1%}'.format(summary['max_drawdown']),
+                 f'Longest losing streak: {summary["longest_losing_streak"]}',
+                 'P&L by pair: ' + ' | '.join(f'{pair} {"{:.2f}".format(pnl)}' for (pair, pnl) in sorted(self.pairs.items()))]
+        return '\n'.join(lines)
+
+    def close(self):
+        if self.format == 'txt':
+            self.file.write('\n' + self.summary_text())
+        self.file.close()
+
+        if self.equity_path:
+            if self.equity[-1][0] != self.count:
+                self.equity.append((self.count, self.balance))
+            with open(self.equity_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['order', 'balance'])
+                writer.writerows((order, round(balance, 2))
+                                 for (order, balance) in self.equity)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,86 @@
+from asyncio import gather
+from scheduler import OrderScheduler
+from debug import log
+
+# seconds to wait after the expiration before reading the results
+# (the results are polled from the page buffer until they arrive)
+CHECK_MARGIN = 0
+
+
+class ResultCollector():
+    """
+    Groups positions by the minute they expire in and reads the results of
+    every position of that minute with a single pass over the deals list.
+
+    The blocking read runs through call (e.g. TradingBot.call, which hands it
+    to the driver executor) and each result is awaited by its callback in order.
+    Callbacks may return a coroutine to run afterwards (e.g. a GALE): those of
+    the whole batch run together, and then after is awaited once
+    """
+
+    def __init__(self, api, call, after=None, loop=None):
+        self.api = api
+        self.call = call
+        self.after = after
+        self.scheduler = OrderScheduler(name='Result Collector', loop=loop)
+        # expiration minute -> {'ids': {id: callback}, 'fire_at': ..., 'job': scheduler id}
+        self.slots = {}
+
+    def watch(self, id, expires_at, callback):
+        slot = int(expires_at // 60)
+        group = self.slots.get(slot)
+        if group is None:
+            group = self.slots[slot] = {'ids': {}, 'fire_at': 0, 'job': None}
+        group['ids'][id] = callback
+
+        # positions of the same minute can expire a few seconds apart, so
+        # the batch only runs once the last of them has expired
+        if expires_at + CHECK_MARGIN > group['fire_at']:
+            group['fire_at'] = expires_at + CHECK_MARGIN
+            if group['job'] is not None:
+                self.scheduler.cancel(group['job'])
+            group['job'] = self.scheduler.schedule(
+                group['fire_at'], lambda: self.collect(slot), name=f'Results {slot}')
+
+    async def collect(self, slot):
+        group = self.slots.pop(slot, None)
+        if not group:
+            return
+
+        callbacks = group['ids']
+        log(f'Checking results for orders {list(callbacks)}', False)
+        try:
+            results = await self.call(self.api.check_binary_orders, list(callbacks))
+        except Exception as e:
+            # every order of the batch fails, rather than staying open forever
+            log(f'Checking results failed for orders {list(callbacks)}: {repr(e)}', False)
+            results = {}
+
+        follow_ups = []
+        for id, callback in callbacks.items():
+            try:
+                follow_up = await callback(results.get(id))
+            except Exception as e:
+                log(f'Result handling failed for order {id}: {repr(e)}', False)
+                continue
+            if follow_up is not None:
+                follow_ups.append((id, follow_up))
+
+        done = await gather(*(follow_up for (_, follow_up) in follow_ups), return_exceptions=True)
+        for ((id, _), result) in zip(follow_ups, done):
+            if isinstance(result, Exception):
+                log(f'Follow-up failed for order {id}: {repr(result)}', False)
+
+        if self.after is not None:
+            try:
+                await self.after()
+            except Exception as e:
+                log(f'Result batch handling failed: {repr(e)}', False)
+
+    @property
+    def pending(self):
+        return sum(len(group['ids']) for group in self.slots.values())
+
+    def stop(self):
+        self.scheduler.cancel_all()
+        self.scheduler.stop()
@@ -0,0 +1,132 @@
+from heapq import heappush, heappop, heapify
+from itertools import count
+from asyncio import Event, wait_for, get_event_loop, current_task, iscoroutine, TimeoutError
+from debug import log
+from tracing import tracer
+from utils import clock
+
+
+class OrderScheduler():
+    """
+    Keeps every pending order in a single heap ordered by fire time and runs
+    them from one asyncio task, instead of sleeping one Timer thread per order.
+
+    Orders registered with the same slot (e.g. the "HH:MM" start time) are
+    fired together as soon as the first of them is due. Callbacks may return
+    a coroutine, which runs as its own task so slow orders don't hold the heap
+    """
+
+    def __init__(self, name='Order Scheduler', loop=None):
+        self.name = name
+        self.loop = loop
+        self.queue = []
+        self.orders = {}
+        self.ids = count()
+        self.wakeup = None
+        self.task = None
+        self.running = False
+        # fired orders that are still running
+        self.firing = set()
+        # stage of bot:latency with how late orders fire compared to their target time
+        self.stage = name.lower().replace(' ', '_') + '_late'
+
+    def schedule(self, fire_at, fn, slot=None, name=None):
+        id = next(self.ids)
+        # [fire time, id, callback, slot, name]; callback is cleared on cancel
+        entry = [fire_at, id, fn, slot, name or f'Order {id}']
+        self.orders[id] = entry
+        heappush(self.queue, entry)
+        if not self.running:
+            self.start()
+        self.wakeup.set()
+        return id
+
+    def cancel(self, id):
+        entry = self.orders.pop(id, None)
+        if entry is None:
+            return False
+        entry[2] = None
+        return True
+
+    def cancel_all(self):
+        for entry in self.orders.values():
+            entry[2] = None
+        self.orders = {}
+        self.queue = []
+        if self.wakeup:
+            self.wakeup.set()
+
+    def start(self):
+        if self.task is not None and not self.task.done():
+            # stopped but not woken up yet, it would keep reading the heap next to the new task
+            self.task.cancel()
+        self.running = True
+        self.loop = self.loop or get_event_loop()
+        self.wakeup = Event()
+        self.task = self.loop.create_task(self._run())
+
+    def stop(self):
+        self.running = False
+        if self.wakeup:
+            self.wakeup.set()
+
+    @property
+    def pending(self):
+        return len(self.orders)
+
+    def _next_batch(self):
+        first = heappop(self.queue)
+        batch = [first]
+        if first[3] is not None:
+            # fire every order of the same slot together
+            for entry in self.queue:
+                if entry[3] == first[3] and entry[2] is not None:
+                    batch.append(entry)
+            if len(batch) > 1:
+                ids = {entry[1] for entry in batch}
+                self.queue = [
+                    entry for entry in self.queue if entry[1] not in ids]
+                heapify(self.queue)
+        for entry in batch:
+            self.orders.pop(entry[1], None)
+        return batch
+
+    async def _run(self):
+        # a task replaced by start exits as soon as it wakes up, even if its cancellation was lost
+        while self.running and self.task is current_task():
+            # drop cancelled orders from the top of the heap
+            while self.queue and self.queue[0][2] is None:
+                heappop(self.queue)
+
+            wait = self.queue[0][0] - clock.time() if self.queue else None
+            if wait is None or wait > 0:
+                self.wakeup.clear()
+                try:
+                    await wait_for(self.wakeup.wait(), clock.real(wait) if wait is not None else None)
+                except TimeoutError:
+                    pass
+                continue
+
+            for entry in self._next_batch():
+                self._fire(entry)
+
+    def _fire(self, entry):
+        (fire_at, id, fn, slot, name) = entry
+        delay = clock.time() - fire_at
+        tracer.record(self.stage, clock.real(max(delay, 0)))
+        log(f'{name} fired {delay * 1000:.0f}ms late', False)
+        try:
+            result = fn()
+        except Exception as e:
+            log(f'{name} failed: {repr(e)}', False)
+            return
+        if iscoroutine(result):
+            task = self.loop.create_task(self._await(name, result))
+            self.firing.add(task)
+            task.add_done_callback(self.firing.discard)
+
+    async def _await(self, name, coro):
+        try:
+            await coro
+        except Exception as e:
+            log(f'{name} failed: {repr(e)}', False)
@@ -0,0 +1,134 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from debug import log
+
+
+class Signal(NamedTuple):
+    pair: str
+    action: str
+    start_time: Optional[str]
+    timeframe: int
+
+
+ACTIONS = {'COMPRA': 'call', 'VENDA': 'put', 'CALL': 'call', 'PUT': 'put'}
+
+
+class DefaultParser():
+    """
+    Parses the message formats of my channels, trying each known pattern of a
+    field until one matches (all of them compiled once)
+
+    Obs: other message patterns will require changes in this class, or a
+    "signal" pattern for the channel (see PatternParser)
+    """
+    start_time = re.compile(r'(\d{2}):(\d{2})')
+    pairs = [re.compile(pattern) for pattern in (
+        r'Moeda: (\w{6}|\w{3}/\w{3})\n',
+        r'(\w{6});',
+        r'(\w{3}/\w{3})\s?',
+        r'\s(\w{6})-',
+        r'\s(\w{6})\(',
+        r'\s(\w{6})\s')]
+    otc = re.compile(r'OTC')
+    actions = [re.compile(pattern) for pattern in (
+        r';(COMPRA|VENDA)',
+        r'Sinal - .(COMPRA|VENDA).\n',
+        r'(PUT|CALL)')]
+    timeframes = [re.compile(pattern) for pattern in (
+        r'Timeframe M(\d)',
+        r'Expiração(?: M|: )(\d)')]
+
+    def __init__(self, default_timeframe=5):
+        self.default_timeframe = default_timeframe
+
+    def first(self, patterns, message):
+        for pattern in patterns:
+            match = pattern.search(message)
+            if match:
+                return match.group(1)
+        return None
+
+    def parse(self, message):
+        start_time = self.start_time.search(message)
+        if start_time:
+            start_time = f'{start_time.group(1)}:{start_time.group(2)}'
+
+        pair = self.first(self.pairs, message).replace('/', '')
+        if self.otc.search(message):
+            pair += '-OTC'
+
+        action = ACTIONS[self.first(self.actions, message)]
+        timeframe = self.first(self.timeframes, message)
+
+        return Signal(pair, action, start_time, int(timeframe) if timeframe else self.default_timeframe)
+
+
+class PatternParser():
+    """
+    Parses the messages of a channel with a single pattern, extracting every
+    field in one pass through the named groups pair, action, and optionally
+    hour and minute (or start_time as HH:MM), otc and timeframe
+    """
+
+    def __init__(self, signal, actions=None, default_timeframe=5):
+        self.signal = re.compile(signal)
+        self.actions = {**ACTIONS, **(actions or {})}
+        self.default_timeframe = default_timeframe
+
+    def parse(self, message):
+        fields = self.signal.search(message).groupdict()
+
+        pair = fields['pair'].replace('/', '')
+        if fields.get('otc'):
+            pair += '-OTC'
+
+        start_time = fields.get('start_time')
+        if fields.get('hour') is not None:
+            start_time = f'{fields["hour"]}:{fields["minute"]}'
+
+        timeframe = fields.get('timeframe')
+
+        return Signal(pair, self.actions[fields['action'].upper()], start_time,
+                      int(timeframe) if timeframe else self.default_timeframe)
+
+
+default_parser = DefaultParser()
+# channel id -> parser
+parsers = {}
+
+
+def register_channel(channel):
+    """
+    Registers the parser for a channel of telegram_channels.json. Channels
+    with a "signal" pattern get a PatternParser, the others the DefaultParser
+    """
+    default_timeframe = channel.get('timeframe', 5)
+    if 'signal' in channel:
+        parser = PatternParser(
+            channel['signal'], channel.get('actions'), default_timeframe)
+    elif default_timeframe != default_parser.default_timeframe:
+        parser = DefaultParser(default_timeframe)
+    else:
+        parser = default_parser
+    parsers[channel['id']] = parser
+    parse_signal.cache_clear()
+    return parser
+
+
+@lru_cache(maxsize=256)
+def parse_signal(message, channel_id=None):
+    """
+    Parses a telegram message with the parser of the channel it came from,
+    returning a Signal or None. Results are cached, so forwarded or edited
+    copies of the same message are not parsed again
+    """
+    parser = parsers.get(channel_id, default_parser)
+    try:
+        signal = parser.parse(message)
+    except Exception as e:
+        log(f'Error while parsing message: {repr(e)} | {message}', False)
+        return None
+
+    log(f'Parsed {signal} from: {message}', False)
+    return signal
@@ -1,5 +1,9 @@
-from os import getenv
+from os import getenv, path
+from argparse import ArgumentParser
+from time import perf_counter
 from dotenv import load_dotenv
+from backtest import load_signals, iter_simulate, Params, RULES, CALL, WIN, LOSS, SKIPPED
+from report import ReportWriter
 
 load_dotenv()
 
@@ -10,10 +14,12 @@ try:
 except Exception:
     pass
 
-""" 
+"""
 Reads a signal history from a file and simulates the end
 balance after every trade, taking into consideration possible
 SOROS and GALE strategies
+
+e.g. python simulator.py signals.txt --balance 1000 --max-gales 2
 """
 
 
@@ -23,107 +29,85 @@ PAYOUT = float(getenv('PAYOUT', 0.8))
 MAX_GALES = int(getenv('MAX_GALES', 1))
 SOROS_HOLDING = float(getenv('SOROS_HOLDING', 0.1))
 MAX_SOROS = int(getenv('MAX_SOROS', 3))
-
-balance = float(input("Balance ($1000): ") or 1000)
-signals = input("Signals file (signals.txt): ") or "signals.txt"
-orders = []
-initial_balance = balance
-soros_count = 0
-soros_amount = None
-soros_enabled = False
-
-
-def parse_order(text):
-    pair = text[:6]
-    time = text[7:12]
-    action = "CALL" if "COMPRA" in text else "PUT"
-    result = "WIN" if "WIN" in text else "LOSS"
-    gales = text[-2:].count('G')
-
-    return (pair, time, action, result, gales)
-
-
-with open("data/" + signals, "r") as f:
-    grouped_signals = {}
-    for line in f.readlines():
-        line = line[:-1]
-        (pair, time, action, result, gales) = parse_order(line)
-
-        if time not in grouped_signals:
-            grouped_signals[time] = []
-
-        grouped_signals[time].append((pair, action, result, gales))
-
-    for time in grouped_signals:
-        signals_in_time = grouped_signals[time]
-        last_soros_status = False
-        amount = balance * BASE_ORDER if not soros_enabled else soros_amount
-
-        for signal in signals_in_time:
-            (pair, action, result, gales) = signal
-
-            balance_now = balance
-
-            if result == 'WIN':
-                if gales == 0:
-                    if soros_count < MAX_SOROS:
-                        soros_enabled = True
-                    else:
-                        soros_enabled = False
-
-                    balance += amount * PAYOUT
-                elif gales == 1 and MAX_GALES >= 1 and not soros_enabled:
-                    balance += -amount + amount * GALE_RATE * PAYOUT
-                    soros_enabled = False if not last_soros_status else True
-                elif gales == 2 and MAX_GALES >= 2 and not soros_enabled:
-                    balance += -amount - amount * GALE_RATE + \
-                        (amount * GALE_RATE ** 2) * PAYOUT
-                    soros_enabled = False if not last_soros_status else True
-                else:
-                    result = 'LOSS'
-
-            if result == 'LOSS':
-                balance -= amount
-                if gales == 0:
-                    gales = 2
-                if not soros_enabled:
-                    if MAX_GALES >= 1:
-                        balance -= amount * GALE_RATE
-                    if MAX_GALES == 2:
-                        balance -= amount * GALE_RATE ** 2
-                else:
-                    gales = 0
-                soros_enabled = False if not last_soros_status else True
-
-            orders.append({'pair': pair, 'time': time,
-                           'action': action, 'result': result, 'amount': balance - balance_now, 'gales': min(gales, MAX_GALES)})
-            last_soros_status = soros_enabled
-
-        if soros_enabled:
-            soros_amount = (amount + amount * PAYOUT) * (1 - SOROS_HOLDING)
-            soros_count += 1
-        else:
-            soros_amount = None
-            soros_count = 0
-
-output = ""
-
-for order in orders:
-    output += f'{order["time"]}: {order["pair"]} - {order["action"]} ${"{:.2f}".format(order["amount"])} {order["result"]} {"G" * order["gales"]}\n'
-
-output += "\nWINS: " + str(output.count('WIN'))
-output += "\nLOSSES: " + str(output.count('LOSS'))
-
-output += "\nInitial balance: {:.2f}".format(initial_balance)
-output += "\nFinal balance: {:.2f}".format(balance)
-
-with open('output.txt', 'w') as f:
-    f.write(output)
-
-if color:
-    output = output.replace(
-        ' WIN', ' ' + colored(f' WIN ', "grey", 'on_green'))
-    output = output.replace(
+CYCLE_LOSS = getenv('CYCLE_LOSS', 'False') == 'True'
+STOP_WIN = float(getenv('STOP_WIN', 0))
+STOP_LOSS = float(getenv('STOP_LOSS', 0))
+
+
+def parse_args(args=None):
+    parser = ArgumentParser(description='Simulates a signal history')
+    parser.add_argument('signals', nargs='?', default='signals.txt',
+                        help='signals file, looked up in data/ when not found (default: signals.txt)')
+    parser.add_argument('--balance', type=float, default=1000)
+    parser.add_argument('--base-order', type=float, default=BASE_ORDER)
+    parser.add_argument('--gale-rate', type=float, default=GALE_RATE)
+    parser.add_argument('--payout', type=float, default=PAYOUT)
+    parser.add_argument('--max-gales', type=int, default=MAX_GALES)
+    parser.add_argument('--soros-holding', type=float,
+                        default=SOROS_HOLDING)
+    parser.add_argument('--max-soros', type=int, default=MAX_SOROS)
+    parser.add_argument('--cycle-loss', action='store_true',
+                        default=CYCLE_LOSS)
+    parser.add_argument('--stop-win', type=float, default=STOP_WIN)
+    parser.add_argument('--stop-loss', type=float, default=STOP_LOSS)
+    parser.add_argument('--rules', choices=['live', 'legacy'], default=RULES)
+    parser.add_argument('--output', default='output.txt',
+                        help='orders file, as .csv, .jsonl or text (default: output.txt)')
+    parser.add_argument('--equity', default='equity.csv',
+                        help='downsampled equity curve file (default: equity.csv)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="parse the signals file without reading or writing its .npy cache")
+    parser.add_argument('--quiet', action='store_true',
+                        help="don't print the orders")
+    return parser.parse_args(args)
+
+
+def colorize(line):
+    if not color:
+        return line
+    return line.replace(' WIN', ' ' + colored(f' WIN ', "grey", 'on_green')).replace(
         ' LOSS', ' ' + colored(f' LOSS ', "grey", 'on_red'))
 
-print(output)
+
+def signals_path(name):
+    if path.exists(name):
+        return name
+    return path.join('data', name)
+
+
+def main(args=None):
+    args = parse_args(args)
+    params = Params(args.base_order, args.gale_rate, args.payout, args.max_gales,
+                    args.soros_holding, args.max_soros, args.cycle_loss, args.stop_win, args.stop_loss)
+
+    signals = load_signals(signals_path(args.signals), cache=not args.no_cache)
+    start = perf_counter()
+    stops = [0, 0, 0]
+
+    with ReportWriter(args.output, args.balance, args.equity) as report:
+        # the orders of every chunk of days are written as soon as it's simulated, so the text is never held whole
+        for (first, result) in iter_simulate(signals, params, args.balance, args.rules):
+            rows = slice(first, first + len(result.pnl))
+            for (slot, pair, action, amount, won, gales) in zip(signals.slot[rows].tolist(), signals.pair[rows].tolist(), signals.action[rows].tolist(),
+                                                                result.pnl.tolist(), result.result.tolist(), result.gales.tolist()):
+                if won == SKIPPED:
+                    continue
+                line = report.add(f'{slot // 60:02d}:{slot % 60:02d}', pair.decode(), 'CALL' if action == CALL else 'PUT',
+                                  amount, 'WIN' if won == WIN else 'LOSS', gales)
+                if not args.quiet:
+                    print(colorize(line))
+            stops[0] += int((result.stops == WIN).sum())
+            stops[1] += int((result.stops == LOSS).sum())
+            stops[2] += len(result.stops)
+    elapsed = perf_counter() - start
+
+    summary = report.summary_text()
+    if args.stop_win or args.stop_loss:
+        summary += f"\nSTOP WIN days: {stops[0]} | STOP LOSS days: {stops[1]} | Days: {stops[2]}"
+
+    print(('' if args.quiet else '\n') + summary)
+    print(f'\nSimulated and wrote {report.count} signals in {elapsed * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
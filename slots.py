@@ -0,0 +1,103 @@
+from heapq import heappush, heappop
+from itertools import count
+from typing import NamedTuple
+from os import getenv
+from utils import CustomTZ
+
+"""
+Signals received by the bot, grouped by the minute of the day they start in.
+Duplicated signals are dropped while their key is remembered, and the
+amount of orders of a minute is read from its slot to split the amount
+between them. Signals and slots are forgotten DEDUP_WINDOW seconds after
+their start time
+"""
+
+# seconds a signal (and the order count of its minute) is kept after its start time
+DEDUP_WINDOW = float(getenv('DEDUP_WINDOW', 300))
+
+# CustomTZ has a fixed offset
+OFFSET = CustomTZ().utcoffset(None).total_seconds()
+
+SIGNAL = 0
+SLOT = 1
+
+
+class SignalKey(NamedTuple):
+    pair: str
+    action: str
+    # minute of the day (CustomTZ) the order starts in
+    minute: int
+    timeframe: int
+
+
+def minute_of(start_time):
+    """ Minute of the day of an HH:MM start time """
+    (hour, minute) = start_time.split(':')
+    return int(hour) * 60 + int(minute)
+
+
+def minute_at(timestamp):
+    """ Minute of the day (CustomTZ) of a timestamp """
+    return int((timestamp + OFFSET) // 60) % 1440
+
+
+class SlotRegistry():
+    def __init__(self, window=DEDUP_WINDOW):
+        self.window = window
+        # signal key -> when it's forgotten
+        self.signals = {}
+        # minute of the day -> [orders, when the slot is forgotten]
+        self.slots = {}
+        # (when, sequence, SIGNAL or SLOT, key or minute); entries pushed
+        # before a slot was extended are skipped when popped
+        self.expiry = []
+        self.sequence = count()
+
+    def register(self, key, fire_at, now):
+        """ Counts the signal in its slot, returning False if it's a duplicate """
+        self.evict(now)
+        if key in self.signals:
+            return False
+        expires = fire_at + self.window
+        self.signals[key] = expires
+        heappush(self.expiry, (expires, next(self.sequence), SIGNAL, key))
+        self.add(key.minute, expires)
+        return True
+
+    def add(self, minute, expires):
+        """ Counts an order in the slot of minute (e.g. a gale, which is never a duplicate) """
+        slot = self.slots.get(minute)
+        if slot is None:
+            slot = self.slots[minute] = [0, 0]
+        slot[0] += 1
+        if expires > slot[1]:
+            slot[1] = expires
+            heappush(self.expiry, (expires, next(self.sequence), SLOT, minute))
+
+    def count(self, minute, now):
+        self.evict(now)
+        slot = self.slots.get(minute)
+        return slot[0] if slot else 0
+
+    def evict(self, now):
+        while self.expiry and self.expiry[0][0] <= now:
+            (expires, _, kind, key) = heappop(self.expiry)
+            if kind == SIGNAL:
+                if self.signals.get(key) == expires:
+                    del self.signals[key]
+            elif key in self.slots and self.slots[key][1] <= now:
+                del self.slots[key]
+
+    def counts(self):
+        """ (minute, orders) of every slot, a snapshot that can be formatted later (see format_counts) """
+        return [(minute, orders) for (minute, (orders, _)) in self.slots.items()]
+
+    def __len__(self):
+        return len(self.signals)
+
+    def __repr__(self):
+        return format_counts(self.counts())
+
+
+def format_counts(counts):
+    return ' | '.join(f'{minute // 60:02d}:{minute % 60:02d} {orders}' for (minute, orders) in sorted(counts))
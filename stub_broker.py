@@ -0,0 +1,65 @@
+from threading import Lock
+from random import Random
+from os import getenv
+from broker import Broker
+from utils import clock
+
+"""
+Broker that fills every order at once and settles it on the bot clock, for
+dry runs and replays (BROKER=stub). Results are taken from outcomes (e.g. a
+recorded journal, see replay.py) or drawn with STUB_WIN_RATE otherwise
+"""
+
+STUB_BALANCE = float(getenv('STUB_BALANCE', 1000))
+STUB_PAYOUT = float(getenv('STUB_PAYOUT', 0.92))
+STUB_WIN_RATE = float(getenv('STUB_WIN_RATE', 0.6))
+# seed of the drawn results (random if empty)
+STUB_SEED = getenv('STUB_SEED')
+
+
+class StubBroker(Broker):
+    workers = 4
+    # (pair, minute the order was placed in) -> 'win' or 'loss'
+    outcomes = {}
+
+    def __init__(self, balance=STUB_BALANCE, payout=STUB_PAYOUT, win_rate=STUB_WIN_RATE, seed=STUB_SEED):
+        self.orders = []
+        self.lock = Lock()
+        self.balance = balance
+        self.payout = payout
+        self.win_rate = win_rate
+        self.random = Random(int(seed) if seed else None)
+
+    def buy(self, amount, pair, action, timeframe):
+        with self.lock:
+            if amount > self.balance:
+                return False, None
+            self.balance -= amount
+            self.orders.append({'amount': amount, 'active': pair, 'direction': action,
+                                'time': clock.time(), 'timeframe': timeframe})
+            return True, len(self.orders) - 1
+
+    def check_binary_order(self, id):
+        order = self.orders[id]
+        clock.sleep(order['time'] + order['timeframe'] * 60 - clock.time())
+
+        with self.lock:
+            if 'result' not in order:
+                result = self.outcomes.get(
+                    (order['active'], int(order['time'] // 60)))
+                if result is None:
+                    result = 'win' if self.random.random() < self.win_rate else 'loss'
+                order['result'] = result
+                order['profit_amount'] = round(
+                    order['amount'] * (1 + self.payout), 2) if result == 'win' else 0
+                self.balance += order['profit_amount']
+        return order
+
+    def get_balance(self, fresh=False):
+        return round(self.balance, 2)
+
+    def restart(self, update_token=False):
+        pass
+
+    def quit(self):
+        pass
@@ -0,0 +1,182 @@
+from os import getenv, cpu_count
+from argparse import ArgumentParser
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from time import perf_counter
+import csv
+import numpy as np
+from dotenv import load_dotenv
+from backtest import load_signals, cached, as_signals, simulate, max_drawdown, group_starts, Params, Signals, RULES, WIN, LOSS
+from simulator import signals_path
+
+load_dotenv()
+
+"""
+Simulates every combination of a grid of risk parameters over a signal
+history and writes them ranked by final balance.
+
+Values are given as a list ("0.01,0.02") or an inclusive range
+("0.01:0.05:0.01"), e.g.
+
+python sweep.py signals.txt --base-order 0.01:0.05:0.01 --max-gales 0:2 --stop-win 0,0.1
+"""
+
+# combinations sent to a worker at a time
+CHUNK_SIZE = int(getenv('SWEEP_CHUNK_SIZE', 64))
+
+FIELDS = ['base_order', 'gale_rate', 'payout', 'max_gales',
+          'soros_holding', 'max_soros', 'cycle_loss', 'stop_win', 'stop_loss']
+
+# signals attached by every worker: (Signals, group starts, shared memory blocks)
+shared = None
+
+
+def parse_values(spec, type=float):
+    """ Parses "a,b,c" or "start:stop[:step]" (inclusive) into a list of values """
+    if ':' not in spec:
+        return [type(value) for value in spec.split(',')]
+    parts = [float(part) for part in spec.split(':')]
+    (start, stop, step) = parts if len(parts) == 3 else (*parts, 1)
+    values = np.arange(start, stop + step / 2, step)
+    return [type(round(value, 10)) for value in values]
+
+
+def share(arrays):
+    """ Copies the arrays to shared memory, returning (blocks, specs to attach them) """
+    blocks, specs = [], []
+    for array in arrays:
+        block = shared_memory.SharedMemory(
+            create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        specs.append((block.name, array.dtype.str, array.shape))
+    return blocks, specs
+
+
+def open_shared(specs):
+    """ Arrays of the shared memory blocks of share, and the blocks (which must be kept open) """
+    blocks = [shared_memory.SharedMemory(name=name) for (name, _, _) in specs]
+    arrays = [np.ndarray(shape, dtype, buffer=block.buf)
+              for (block, (_, dtype, shape)) in zip(blocks, specs)]
+    return arrays, blocks
+
+
+def attach(specs):
+    """ Maps the signals in a worker, from the cache file (a path) or shared memory blocks """
+    global shared
+    if isinstance(specs, str):
+        signals = as_signals(np.load(specs, mmap_mode='r'))
+        shared = (signals, group_starts(signals), [])
+        return
+    (arrays, blocks) = open_shared(specs)
+    shared = (Signals(*arrays[:-1]), arrays[-1], blocks)
+
+
+def evaluate(combinations, balance, rules):
+    (signals, starts, _) = shared
+    rows = []
+    # aggressive combinations may compound past the float range
+    with np.errstate(over='ignore', invalid='ignore'):
+        for params in combinations:
+            result = simulate(signals, Params(*params),
+                              balance, starts, rules)
+            days = max(len(result.stops), 1)
+            rows.append((*params, result.final_balance, max_drawdown(result, balance),
+                         int((result.stops == WIN).sum()) / days, int((result.stops == LOSS).sum()) / days))
+    return rows
+
+
+def sweep(signals, grid, balance=1000.0, workers=None, chunk_size=CHUNK_SIZE, cache_path=None, rules=RULES):
+    """
+    Simulates every combination of the grid (field -> values) in a process
+    pool, returning rows of (*params, final balance, max drawdown, stop win
+    frequency, stop loss frequency) ranked by final balance.
+
+    Workers memory-map the cache_path of the signals when given, otherwise
+    the signals are copied once to shared memory
+    """
+    combinations = list(product(*(grid[field] for field in FIELDS)))
+    chunks = [combinations[i:i + chunk_size]
+              for i in range(0, len(combinations), chunk_size)]
+
+    # workers read the signals from the cache or shared memory instead of a pickled copy each
+    blocks, specs = ([], cache_path) if cache_path else share(
+        [*signals, group_starts(signals)])
+    try:
+        with ProcessPoolExecutor(max_workers=workers or cpu_count(), initializer=attach, initargs=(specs,)) as executor:
+            rows = [row for chunk in executor.map(evaluate, chunks, [balance] * len(chunks), [rules] * len(chunks))
+                    for row in chunk]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    # combinations that blew up (nan) go last
+    rows.sort(key=lambda row: row[len(FIELDS)] if row[len(FIELDS)] == row[len(FIELDS)] else -np.inf,
+              reverse=True)
+    return rows
+
+
+def parse_args(args=None):
+    parser = ArgumentParser(
+        description='Simulates a grid of risk parameters over a signal history')
+    parser.add_argument('signals', nargs='?', default='signals.txt')
+    parser.add_argument('--balance', type=float, default=1000)
+    parser.add_argument('--base-order', default=getenv('BASE_ORDER', '0.02'))
+    parser.add_argument('--gale-rate', default=getenv('GALE_RATE', '2.2'))
+    parser.add_argument('--payout', default=getenv('PAYOUT', '0.8'))
+    parser.add_argument('--max-gales', default=getenv('MAX_GALES', '1'))
+    parser.add_argument('--soros-holding',
+                        default=getenv('SOROS_HOLDING', '0.1'))
+    parser.add_argument('--max-soros', default=getenv('MAX_SOROS', '3'))
+    parser.add_argument('--cycle-loss', default='False',
+                        help='True, False or both (True,False)')
+    parser.add_argument('--stop-win', default=getenv('STOP_WIN', '0'))
+    parser.add_argument('--stop-loss', default=getenv('STOP_LOSS', '0'))
+    parser.add_argument('--rules', choices=['live', 'legacy'], default=RULES)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default='sweep.csv')
+    parser.add_argument('--top', type=int, default=10,
+                        help='rows printed to the console')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    grid = {
+        'base_order': parse_values(args.base_order),
+        'gale_rate': parse_values(args.gale_rate),
+        'payout': parse_values(args.payout),
+        'max_gales': parse_values(args.max_gales, int),
+        'soros_holding': parse_values(args.soros_holding),
+        'max_soros': parse_values(args.max_soros, int),
+        'cycle_loss': parse_values(args.cycle_loss, lambda value: value == 'True'),
+        'stop_win': parse_values(args.stop_win),
+        'stop_loss': parse_values(args.stop_loss),
+    }
+
+    source = signals_path(args.signals)
+    signals = load_signals(source)
+    start = perf_counter()
+    rows = sweep(signals, grid, args.balance,
+                 args.workers, cache_path=cached(source), rules=args.rules)
+    elapsed = perf_counter() - start
+
+    header = ['rank', *FIELDS, 'final_balance', 'max_drawdown',
+              'stop_win_frequency', 'stop_loss_frequency']
+    with open(args.output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for rank, row in enumerate(rows, 1):
+            writer.writerow([rank, *row])
+
+    print(' | '.join(header))
+    for rank, row in enumerate(rows[:args.top], 1):
+        print(' | '.join([str(rank), *(str(value) for value in row[:len(FIELDS)]),
+                          *('{:.4f}'.format(value) for value in row[len(FIELDS):])]))
+    print(f'\nSimulated {len(rows)} combinations of {len(signals.slot)} signals in {elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
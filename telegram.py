@@ -3,10 +3,15 @@ from telethon import TelegramClient
 from dotenv import load_dotenv
 from os import getenv
 import re
-from datetime import timedelta, datetime
+from datetime import timedelta
 from time import localtime
 from debug import log
+import journal
+from journal import time_of
+from tracing import tracer
 from json import load
+from signals import parse_signal
+from dispatch import dispatcher
 
 load_dotenv()
 
@@ -21,77 +26,16 @@ client = TelegramClient('tradingbot', api_id, api_hash).start(
 CHANNELS = [{**channel, 'id': PeerChannel(channel_id=channel['id'])}
             for channel in load(open('telegram_channels.json', 'r'))]
 
+for channel in CHANNELS:
+    dispatcher.add({**channel, 'id': channel['id'].channel_id})
 
-def get_message_options(message):
-    """
-    Parses a telegram message and retrieves all information necessary for scheduling a trade
 
-    Obs: this implementation is specific for my scenario. Other message patterns will require changes in this funcion
+def get_message_options(message, channel_id=None):
     """
-
-    action_map = {'COMPRA': 'call', 'VENDA': 'put'}
-    start_time = None
-    pair = None
-    action = None
-    timeframe = None
-
-    log(f'Message received: {message}', False)
-
-    try:
-        start_time = re.search('(\d{2}):(\d{2})', message)
-        if start_time:
-            start_time = f'{start_time.group(1)}:{start_time.group(2)}'
-
-        pair = re.search('Moeda: (\w{6}|\w{3}/\w{3})\n', message)
-        if not pair:
-            pair = re.search('(\w{6});', message)
-
-        if not pair:
-            pair = re.search('(\w{3}/\w{3})\s?', message)
-
-        if not pair:
-            pair = re.search('\s(\w{6})-', message)
-
-        if not pair:
-            pair = re.search('\s(\w{6})\(', message)
-
-        if not pair:
-            pair = re.search('\s(\w{6})\s', message)
-
-        pair = pair.group(1).replace('/', '')
-
-        otc = re.search('(OTC)', message)
-        otc = otc or re.search('-OTC', message)
-
-        if otc:
-            pair += '-OTC'
-
-        action = re.search(';(COMPRA|VENDA)', message)
-        if not action:
-            action = re.search('Sinal - .(COMPRA|VENDA).\n', message)
-        else:
-            action = action_map[action.group(1)]
-
-        if not action:
-            action = re.search('PUT|CALL', message)
-            action = action.group(0).lower()
-
-        timeframe = re.search('Timeframe M(\d)', message)
-        if not timeframe:
-            timeframe = re.search('Expiração(?: M|: )(\d)', message)
-        if timeframe:
-            timeframe = int(timeframe.group(1))
-        else:
-            timeframe = 5
-
-    except Exception as e:
-        log(f'Error while parsing message: {e}', False)
-        return None
-
-    log(
-        f'Parsed pair, action, start time and timeframe: {(pair, action, start_time, timeframe)}', False)
-
-    return (pair, action, start_time, timeframe)
+    Parses a telegram message and retrieves all information necessary for scheduling a trade,
+    as a Signal (pair, action, start_time, timeframe), using the parser registered for the channel
+    """
+    return parse_signal(message, channel_id)
 
 
 def get_message_options_list(message):
@@ -134,6 +78,8 @@ def get_message_options_list(message):
 def run_command(command):
     commands = {
         'logs': logs,
+        'stats': stats,
+        'latency': latency,
         'stop': stop
     }
 
@@ -144,19 +90,34 @@ def run_command(command):
     return commands[command](*args) if command in commands else None
 
 
-def logs(page=None):
-    limit = 4096
-    page = int(page) if page else 1
-    with open(f'./log-{datetime.today().strftime("%d-%m-%Y")}.txt', 'r', encoding='utf-8') as f:
-        content = f.read()
-        if len(content) > limit:
-            content = content[0 + limit * (page - 1):limit * page]
-            if len(content) == limit:
-                return content[:-3] + '...'
-            else:
-                return content
-        else:
-            return content
+def logs(*args):
+    """
+    Page of the day's event journal: bot:logs [page] [channel=..] [pair=..]
+    [result=win|loss] [type=signal|order|result|error] [since=HH:MM] [until=HH:MM]
+    """
+    number = 1
+    filters = {}
+    try:
+        for arg in args:
+            if arg.isdigit():
+                number = int(arg)
+            elif '=' in arg:
+                (key, value) = arg.split('=', 1)
+                if key in ('since', 'until'):
+                    value = time_of(value)
+                filters[key] = value
+        return journal.page(number, **filters)
+    except (TypeError, KeyError, ValueError) as e:
+        return f'Invalid filter: {e}'
+
+
+def stats():
+    return dispatcher.report()
+
+
+def latency():
+    """ Percentiles of every stage between a signal and its order """
+    return tracer.report()
 
 
 def stop():
@@ -0,0 +1,13 @@
+import os
+import pytest
+import debug
+
+
+@pytest.fixture(autouse=True, scope='session')
+def workdir(tmp_path_factory):
+    """ Runs the tests in a temporary folder, where the log and journal files of the day are written """
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('run'))
+    yield
+    debug.stop_writer()
+    os.chdir(cwd)
@@ -0,0 +1,38 @@
+from dispatch import ChannelDispatcher
+from signals import Signal
+
+CHANNELS = [
+    {'id': 9001, 'pattern': '.*;(COMPRA|VENDA).*',
+     'signal': '(?P<pair>\\w{6});(?P<hour>\\d{2}):(?P<minute>\\d{2});(?P<action>COMPRA|VENDA)(?:.*M(?P<timeframe>\\d))?',
+     'timeframe': 5},
+    {'id': 9002, 'pattern': '.*'},
+]
+
+
+def dispatcher():
+    channels = ChannelDispatcher()
+    for channel in CHANNELS:
+        channels.add(channel)
+    return channels
+
+
+def test_messages_use_their_channel_parser():
+    channels = dispatcher()
+    assert channels.dispatch(9001, 'EURUSD;10:05;COMPRA M1') == Signal('EURUSD', 'call', '10:05', 1)
+    assert channels.dispatch(9001, 'GBPJPY;10:06;VENDA') == Signal('GBPJPY', 'put', '10:06', 5)
+    assert channels.dispatch(9002, 'EUR/USD PUT 10:07 Expiração M1') == Signal('EURUSD', 'put', '10:07', 1)
+
+
+def test_chatter_is_filtered_before_parsing():
+    channels = dispatcher()
+    assert channels.dispatch(9001, 'Good morning!') is None
+    assert channels.dispatch(9002, 'Good morning!') is None
+    assert channels.counters[9001] == {'received': 1, 'filtered': 1, 'parsed': 0}
+    assert channels.counters[9002] == {'received': 1, 'filtered': 0, 'parsed': 0}
+
+
+def test_unknown_channel_is_counted():
+    channels = dispatcher()
+    channels.dispatch(42, 'EURUSD;10:05;COMPRA')
+    assert channels.counters[42]['received'] == 1
+    assert '42: 1 received' in channels.report()
@@ -0,0 +1,67 @@
+from datetime import datetime
+import pytest
+import journal
+from journal import Journal, query, read_events, page, journal_paths, INDEX
+from utils import CustomTZ
+
+DAY = datetime(2024, 3, 5, 12, 0, tzinfo=CustomTZ())
+START = DAY.timestamp()
+
+EVENTS = [
+    ('signal', 101, 'EURUSD', None, {'action': 'call'}),
+    ('order', 101, 'EURUSD', None, {'amount': 20.0}),
+    ('signal', 202, 'GBPJPY', None, {'action': 'put'}),
+    ('result', 101, 'EURUSD', 'win', {'profit': 16.0}),
+    ('error', None, None, None, {'message': 'Buy Error: ünïcode'}),
+    ('result', 202, 'GBPJPY', 'loss', {'profit': -20.0}),
+]
+
+
+@pytest.fixture()
+def written(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    events = Journal()
+    for (i, (type, channel, pair, result, fields)) in enumerate(EVENTS):
+        events.write(START + i, type, channel, pair, result, fields)
+    events.close()
+    return events
+
+
+def test_index_round_trip(written):
+    entries = query(DAY)
+    assert len(entries) == len(EVENTS)
+    events = read_events(entries, DAY)
+    assert [(event['type'], event['channel'], event['pair'], event['result']) for event in events] == \
+        [event[:4] for event in EVENTS]
+    assert events[4]['message'] == 'Buy Error: ünïcode'
+    assert list(entries['time']) == [START + i for i in range(len(EVENTS))]
+
+
+def test_filters(written):
+    assert [event['profit'] for event in read_events(query(DAY, type='result'), DAY)] == [16.0, -20.0]
+    assert len(query(DAY, channel=202)) == 2
+    assert len(query(DAY, pair='eurusd')) == 3
+    assert [event['pair'] for event in read_events(query(DAY, result='LOSS'), DAY)] == ['GBPJPY']
+    assert len(query(DAY, since=START + 2, until=START + 4)) == 2
+
+
+def test_partial_record_is_ignored(written):
+    (_, index_path) = journal_paths(DAY)
+    with open(index_path, 'ab') as f:
+        f.write(b'\0' * (INDEX.size // 2))
+    assert len(query(DAY)) == len(EVENTS)
+
+
+def test_missing_day(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert len(query(DAY)) == 0
+    assert read_events(query(DAY), DAY) == []
+
+
+def test_page(written, monkeypatch):
+    monkeypatch.setattr(journal, 'PAGE_SIZE', 4)
+    text = page(2, DAY)
+    lines = text.split('\n')
+    assert lines[0] == 'Page 2/2 (6 events)'
+    assert len(lines) == 3
+    assert lines[1].endswith('ERROR message=Buy Error: ünïcode')
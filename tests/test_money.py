@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from money import MoneyManager, BASE, GALE, SOROS, CYCLE
+from backtest import simulate_live, Params, Signals, WIN
+
+
+def test_base_amount():
+    money = MoneyManager(base_order=0.02)
+    assert money.base_amount(1000) == 20
+    # split between the orders of the same time, never under $1
+    assert money.base_amount(1000, 4) == 5
+    assert money.base_amount(10) == 1
+    assert money.take_amount() == (None, BASE)
+
+
+def test_direct_win_enables_soros():
+    money = MoneyManager(base_order=0.02, soros_holding=0.1, max_soros=1, cycle_loss=False)
+    assert money.needs_balance(True, 0)
+    assert money.on_result(True, 20, 0, BASE, profit=16, balance=1016) is None
+    assert money.take_amount() == (pytest.approx(32.4), SOROS)
+    # SOROS wins don't compound past max_soros
+    money.on_result(True, 32.4, 0, SOROS, profit=25.92, balance=1041.92)
+    assert money.take_amount() == (None, BASE)
+    assert money.soros_count == 0
+
+
+def test_gale_then_cycle_loss():
+    money = MoneyManager(gale_rate=2.2, max_gales=1, cycle_loss=True)
+    assert money.on_result(False, 20, 0, BASE, balance=980) == 44
+    assert money.on_result(False, 44, 1, GALE, balance=936) is None
+    # every stake of the position is recovered by the next order
+    assert money.take_amount() == (64, CYCLE)
+    assert money.take_amount() == (None, BASE)
+
+
+def test_no_gale_past_max_gales():
+    money = MoneyManager(max_gales=0, cycle_loss=False)
+    assert money.on_result(False, 20, 0, BASE, balance=980) is None
+    assert money.take_amount() == (None, BASE)
+
+
+def test_check_stop():
+    money = MoneyManager(stop_win=0.1, stop_loss=0.05)
+    assert money.check_stop(2000) is None
+    money.start_day(1000)
+    assert money.check_stop(1099) is None
+    assert money.check_stop(1100) == 'WIN'
+    assert money.check_stop(950) == 'LOSS'
+
+
+def drive(signals, params, balance):
+    """ Balance change of every signal, with one order placed and settled at a time like the bot does """
+    money = MoneyManager(params.base_order, params.gale_rate, params.max_gales, params.soros_holding,
+                         params.max_soros, params.cycle_loss, params.stop_win, params.stop_loss)
+    changes = []
+    (day, stopped) = (-1, False)
+    for i in range(len(signals.slot)):
+        if signals.day[i] != day:
+            day = signals.day[i]
+            money.start_day(balance)
+            stopped = False
+        change = 0.0
+        if not stopped:
+            (amount, kind) = money.take_amount()
+            if amount is None:
+                amount = money.base_amount(balance)
+            attempt = 0
+            while amount is not None:
+                won = signals.result[i] == WIN and signals.gales[i] == attempt
+                profit = amount * params.payout if won else 0.0
+                balance += profit if won else -amount
+                change += profit if won else -amount
+                amount = money.on_result(won, amount, attempt, kind, profit, balance)
+                if money.check_stop(balance):
+                    stopped = True
+                    amount = None
+                attempt += 1
+        changes.append(change)
+    return np.array(changes), balance
+
+
+@pytest.mark.parametrize('params', [
+    Params(),
+    Params(cycle_loss=True),
+    Params(max_gales=2, max_soros=2, cycle_loss=True, stop_win=0.08, stop_loss=0.1),
+    Params(max_gales=0, stop_loss=0.05),
+])
+def test_simulate_live_matches_the_bot(params):
+    rng = np.random.default_rng(11)
+    (days, per_day) = (15, 30)
+    n = days * per_day
+    # a signal per start time, so orders never share their amount
+    signals = Signals(
+        pair=np.full(n, b'EURUSD', 'S10'),
+        slot=np.tile(np.arange(per_day) * 10, days).astype(np.int16),
+        action=np.zeros(n, np.int8),
+        result=(rng.random(n) < 0.8).astype(np.int8),
+        gales=rng.choice(3, n, p=[.75, .2, .05]).astype(np.int8),
+        day=np.repeat(np.arange(days), per_day).astype(np.int32))
+
+    (changes, final) = drive(signals, params, 1000.0)
+    result = simulate_live(signals, params, 1000.0)
+    assert result.pnl == pytest.approx(changes)
+    assert result.final_balance == pytest.approx(final)
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from backtest import simulate, group_starts, Params, Signals, WIN, LOSS, SKIPPED
+from montecarlo import Outcomes, Paths, Stops, legacy_kernel, live_kernel
+
+PARAMS = [
+    Params(),
+    Params(cycle_loss=True),
+    Params(cycle_loss=True, stop_win=0.1, stop_loss=0.12),
+    Params(max_gales=2, max_soros=1, stop_win=0.05),
+    Params(max_gales=0),
+    # goes broke
+    Params(base_order=0.2, gale_rate=3, cycle_loss=True),
+]
+
+
+class Replayed(Outcomes):
+    """ The outcome codes of every path, fixed instead of sampled """
+
+    def __init__(self, codes, params):
+        super().__init__(np.zeros(len(codes), np.int32), np.arange(6, dtype=np.int8)[None],
+                         codes.shape[1], None, params)
+        self.codes = codes
+
+    def __call__(self, i):
+        return self.codes[i]
+
+
+@pytest.fixture(scope='module')
+def history():
+    rng = np.random.default_rng(7)
+    (days, per_day) = (20, 40)
+    n = days * per_day
+    signals = Signals(
+        pair=rng.choice([b'EURUSD', b'GBPJPY'], n).astype('S10'),
+        # repeated start times form groups sharing their amount
+        slot=np.tile(np.sort(rng.integers(0, 1400, per_day)), days).astype(np.int16),
+        action=rng.integers(0, 2, n).astype(np.int8),
+        result=np.zeros(n, np.int8),
+        gales=np.zeros(n, np.int8),
+        day=np.repeat(np.arange(days), per_day).astype(np.int32))
+    codes = rng.choice(6, (n, 16), p=[.1, .03, .02, .65, .15, .05]).astype(np.int8)
+    return signals, codes
+
+
+@pytest.mark.parametrize('params', PARAMS)
+@pytest.mark.parametrize('rules', ['legacy', 'live'])
+def test_kernels_match_backtest(history, rules, params):
+    (signals, codes) = history
+    starts = group_starts(signals)
+    paths = Paths(codes.shape[1], 1000.0)
+    stops = Stops()
+    kernel = live_kernel if rules == 'live' else legacy_kernel
+    with np.errstate(all='ignore'):
+        kernel(Replayed(codes, params), starts, signals.day[starts], signals.slot[starts].astype(np.int64),
+               len(signals.slot), params, paths, stops)
+
+    days = [0, 0]
+    for path in range(codes.shape[1]):
+        replayed = signals._replace(result=(codes[:, path] // 3).astype(np.int8),
+                                    gales=(codes[:, path] % 3).astype(np.int8))
+        result = simulate(replayed, params, 1000.0, starts, rules)
+        assert paths.balance[path] == pytest.approx(result.final_balance, rel=1e-9, abs=1e-9)
+        assert paths.broke[path] == (result.final_balance == 0)
+        days[0] += int((result.stops == WIN).sum())
+        days[1] += int((result.stops == LOSS).sum())
+    assert stops.days == days
+
+
+def test_balance_stops_at_zero(history):
+    (signals, codes) = history
+    replayed = signals._replace(result=(codes[:, 0] // 3).astype(np.int8), gales=(codes[:, 0] % 3).astype(np.int8))
+    for rules in ('legacy', 'live'):
+        result = simulate(replayed, PARAMS[-1], 1000.0, rules=rules)
+        assert result.final_balance == 0
+        assert result.balance[-1] == pytest.approx(0, abs=1e-6)
+        # every signal after going broke is skipped
+        assert result.result[-1] == SKIPPED
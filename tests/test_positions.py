@@ -0,0 +1,51 @@
+from positions import PositionStore, format_store, NEAR_EXPIRY
+from money import BASE
+
+
+def test_near_expiry_follows_the_open_positions():
+    store = PositionStore()
+    first = store.add(1, 'EURUSD', 'call', 20, 1000, 5, BASE)
+    store.add(2, 'GBPJPY', 'put', 20, 1030, 1, BASE)
+    # the 1 minute order gets near its expiration first
+    assert not store.near_expiry(1030 + 60 * NEAR_EXPIRY - 1)
+    assert store.near_expiry(1030 + 60 * NEAR_EXPIRY)
+    store.close(store.get(2))
+    assert not store.near_expiry(1100)
+    assert store.near_expiry(1000 + 300 * NEAR_EXPIRY)
+    store.close(first)
+    assert len(store) == 0
+    assert store.closed_today == 2
+
+
+def test_gale_moves_the_position():
+    store = PositionStore()
+    position = store.add(1, 'EURUSD', 'call', 20, 1000, 5, BASE)
+    store.gale(position, 7, 44)
+    assert store.get(7) is position and store.get(1) is position
+    assert (position.id, position.amount) == (7, 44)
+    store.close(position)
+    store.close(position)
+    assert store.closed_today == 1
+
+
+def test_archive_closed():
+    store = PositionStore(archive_size=1)
+    for id in range(3):
+        store.add(id, 'EURUSD', 'call', 20, 1000 + id, 5, BASE)
+    store.close(store.get(0))
+    store.close(store.get(1))
+    store.archive_closed()
+    # only the newest closed position is kept
+    assert [position.id for position in store.archive] == [1]
+    assert list(store.by_id) == [2]
+    assert store.closed_today == 0
+
+
+def test_snapshot_is_frozen():
+    store = PositionStore()
+    position = store.add(1, 'EURUSD', 'call', 20, 1000, 5, BASE)
+    snapshot = store.snapshot()
+    store.gale(position, 2, 44)
+    store.close(position)
+    assert format_store(snapshot) == '1 open, 0 closed today: [Position(1 EURUSD call $20.00 G0 open)]'
+    assert repr(store) == '0 open, 1 closed today: []'
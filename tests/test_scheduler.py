@@ -0,0 +1,111 @@
+import asyncio
+from scheduler import OrderScheduler
+from utils import clock
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def run_tasks():
+    return [task for task in asyncio.all_tasks() if task.get_coro().__name__ == '_run']
+
+
+def test_fires_in_time_order():
+    async def main():
+        scheduler = OrderScheduler()
+        fired = []
+        now = clock.time()
+        for (delay, name) in [(0.06, 'c'), (0.02, 'a'), (0.04, 'b')]:
+            scheduler.schedule(now + delay, lambda name=name: fired.append(name))
+        await asyncio.sleep(0.15)
+        scheduler.stop()
+        return fired, scheduler.pending
+
+    assert run(main()) == (['a', 'b', 'c'], 0)
+
+
+def test_slot_fires_together():
+    async def main():
+        scheduler = OrderScheduler()
+        fired = []
+        now = clock.time()
+        scheduler.schedule(now + 0.02, lambda: fired.append(('a', clock.time())), slot='10:05')
+        scheduler.schedule(now + 10, lambda: fired.append(('b', clock.time())), slot='10:05')
+        scheduler.schedule(now + 10, lambda: fired.append(('c', clock.time())), slot='10:06')
+        await asyncio.sleep(0.1)
+        scheduler.stop()
+        return fired, scheduler.pending
+
+    (fired, pending) = run(main())
+    # the order of the same slot fires with the first one, not 10s later
+    assert [name for (name, _) in fired] == ['a', 'b']
+    assert pending == 1
+
+
+def test_cancel():
+    async def main():
+        scheduler = OrderScheduler()
+        fired = []
+        now = clock.time()
+        id = scheduler.schedule(now + 0.02, lambda: fired.append('a'))
+        scheduler.schedule(now + 0.03, lambda: fired.append('b'))
+        assert scheduler.cancel(id)
+        assert not scheduler.cancel(id)
+        await asyncio.sleep(0.1)
+        scheduler.cancel_all()
+        scheduler.stop()
+        return fired
+
+    assert run(main()) == ['b']
+
+
+def test_coroutines_run_as_tasks():
+    async def main():
+        scheduler = OrderScheduler()
+        fired = []
+
+        async def slow():
+            await asyncio.sleep(0.05)
+            fired.append('slow')
+
+        now = clock.time()
+        scheduler.schedule(now, slow)
+        scheduler.schedule(now + 0.01, lambda: fired.append('fast'))
+        await asyncio.sleep(0.15)
+        scheduler.stop()
+        return fired
+
+    # the slow order doesn't hold the next one
+    assert run(main()) == ['fast', 'slow']
+
+
+def test_failing_order_keeps_running():
+    async def main():
+        scheduler = OrderScheduler()
+        fired = []
+        now = clock.time()
+        scheduler.schedule(now, lambda: 1 / 0)
+        scheduler.schedule(now + 0.01, lambda: fired.append('a'))
+        await asyncio.sleep(0.1)
+        scheduler.stop()
+        return fired
+
+    assert run(main()) == ['a']
+
+
+def test_restart_keeps_one_task():
+    async def main():
+        scheduler = OrderScheduler()
+        fired = []
+        scheduler.schedule(clock.time() + 100, lambda: None)
+        await asyncio.sleep(0)
+        # scheduled again before the stopped task wakes up
+        scheduler.stop()
+        scheduler.schedule(clock.time() + 0.02, lambda: fired.append('a'))
+        await asyncio.sleep(0.1)
+        tasks = len(run_tasks())
+        scheduler.stop()
+        return tasks, fired
+
+    assert run(main()) == (1, ['a'])
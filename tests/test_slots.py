@@ -0,0 +1,47 @@
+from slots import SlotRegistry, SignalKey, minute_of, format_counts
+
+
+def key(pair='EURUSD', action='call', start='10:05', timeframe=5):
+    return SignalKey(pair, action, minute_of(start), timeframe)
+
+
+def test_duplicates_are_dropped():
+    slots = SlotRegistry(window=300)
+    assert slots.register(key(), 1000, 900)
+    assert not slots.register(key(), 1000, 910)
+    assert slots.register(key(action='put'), 1000, 920)
+    assert slots.count(minute_of('10:05'), 930) == 2
+    assert len(slots) == 2
+
+
+def test_signals_and_slots_are_evicted():
+    slots = SlotRegistry(window=300)
+    slots.register(key(), 1000, 900)
+    slots.register(key(pair='GBPJPY', start='10:06'), 1060, 900)
+    assert slots.count(minute_of('10:05'), 1299) == 1
+    # forgotten window seconds after their start time
+    assert slots.count(minute_of('10:05'), 1300) == 0
+    assert slots.register(key(), 2000, 1300)
+    assert slots.count(minute_of('10:06'), 1300) == 1
+    assert slots.count(minute_of('10:06'), 1360) == 0
+
+
+def test_gale_extends_its_slot():
+    slots = SlotRegistry(window=300)
+    slots.register(key(), 1000, 900)
+    slots.add(minute_of('10:05'), 1600)
+    # the signal is forgotten, the slot lives on with both orders
+    assert slots.count(minute_of('10:05'), 1400) == 2
+    assert len(slots) == 0
+    assert slots.count(minute_of('10:05'), 1600) == 0
+
+
+def test_counts_snapshot():
+    slots = SlotRegistry(window=300)
+    slots.register(key(start='10:06'), 1060, 900)
+    slots.register(key(), 1000, 900)
+    slots.register(key(pair='GBPJPY'), 1000, 900)
+    counts = slots.counts()
+    slots.register(key(pair='AUDCAD'), 1000, 900)
+    assert format_counts(counts) == '10:05 2 | 10:06 1'
+    assert repr(slots) == '10:05 3 | 10:06 1'
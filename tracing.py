@@ -0,0 +1,201 @@
+from contextvars import ContextVar
+from itertools import count
+from threading import Lock
+from time import perf_counter, time
+from math import log as ln
+from os import getenv, replace
+import json
+from debug import log, defer
+
+"""
+Signal to fill latency tracing: every signal gets a Trace when its message
+arrives, and each stage it goes through (parse, dedup, schedule, timer fire,
+sizing, executor, driver wait, pair and timeframe selection, click) records
+how long it took on the monotonic clock into a histogram per stage. Result
+detection (expiry to result observed) is recorded per order.
+
+Other stages are recorded by name as well (e.g. how late the schedulers
+fire and the driver queue times of every caller). The percentiles are
+written to TRACE_PATH every TRACE_INTERVAL seconds and shown by bot:latency
+"""
+
+# file the stage percentiles are written to
+TRACE_PATH = getenv('TRACE_PATH', './latency.json')
+# seconds between two writes of TRACE_PATH
+TRACE_INTERVAL = float(getenv('TRACE_INTERVAL', 60))
+
+STAGES = ['parse', 'dedup', 'schedule', 'fire', 'sizing', 'executor', 'driver_wait',
+          'amount_input', 'select_pair', 'select_timeframe', 'click', 'round_trip', 'total', 'result']
+
+# log-spaced buckets from 0.1ms growing 5% each (up to a few hours)
+BUCKET_MIN = 0.0001
+BUCKET_GROWTH = ln(1.05)
+BUCKETS = 400
+
+# trace of the broker call running in the current thread (see traced)
+current = ContextVar('trace', default=None)
+
+
+class Histogram():
+    """ Latency counts in log-spaced buckets, so percentiles cost no stored samples """
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        seconds = max(seconds, 0.0)
+        bucket = 0 if seconds <= BUCKET_MIN else int(
+            ln(seconds / BUCKET_MIN) / BUCKET_GROWTH) + 1
+        self.counts[min(bucket, BUCKETS - 1)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, point):
+        """ Upper bound of the bucket holding the percentile (in seconds) """
+        if self.count == 0:
+            return None
+        target = self.count * point / 100
+        seen = 0
+        for (bucket, amount) in enumerate(self.counts):
+            seen += amount
+            if amount and seen >= target:
+                return min(BUCKET_MIN * 1.05 ** bucket, self.max)
+        return self.max
+
+    def summary(self):
+        """ count, mean, p50, p95, p99 and max in milliseconds """
+        if self.count == 0:
+            return {'count': 0}
+        return {'count': self.count, 'mean': round(self.sum / self.count * 1000, 2),
+                **{f'p{point}': round(self.percentile(point) * 1000, 2) for point in (50, 95, 99)},
+                'max': round(self.max * 1000, 2)}
+
+
+class Trace():
+    """
+    Stages of a single signal. mark closes a stage that started when the last
+    one ended, add records a stage measured elsewhere (e.g. by the page).
+    A stage is only recorded the first time (e.g. the dedup of a scheduled
+    order is not recorded again when it fires)
+    """
+    __slots__ = ('id', 'tracer', 'last', 'elapsed', 'stages')
+
+    def __init__(self, id, tracer):
+        self.id = id
+        self.tracer = tracer
+        self.last = perf_counter()
+        self.elapsed = 0.0
+        self.stages = []
+
+    def mark(self, stage):
+        now = perf_counter()
+        self.record(stage, now - self.last)
+        self.last = now
+
+    def add(self, stage, seconds):
+        self.record(stage, seconds)
+        self.last = perf_counter()
+
+    def split(self, stages, overhead='round_trip'):
+        """
+        Closes several stages measured elsewhere at once ({stage: seconds}),
+        recording the rest of the time since the last stage as overhead
+        """
+        now = perf_counter()
+        for (stage, seconds) in stages.items():
+            self.record(stage, seconds)
+        self.record(overhead, max(now - self.last - sum(stages.values()), 0))
+        self.last = now
+
+    def record(self, stage, seconds):
+        self.elapsed += seconds
+        if any(recorded == stage for (recorded, _) in self.stages):
+            return
+        self.stages.append((stage, seconds))
+        self.tracer.record(stage, seconds)
+
+    def finish(self):
+        """ Records the total of the stages (the wait for the start time is not included) """
+        self.tracer.record('total', self.elapsed + perf_counter() - self.last)
+        # later stages (e.g. the result) must not change the logged ones
+        (id, stages) = (self.id, tuple(self.stages))
+        log(lambda: f'Trace {id}: ' + ' | '.join(
+            f'{stage} {seconds * 1000:.1f}ms' for (stage, seconds) in stages), False)
+
+
+class Tracer():
+    def __init__(self, path=TRACE_PATH, interval=TRACE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.ids = count(1)
+        # stages are recorded from the event loop and from the driver threads
+        self.lock = Lock()
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.written = time()
+
+    def begin(self):
+        return Trace(next(self.ids), self)
+
+    def record(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.add(seconds)
+
+        now = time()
+        if self.path and now - self.written >= self.interval:
+            self.written = now
+            defer(self.dump)
+
+    def summary(self):
+        with self.lock:
+            return {stage: histogram.summary() for (stage, histogram) in self.histograms.items()}
+
+    def dump(self):
+        """ Writes the percentiles of every stage to path (replacing it at once) """
+        data = json.dumps(
+            {'time': time(), 'stages': self.summary()}, indent=2)
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(data)
+        replace(self.path + '.tmp', self.path)
+
+    def report(self):
+        lines = ['stage: count | p50 | p95 | p99 | max (ms)']
+        for (stage, summary) in self.summary().items():
+            if summary['count']:
+                lines.append(
+                    f'{stage}: {summary["count"]} | {summary["p50"]} | {summary["p95"]} | {summary["p99"]} | {summary["max"]}')
+        return '\n'.join(lines) if len(lines) > 1 else 'No latency recorded'
+
+
+tracer = Tracer()
+
+
+def traced(trace, fn, *args, **kwargs):
+    """ Runs fn with trace as the current trace of the thread (the time queued for the thread is recorded as executor) """
+    trace.mark('executor')
+    token = current.set(trace)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        current.reset(token)
+
+
+def mark(stage):
+    """ Closes stage on the trace of the current thread, if any """
+    trace = current.get()
+    if trace is not None:
+        trace.mark(stage)
+
+
+def split(stages):
+    trace = current.get()
+    if trace is not None:
+        trace.split(stages)
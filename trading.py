@@ -1,13 +1,19 @@
-from pocketoption import PocketOption
-from time import time
-from datetime import datetime
+from broker import create_broker
 from dotenv import load_dotenv
 from os import getenv
-from threading import Thread, Timer, enumerate
 from debug import log
-from utils import fmt_order, get_time, normalize_amount, time_until
-from asyncio import set_event_loop
-from typing import Dict, List
+from journal import record
+from tracing import tracer, traced
+from utils import fmt_order, get_time, time_until, timestamp_of, clock
+from scheduler import OrderScheduler
+from results import ResultCollector
+from money import MoneyManager, GALE, SOROS, CYCLE
+from positions import PositionStore, format_store
+from slots import SlotRegistry, SignalKey, minute_of, minute_at, format_counts
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from asyncio import get_event_loop, iscoroutine
+from typing import Dict, Tuple
 
 load_dotenv()
 
@@ -18,6 +24,10 @@ SOFT_TOP = getenv('SOFT_TOP', 'False') == 'True'
 
 DEMO_MODE = getenv('DEMO_MODE', 'True') == 'True'
 
+# trading platform backend: "selenium" (browser), "websocket" (protocol client)
+# or "stub" (instant fills settled on the bot clock, for dry runs and replays)
+BROKER = getenv('BROKER', 'selenium')
+
 # percentage of balance used by orders
 BASE_ORDER = float(getenv('BASE_ORDER', 0.02))
 # how much of order amount will be used for the gale
@@ -34,19 +44,16 @@ STOP_WIN = float(getenv('STOP_WIN', 0.1)) or None
 CYCLE_LOSS = getenv('CYCLE_LOSS', 'True') == 'True'
 # loss needed to stop orders for the day
 STOP_LOSS = float(getenv('STOP_LOSS', 0.12)) or None
+# seconds before a scheduled order to select its pair and timeframe (0 to disable)
+PREARM_SECONDS = float(getenv('PREARM_SECONDS', 10))
+# threads running the blocking broker calls (driver work, result polling)
+DRIVER_WORKERS = int(getenv('DRIVER_WORKERS', 8))
 
 
 class TradingBot():
-    positions = []
     order_queue = []
-    orders_received: Dict[str, List] = {}
-    parsed_orders = {}
-
-    next_soros_amount = None
-    soros_start_balance = None
-    current_soros_count = 0
-    pending_soros = False
-    cycle_loss_amount = None
+    # start time -> (pair, timeframe) of the order that pre-arms the ticket
+    armed: Dict[str, Tuple] = {}
 
     loop = None
     stop_day = None
@@ -55,260 +62,294 @@ class TradingBot():
     def __init__(self, stop_callback=None, loop=None):
         print("Conecting...")
 
-        self.api = PocketOption(POCKET_SSID, DEMO_MODE)
-
-        self.initial_balance = self.api.get_balance()
+        self.api = create_broker(BROKER, POCKET_SSID, DEMO_MODE)
+        self.loop = loop or get_event_loop()
+        # the only threads allowed to block on the broker; everything
+        # else runs as coroutines on the loop
+        self.executor = ThreadPoolExecutor(
+            max(DRIVER_WORKERS, self.api.workers + 2), thread_name_prefix='Driver')
+        self.scheduler = OrderScheduler(loop=self.loop)
+        self.results = ResultCollector(
+            self.api, self.call, after=self.after_results, loop=self.loop)
+        # orders submitted from the message handlers that are still running
+        self.tasks = set()
+        self.positions = PositionStore()
+        # signals received and how many orders start in each minute
+        self.slots = SlotRegistry()
+
+        self.money = MoneyManager(BASE_ORDER, GALE_RATE, MAX_GALES, SOROS_HOLDING, MAX_SOROS,
+                                  CYCLE_LOSS, STOP_WIN, STOP_LOSS)
+        self.money.start_day(self.api.get_balance(fresh=True))
         self.stop_callback = stop_callback
-        self.loop = loop
 
-        print("Balance:", self.initial_balance)
+        print("Balance:", self.money.initial_balance)
         print("##############################")
 
-    def execute_option(self, pair, action, start_time=None, amount=None, gale=False, pos_index=None, expires_in=5):
-        order_format = fmt_order(pair, action, start_time, expires_in)
-        if not order_format in self.parsed_orders:
-            self.parsed_orders[order_format] = True
-        else:
-            log(f'Order {order_format} already queued', False)
-            return
+    async def call(self, fn, *args, trace=None, **kwargs):
+        """ Runs a blocking broker call in the driver executor (with trace as the current trace of its thread) """
+        if trace is not None:
+            return await self.loop.run_in_executor(self.executor, partial(traced, trace, fn, *args, **kwargs))
+        return await self.loop.run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    def submit(self, pair, action, start_time=None, expires_in=5, channel=None, trace=None):
+        """ Runs execute_option as its own task, so the caller never waits on order placement """
+        task = self.loop.create_task(self.execute_option(
+            pair, action, start_time, expires_in=expires_in, channel=channel, trace=trace))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def execute_option(self, pair, action, start_time=None, amount=None, gale=False, position=None, expires_in=5, channel=None, trace=None):
+        # gales are traced from here
+        trace = trace or tracer.begin()
+        now = clock.time()
+        if gale:
+            # a gale is never a duplicate, it only counts in the slot of its minute
+            self.slots.add(minute_at(now), now + self.slots.window)
+            return await self.place(pair, action, amount, gale, position, expires_in, channel, trace)
+
+        (fire_at, minute) = (now, minute_at(now))
         if start_time is not None:
+            # rejected signals must not count in (tomorrow's) slot of their start time
             start_in = time_until(start_time)
             if start_in / 3600 > 9:
                 log(f'Order too late or too soon to be executed', False)
                 return
-            order_fmt = fmt_order(pair, action, start_time, expires_in)
-            if start_time not in self.orders_received:
-                self.orders_received[start_time] = []
-            self.orders_received[start_time].append(order_fmt)
-            t = Timer(start_in, lambda: self.execute_option(
-                pair, action, amount=amount, gale=gale, pos_index=pos_index, expires_in=expires_in))
-            t.name = 'Order ' + order_fmt
-            t.start()
-            return
-
-        try:
-            del self.parsed_orders[fmt_order(
-                pair, action, start_time, expires_in)]
-        except:
-            pass
+            (fire_at, minute) = (timestamp_of(start_time), minute_of(start_time))
 
+        if not self.slots.register(SignalKey(pair, action, minute, expires_in), fire_at, now):
+            log(f'Order {fmt_order(pair, action, start_time, expires_in)} already queued', False)
+            return
+        trace.mark('dedup')
+        if start_time is None:
+            return await self.place(pair, action, amount, gale, position, expires_in, channel, trace)
+
+        order_fmt = fmt_order(pair, action, start_time, expires_in)
+
+        # only the first order of each start time can use the ticket
+        if PREARM_SECONDS > 0 and start_time not in self.armed:
+            self.armed[start_time] = (pair, expires_in)
+            self.scheduler.schedule(fire_at - PREARM_SECONDS, lambda: self.prearm(
+                start_time), name='Pre-arm ' + order_fmt)
+
+        async def fire():
+            # how late the timer fired, the wait for the start time is not latency
+            trace.add('fire', clock.real(max(clock.time() - fire_at, 0)))
+            self.armed.pop(start_time, None)
+            await self.place(pair, action, amount, gale, position, expires_in, channel, trace)
+
+        id = self.scheduler.schedule(
+            fire_at, fire, slot=start_time, name='Order ' + order_fmt)
+        trace.mark('schedule')
+        return id
+
+    async def place(self, pair, action, amount=None, gale=False, position=None, expires_in=5, channel=None, trace=None):
+        """ Places an order that is due now (or queues it while a position is near its expiration) """
         if self.stopped:
             log(f'Ignoring order due to soft stop', False)
             return
-        elif self.stop_day or self.last_order_day is not None and self.last_order_day != datetime.now().day:
-            self.reset()
-        self.last_order_day = datetime.now().day
+        elif self.stop_day or self.last_order_day is not None and self.last_order_day != clock.now().day:
+            await self.reset()
+        self.last_order_day = clock.now().day
         log(f'Executing order: {pair}/{action.upper()}', False)
 
-        # filter pending orders which are 93% of the expiration time in
-        # (e.g. 4m40s if expires in 5min)
-        pending_orders = list(filter(lambda pos: not pos['closed'] and time(
-        ) - pos["time"] >= pos["expires_in"] * 60 * 0.93, self.positions))
-
-        if len(pending_orders) > 0 and not gale:
+        # positions near their expiration may free a SOROS amount
+        if self.positions.near_expiry(clock.time()) and not gale:
             log(f'Order queued: {pair}/{action.upper()}', False)
             # delay order excution to wait possible SOROS use
             def order(): return self.buy(
-                amount, pair, action, gale, pos_index, expires_in)
+                amount, pair, action, gale, position, expires_in, channel, trace)
             self.order_queue.append(order)
             return order
         else:
-            id = self.buy(amount, pair, action, gale, pos_index, expires_in)
+            id = await self.buy(amount, pair, action, gale, position, expires_in, channel, trace)
             return id
 
-    def buy(self, amount, pair, action, gale=False, pos_index=None, expires_in=5):
-        is_soros = False
-        is_cycle_loss = False
-        if self.next_soros_amount:
-            amount = self.next_soros_amount
-            self.next_soros_amount = None
-            is_soros = True
-        elif self.cycle_loss_amount and not gale:
-            amount = self.cycle_loss_amount
-            self.cycle_loss_amount = None
-            is_cycle_loss = True
+    async def buy(self, amount, pair, action, gale=False, position=None, expires_in=5, channel=None, trace=None):
+        trace = trace or tracer.begin()
+        (pending_amount, kind) = self.money.take_amount() if not gale else (amount, GALE)
+        if pending_amount is not None:
+            amount = pending_amount
         else:
-            balance = self.api.get_balance()
+            balance = await self.call(self.api.get_balance)
             if balance is None:
                 log(
                     f'Failed to enter position: {pair}')
+                record('error', channel, pair, error='balance unavailable')
                 return
 
-            now = get_time()
-            log(f'{now} | {self.orders_received}', False)
+            # the writer formats it later, from values taken now
+            (now, counts) = (clock.time(), self.slots.counts())
+            log(lambda: f'{get_time(now)} | {format_counts(counts)}', False)
 
             # split amount equally for all orders schedule for the same time
-            amount = normalize_amount(
-                balance * BASE_ORDER / len(self.orders_received[now]) if not gale else amount)
+            orders = self.slots.count(minute_at(clock.time()), clock.time())
+            amount = self.money.base_amount(balance, max(orders, 1))
 
         log(f'Raw amount: {amount}', False)
+        trace.mark('sizing')
 
-        check, id = self.api.buy(amount, pair, action, expires_in)
+        check, id = await self.call(self.api.buy, amount, pair, action, expires_in, trace=trace)
         if check:
+            trace.finish()
             if not gale:
-                self.positions.append({'id': id, 'pair': pair, 'action': action, 'gales': 0,
-                                       'amount': amount, 'time': time(), 'expires_in': expires_in, 'cycle_loss': is_cycle_loss, 'closed': False})
+                position = self.positions.add(
+                    id, pair, action, amount, clock.time(), expires_in, kind, channel)
             else:
-                self.positions[pos_index]['amount'] = amount
+                self.positions.gale(position, id, amount)
 
             msg = ''
             if gale:
-                msg += f'GALE {self.positions[pos_index]["gales"]}: '
-            elif is_soros:
-                msg += f'SOROS {self.current_soros_count}: '
-                self.pending_soros = False
-            elif is_cycle_loss:
+                msg += f'GALE {position.gales}: '
+            elif kind == SOROS:
+                msg += f'SOROS {self.money.soros_count}: '
+            elif kind == CYCLE:
                 msg += f'CYCLE: '
 
             msg += f'{action.upper()} of ${"{:.2f}".format(amount)} {pair}'
             log(msg)
+            record('order', channel, pair, id=id, action=action, amount=amount, kind=kind,
+                   gales=position.gales, trace=trace.id)
+
+            await self.rearm()
 
-            index = len(self.positions) - 1 if not gale else pos_index
+            order_info = fmt_order(pair, action, 0, expires_in)
 
-            Thread(target=lambda: self.check_gale_for(
-                id, index, order_info=fmt_order(pair, action, 0, expires_in)), name=f'Gale Check ({fmt_order(pair, action, 0, expires_in)})').start()
+            self.results.watch(id, clock.time() + expires_in * 60, lambda order: self.check_gale_for(
+                order, position, order_info=order_info))
 
             return id
         else:
             log(
                 f'Failed to enter position: {pair}')
-
-    def check_gale_for(self, id, index, order_info='Unknown'):
-        order = self.api.check_binary_order(id)
-        position = self.positions[index]
+            record('error', channel, pair, error='order not placed',
+                   action=action, amount=amount)
+
+    async def prearm(self, start_time):
+        if start_time in self.armed and not self.stopped:
+            (pair, expires_in) = self.armed[start_time]
+            await self.call(self.api.prepare, pair, expires_in)
+
+    async def rearm(self):
+        """ Redoes the pre-arm of upcoming orders if another order took over the ticket """
+        now = clock.time()
+        for start_time, (pair, expires_in) in list(self.armed.items()):
+            if 0 < timestamp_of(start_time) - now <= PREARM_SECONDS and not self.api.is_armed(pair, expires_in):
+                log(f'Ticket taken over, pre-arming {pair} again', False)
+                await self.call(self.api.prepare, pair, expires_in)
+
+    async def check_gale_for(self, order, position, order_info='Unknown'):
+        """
+        Applies the result of an order to the money state, returning its GALE
+        (not started yet) so the gales of a batch are placed together
+        """
+        money = self.money
 
         if not order:
             log(f'Failed to verify result for order: {order_info}')
-            position['closed'] = True
-            self.reset_soros()
-        elif order['result'] != 'win':
-            if position['gales'] != MAX_GALES and MAX_GALES >= 1 and (self.current_soros_count == 0 or self.pending_soros):
-                position['gales'] += 1
-
-                if not self.pending_soros:
-                    self.reset_soros()
-
-                now = get_time()
-
-                if now not in self.orders_received:
-                    self.orders_received[now] = []
-                self.orders_received[now].append(
-                    fmt_order(order['active'], order['direction'], now, position["expires_in"]))
-
-                self.execute_option(
-                    order['active'], order['direction'], amount=position['amount'] * GALE_RATE, gale=True, pos_index=index, expires_in=position["expires_in"])
-            else:
-                position['closed'] = True
-                gales_time = position["expires_in"] * 60 * \
-                    MAX_GALES if self.current_soros_count == 0 or self.pending_soros else 0
-                log(f'LOSS for {order["active"]} from {get_time(time() - position["expires_in"] * 60 - gales_time)}')
-
-                self.enable_cycle_loss(position)
-
-                if not self.pending_soros:
-                    self.reset_soros()
+            record('error', position.channel, position.pair,
+                   error='result not verified', id=position.id)
+            self.positions.close(position)
+            money.on_unknown()
         else:
-            position['closed'] = True
-            log(f'WIN for {order["active"]} from {get_time(time() - position["expires_in"] * 60)}')
-            log(
-                f"SOROS check: Pending = {self.pending_soros} | Gales = {position['gales']} | Cycle loss = {position['cycle_loss']} | Current SOROS = {self.current_soros_count} | Max SOROS = {MAX_SOROS}", False)
-            if not self.pending_soros:
-                # enables SOROS if direct WIN
-                if position['gales'] == 0 and not position['cycle_loss'] and self.current_soros_count < MAX_SOROS:
-                    self.next_soros_amount = normalize_amount(
-                        order['profit_amount'] * (1 - SOROS_HOLDING))
-                    self.current_soros_count += 1
-                    self.pending_soros = True
-                    self.soros_start_balance = self.api.get_balance(
-                    ) - (order['profit_amount'] - order['amount'])
-                    log(
-                        f'SOROS config: Start balance = {self.soros_start_balance} | Amount  = {self.next_soros_amount}', False)
-                elif self.current_soros_count >= MAX_SOROS:
-                    self.reset_soros()
-
-        if not self.check_stop():
-            for queued_order in self.order_queue:
+            win = order['result'] == 'win'
+            profit = order['profit_amount'] - order['amount'] if win else 0
+            record('result', position.channel, position.pair, 'win' if win else 'loss',
+                   id=position.id, gales=position.gales, amount=position.amount, profit=profit)
+            balance = None
+            if money.needs_balance(win, position.gales, position.kind):
+                # the settled profit must already be in the balance
+                balance = await self.call(self.api.get_balance, fresh=win)
+            gales_time = position.expires_in * 60 * \
+                MAX_GALES if money.soros_count == 0 or money.pending_soros else 0
+
+            gale_amount = money.on_result(
+                win, position.amount, position.gales, position.kind, profit, balance)
+
+            if gale_amount is not None:
+                position.gales += 1
+
+                return self.execute_option(order['active'], order['direction'], amount=gale_amount, gale=True,
+                                           position=position, expires_in=position.expires_in, channel=position.channel)
+            elif not win:
+                self.positions.close(position)
+                log(f'LOSS for {order["active"]} from {get_time(clock.time() - position.expires_in * 60 - gales_time)}')
+                if money.cycle_loss_amount is not None:
+                    log(f'CYCLE LOSS amount: {money.cycle_loss_amount}', False)
+            else:
+                self.positions.close(position)
+                log(f'WIN for {order["active"]} from {get_time(clock.time() - position.expires_in * 60)}')
                 log(
-                    f'Running queued order: {self.order_queue.index(queued_order)}', False)
-                queued_order()
-            self.order_queue = []
-
-    def enable_cycle_loss(self, position):
-        if self.cycle_loss_amount is not None or not CYCLE_LOSS:
-            return
-
-        if self.soros_start_balance is not None:
-            self.cycle_loss_amount = normalize_amount(
-                self.soros_start_balance - self.api.get_balance())
-        else:
-            self.cycle_loss_amount = 0
-            for i in range(MAX_GALES + 1):
-                self.cycle_loss_amount += position['amount'] / \
-                    GALE_RATE ** (MAX_GALES - i)
-            self.cycle_loss_amount = normalize_amount(self.cycle_loss_amount)
-
-        log(f'CYCLE LOSS amount: {self.cycle_loss_amount}', False)
-
-    def reset_soros(self):
-        self.current_soros_count = 0
-        self.next_soros_amount = None
-        self.pending_soros = False
-        self.soros_start_balance = None
-
-    def check_stop(self):
-        current_balance = self.api.get_balance()
+                    f"SOROS check: Pending = {money.pending_soros} | Gales = {position.gales} | Kind = {position.kind} | Current SOROS = {money.soros_count} | Max SOROS = {MAX_SOROS}", False)
+                if money.pending_soros:
+                    log(
+                        f'SOROS config: Start balance = {money.soros_start_balance} | Amount  = {money.next_soros_amount}', False)
+
+    async def after_results(self):
+        """ Checks the stop once per batch of results, then runs the queued orders """
+        if not await self.check_stop():
+            (queued_orders, self.order_queue) = (self.order_queue, [])
+            for index, queued_order in enumerate(queued_orders):
+                log(f'Running queued order: {index}', False)
+                await queued_order()
+
+    async def check_stop(self):
+        current_balance = await self.call(self.api.get_balance)
         if current_balance is None:
             return False
-        stop = False
-        if STOP_WIN is not None and current_balance - self.initial_balance >= self.initial_balance * STOP_WIN:
-            stop = 'WIN'
-
-        if STOP_LOSS is not None and self.initial_balance - current_balance >= self.initial_balance * STOP_LOSS:
-            stop = 'LOSS'
+        stop = self.money.check_stop(current_balance)
 
-        log(self.positions, False)
-        pending_orders = list(
-            filter(lambda pos: not pos['closed'], self.positions))
-        log(pending_orders, False)
+        # only the open positions are listed, so this stays short
+        positions = self.positions.snapshot()
+        log(lambda: f'Positions: {format_store(positions)}', False)
         if stop:
-            if len(pending_orders) == 0:
+            if len(self.positions) == 0:
                 log(f"STOP {stop} reached\nFinal balance: {current_balance}")
-                self.stop_orders(soft=SOFT_TOP)
+                await self.stop_orders(soft=SOFT_TOP)
             else:
-                self.stop_day = datetime.now().day
+                self.stop_day = clock.now().day
             return True
 
-    def stop_orders(self, soft=False, cb=True):
-        if soft:
-            self.stop_day = datetime.now().day
+    def cancel_orders(self, soft=False):
         # cancel all scheduled orders
-        for thread in enumerate():
-            if 'Order' in thread.name:
-                thread.cancel()
-        self.api.quit()
+        self.scheduler.cancel_all()
+        self.armed.clear()
+        if not soft:
+            self.scheduler.stop()
+            self.results.stop()
+
+    async def stop_orders(self, soft=False, cb=True):
+        if soft:
+            self.stop_day = clock.now().day
+        self.cancel_orders(soft)
+        await self.call(self.api.quit)
         if callable(self.stop_callback) and cb and not soft:
-            set_event_loop(self.loop)
-            self.stop_callback()
+            result = self.stop_callback()
+            if iscoroutine(result):
+                await result
 
     def close(self):
+        """ Stops everything once the event loop is no longer running """
         if not self.stop_day:
             log('Closing...')
-            self.stop_orders(False)
+            self.cancel_orders()
+            self.api.quit()
+        self.executor.shutdown(wait=False)
 
-    def reset(self):
-        self.reset_soros()
+    async def reset(self):
         self.stop_day = None
         self.order_queue = []
-        self.api.restart()
-        self.initial_balance = self.api.get_balance()
-        print("Balance:", self.initial_balance)
+        self.positions.archive_closed()
+        await self.call(self.api.restart)
+        self.money.start_day(await self.call(self.api.get_balance, fresh=True))
+        print("Balance:", self.money.initial_balance)
         print("##############################")
 
     @property
     def stopped(self):
-        return self.stop_day is not None and datetime.now().day == self.stop_day
+        return self.stop_day is not None and clock.now().day == self.stop_day
 
 
 # if __name__ == '__main__':
 #     iq = TradingBot()
-#     id = iq.execute_option('GBPUSD', 'put', 100)
+#     id = iq.loop.run_until_complete(iq.execute_option('GBPUSD', 'put', 100))
@@ -1,7 +1,8 @@
-from time import time, strftime
+from time import time, strftime, sleep, perf_counter
+from math import ceil
 from datetime import tzinfo, timedelta, datetime
 from threading import Timer
-from asyncio import set_event_loop
+from asyncio import iscoroutine
 
 
 class CustomTZ(tzinfo):
@@ -20,9 +21,50 @@ class CustomTZ(tzinfo):
         return f"{self.__class__.__name__}()"
 
 
+class Clock():
+    """
+    Time source of the bot. It follows the wall clock unless accelerated,
+    when it starts at a given (e.g. recorded) time and runs speed times
+    faster, shortening every wait accordingly (see replay.py)
+    """
+
+    def __init__(self):
+        self.start = None
+        self.origin = None
+        self.speed = 1
+
+    def accelerate(self, start, speed):
+        self.start = start
+        self.origin = perf_counter()
+        self.speed = speed
+
+    def reset(self):
+        self.start = None
+        self.speed = 1
+
+    def time(self):
+        if self.start is None:
+            return time()
+        return self.start + (perf_counter() - self.origin) * self.speed
+
+    def now(self, tz=None):
+        return datetime.fromtimestamp(self.time(), tz)
+
+    def real(self, seconds):
+        """ Wall clock seconds taken by seconds of this clock """
+        return seconds / self.speed
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            sleep(self.real(seconds))
+
+
+clock = Clock()
+
+
 def fmt_order(pair, action, start_time, timeframe):
     if type(start_time) == int:
-        order_time = datetime.fromtimestamp(time() + start_time, CustomTZ())
+        order_time = datetime.fromtimestamp(clock.time() + start_time, CustomTZ())
         return f'{pair};{action};{order_time.hour}:{order_time.minute if order_time.minute >= 10 else "0" + str(order_time.minute)}:{timeframe}'
     return f'{pair};{action};{start_time}:{timeframe}'
 
@@ -31,7 +73,7 @@ def get_time(t=None):
     if t:
         dt = datetime.fromtimestamp(t, CustomTZ())
     else:
-        dt = datetime.now(CustomTZ())
+        dt = clock.now(CustomTZ())
     return strftime("%H:%M", (1, 0, 0, dt.hour, dt.minute, 0, 0, 0, 0))
 
 
@@ -41,13 +83,19 @@ def normalize_amount(amount):
 
 def time_until(start_time):
     hour, min = start_time.split(':')
-    dt = datetime.now(CustomTZ())
+    dt = clock.now(CustomTZ())
     time_is_equal = int(hour) == dt.hour and int(min) == dt.minute
     duration = timedelta(hours=int(hour), minutes=int(min)) - timedelta(
         hours=dt.hour, minutes=dt.minute, seconds=dt.second) if not time_is_equal else timedelta()
     return duration.seconds
 
 
+def timestamp_of(start_time):
+    """ Returns the epoch time at which the minute start_time (HH:MM) begins """
+    now = clock.time()
+    return now - now % 60 + ceil(time_until(start_time) / 60) * 60
+
+
 class Timeout():
     finish = None
     max_interval = 1
@@ -61,16 +109,21 @@ class Timeout():
         self.loop = loop
 
     def start(self):
-        self.timer = Timer(self.max_interval, lambda: self._stop())
+        if self.loop:
+            # runs finish on the loop itself, so it can use the loop's objects
+            self.timer = self.loop.call_later(
+                clock.real(self.max_interval), self._stop)
+            return
+        self.timer = Timer(clock.real(self.max_interval), lambda: self._stop())
         self.timer.name = 'Disconnection Timeout'
         self.timer.start()
 
     def _stop(self):
         if self.finish is not None:
             self.finished = True
-            if self.loop:
-                set_event_loop(self.loop)
-            self.finish()
+            result = self.finish()
+            if iscoroutine(result):
+                self.loop.create_task(result)
 
     def cancel(self):
         if self.timer: